@@ -0,0 +1,101 @@
+"""
+Benchmark the load-time inference preparation used by Detector(optimize=True) on each
+CNN model: the float model as loaded, with BatchNorm folded into its convolutions, and
+additionally in the channels_last memory format. Inputs are random tensors of the size
+each model sees, and the largest difference from the original outputs is reported.
+
+Usage:
+    python benchmarks/inference_prep_benchmark.py [--models retinaface resmasknet]
+        [--batch-size 8] [--repeats 5] [--device cpu]
+"""
+
+import argparse
+import time
+import torch
+from feat.face_detectors.Retinaface.Retinaface_test import Retinaface
+from feat.face_detectors.FaceBoxes.FaceBoxes_test import FaceBoxes
+from feat.landmark_detectors.mobilefacenet_test import MobileFaceNet
+from feat.landmark_detectors.pfld_compressed_test import PFLDInference
+from feat.landmark_detectors.basenet_test import MobileNet_GDConv
+from feat.emo_detectors.ResMaskNet.resmasknet_test import ResMaskNet
+from feat.identity_detectors.facenet.facenet_test import Facenet
+from feat.utils.inference import fuse_conv_bn, prepare_for_inference
+
+# Model constructor and the size of the images it is run on. Face detectors see one
+# whole frame, the other models a batch of faces
+MODELS = {
+    "retinaface": (lambda device: Retinaface(device=device).net, (480, 640), False),
+    "faceboxes": (lambda device: FaceBoxes(device=device).net, (480, 640), False),
+    "mobilefacenet": (
+        lambda device: MobileFaceNet([112, 112], 136).to(device).eval(),
+        (112, 112),
+        True,
+    ),
+    "pfld": (lambda device: PFLDInference().to(device).eval(), (112, 112), True),
+    "mobilenet": (
+        lambda device: MobileNet_GDConv(136).to(device).eval(),
+        (224, 224),
+        True,
+    ),
+    "resmasknet": (lambda device: ResMaskNet(device=device).model, (224, 224), True),
+    "facenet": (lambda device: Facenet(device=device).model, (112, 112), True),
+}
+
+
+def timeit(fn, repeats):
+    with torch.no_grad():
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def max_diff(expected, output):
+    if isinstance(expected, torch.Tensor):
+        expected, output = [expected], [output]
+    return max((e - o).abs().max().item() for e, o in zip(expected, output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--models", nargs="+", default=list(MODELS))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    for name in args.models:
+        make_model, size, batched = MODELS[name]
+        model = make_model(args.device)
+        x = torch.rand(
+            (args.batch_size if batched else 1, 3) + size, device=args.device
+        )
+        variants = {
+            "float": model,
+            "fused": fuse_conv_bn(model),
+            "fused+channels_last": prepare_for_inference(model, channels_last=True),
+        }
+
+        with torch.no_grad():
+            expected = model(x)
+            diffs = {
+                variant: max_diff(expected, prepared(x))
+                for variant, prepared in variants.items()
+            }
+        times = {
+            variant: timeit(lambda: prepared(x), args.repeats)
+            for variant, prepared in variants.items()
+        }
+        print(
+            f"{name}: "
+            + " | ".join(
+                f"{variant} {times[variant] * 1000:.1f}ms "
+                f"({times['float'] / times[variant]:.2f}x, max diff {diffs[variant]:.1e})"
+                for variant in variants
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the shared batched nms() against the per-image numpy loops it replaced
+(py_cpu_nms for FaceBoxes/Retinaface/img2pose and nms_numpy for MTCNN). Also checks
+that both return the same boxes. "Min" overlap is only used on the few candidates that
+reach MTCNN's last stage, so it is benchmarked on fewer boxes.
+
+Usage:
+    python benchmarks/nms_benchmark.py [--batch-size 8] [--n-boxes 2000]
+        [--n-boxes-min 200] [--repeats 5]
+"""
+
+import argparse
+import time
+import numpy as np
+import torch
+from feat.utils.image_operations import nms
+
+
+def numpy_nms(boxes, scores, threshold, method="IoU"):
+    """Previous greedy numpy implementation, used as the reference"""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        if method == "Min":
+            ovr = inter / np.minimum(areas[i], areas[order[1:]])
+        else:
+            ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(ovr <= threshold)[0] + 1]
+    return keep
+
+
+def make_batch(batch_size, n_boxes, seed=0):
+    """Clustered random boxes, similar to raw detector output on faces"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(50, 600, size=(batch_size, n_boxes, 2))
+    centers = np.round(centers / 60) * 60 + rng.normal(0, 8, size=centers.shape)
+    sizes = rng.uniform(20, 120, size=(batch_size, n_boxes, 1))
+    boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=-1)
+    scores = rng.uniform(size=(batch_size, n_boxes))
+    return boxes.astype(np.float32), scores.astype(np.float32)
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--n-boxes", type=int, default=2000)
+    parser.add_argument("--n-boxes-min", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    for method, threshold, n_boxes in [
+        ("IoU", 0.3, args.n_boxes),
+        ("Min", 0.7, args.n_boxes_min),
+    ]:
+        boxes, scores = make_batch(args.batch_size, n_boxes)
+        flat_boxes = torch.from_numpy(boxes.reshape(-1, 4))
+        flat_scores = torch.from_numpy(scores.reshape(-1))
+        idxs = torch.arange(args.batch_size).repeat_interleave(n_boxes)
+
+        def loop():
+            return [numpy_nms(b, s, threshold, method) for b, s in zip(boxes, scores)]
+
+        def batched():
+            return nms(flat_boxes, flat_scores, threshold, idxs=idxs, method=method)
+
+        keep = batched()
+        expected = [sorted(np.array(k) + i * n_boxes) for i, k in enumerate(loop())]
+        match = sorted(keep.tolist()) == sorted(np.concatenate(expected).tolist())
+
+        loop_time, batched_time = timeit(loop, args.repeats), timeit(
+            batched, args.repeats
+        )
+        print(
+            f"{method}: {args.batch_size} images x {n_boxes} boxes | "
+            f"numpy loop {loop_time * 1000:.1f}ms | batched {batched_time * 1000:.1f}ms | "
+            f"speedup {loop_time / batched_time:.1f}x | same boxes: {match}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Report the accuracy and speed of Detector(quantize=True) against the float models on
+the bundled test images. Faces are detected once with the float detector and both
+detectors run their landmark, emotion and identity models on the same faces, so each
+difference is due to that model's quantization only. The calibration images are
+excluded by default so the report is measured on images the quantized models were not
+calibrated on.
+
+Reported per image and overall:
+    landmarks: mean distance (px) between float and int8 landmarks
+    emotions: max absolute probability difference and top emotion agreement
+    identity: mean cosine similarity between float and int8 embeddings
+
+Usage:
+    python benchmarks/quantization_benchmark.py [--images multi_face.jpg ...]
+        [--repeats 3] [--include-calibration-images]
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import torch
+from torchvision.io import read_image, ImageReadMode
+from feat import Detector
+from feat.utils.io import get_test_data_path
+from feat.utils.quantization import CALIBRATION_IMAGES
+
+IMAGES = [
+    "multi_face.jpg",
+    "BWPictureHuman.jpg",
+] + CALIBRATION_IMAGES
+
+
+def timeit(fn, repeats):
+    output = fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return output, (time.perf_counter() - start) / repeats
+
+
+def flatten(faces):
+    return np.array([face for frame in faces for face in frame], dtype=float)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", nargs="+", default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--include-calibration-images", action="store_true")
+    args = parser.parse_args()
+
+    images = args.images
+    if images is None:
+        images = [
+            image
+            for image in IMAGES
+            if args.include_calibration_images or image not in CALIBRATION_IMAGES
+        ]
+
+    detectors = {
+        "float": Detector(device="cpu"),
+        "int8": Detector(device="cpu", quantize=True),
+    }
+
+    stages = {
+        "landmarks": lambda detector, frame, faces: detector.detect_landmarks(
+            frame, faces
+        ),
+        "emotions": lambda detector, frame, faces: detector.detect_emotions(
+            frame, faces, None
+        ),
+        "identity": lambda detector, frame, faces: detector.detect_identity(
+            frame, faces
+        ),
+    }
+
+    totals = {name: [] for name in ["landmarks", "emotions", "agree", "identity"]}
+    times = {(stage, name): 0.0 for stage in stages for name in detectors}
+    for image in images:
+        frame = read_image(
+            os.path.join(get_test_data_path(), image), mode=ImageReadMode.RGB
+        )
+        frame = frame.unsqueeze(0).float()
+        faces = detectors["float"].detect_faces(frame)
+        if sum(len(frame_faces) for frame_faces in faces) == 0:
+            print(f"{image}: no faces detected, skipping")
+            continue
+
+        outputs = {}
+        for stage, detect in stages.items():
+            for name, detector in detectors.items():
+                outputs[stage, name], elapsed = timeit(
+                    lambda: detect(detector, frame, faces), args.repeats
+                )
+                times[stage, name] += elapsed
+
+        landmarks = [flatten(outputs["landmarks", name]) for name in detectors]
+        landmark_error = np.linalg.norm(landmarks[0] - landmarks[1], axis=-1).mean()
+        emotions = [flatten(outputs["emotions", name]) for name in detectors]
+        emotion_error = np.abs(emotions[0] - emotions[1]).max()
+        agreement = (emotions[0].argmax(1) == emotions[1].argmax(1)).mean()
+        embeddings = [
+            torch.from_numpy(flatten(outputs["identity", name])) for name in detectors
+        ]
+        similarity = (
+            torch.nn.functional.cosine_similarity(*embeddings, dim=1).mean().item()
+        )
+
+        n_faces = len(landmarks[0])
+        totals["landmarks"].extend([landmark_error] * n_faces)
+        totals["emotions"].append(emotion_error)
+        totals["agree"].extend([agreement] * n_faces)
+        totals["identity"].extend([similarity] * n_faces)
+        print(
+            f"{image} ({n_faces} faces): landmarks {landmark_error:.2f}px | "
+            f"emotions max diff {emotion_error:.3f}, top agreement {agreement:.0%} | "
+            f"identity cosine {similarity:.4f}"
+        )
+
+    if totals["emotions"]:
+        print(
+            f"overall: landmarks {np.mean(totals['landmarks']):.2f}px | "
+            f"emotions max diff {np.max(totals['emotions']):.3f}, "
+            f"top agreement {np.mean(totals['agree']):.0%} | "
+            f"identity cosine {np.mean(totals['identity']):.4f}"
+        )
+    for stage in stages:
+        print(
+            f"{stage}: float {times[stage, 'float'] * 1000:.1f}ms | "
+            f"int8 {times[stage, 'int8'] * 1000:.1f}ms | "
+            f"speedup {times[stage, 'float'] / times[stage, 'int8']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
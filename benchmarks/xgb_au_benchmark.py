@@ -0,0 +1,75 @@
+"""
+Benchmark the two prediction engines of the XGB AU model: one xgboost inplace_predict
+call per AU ("xgboost") against evaluating all 20 AU ensembles at once with the
+vectorized NumpyTreeEnsemble ("numpy"). Only the tree evaluation is timed, on random
+features of the right size, and the largest difference in probabilities is reported.
+
+Usage:
+    python benchmarks/xgb_au_benchmark.py [--batch-sizes 1 4 16 64 256 1024]
+        [--repeats 20] [--n-jobs 1]
+"""
+
+import argparse
+import time
+import numpy as np
+from feat.au_detectors.StatLearning.SL_test import XGBClassifier
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64, 256, 1024]
+    )
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    args = parser.parse_args()
+
+    model = XGBClassifier(n_jobs=args.n_jobs, engine="numpy")
+    n_features = {
+        block: model.boosters[au][0].num_features()
+        for block, au in [("upper", "AU1"), ("lower", "AU11"), ("full", "AU4")]
+    }
+    rng = np.random.default_rng(0)
+
+    for batch_size in args.batch_sizes:
+        features = {
+            block: rng.normal(size=(batch_size, n)).astype(np.float32)
+            for block, n in n_features.items()
+        }
+        stacked = np.concatenate(
+            [features["upper"], features["lower"], features["full"]], 1
+        )
+
+        def xgboost_engine():
+            return np.array(
+                [
+                    booster.inplace_predict(
+                        features[model._au_block(au)], iteration_range=iteration_range
+                    )
+                    for au, (booster, iteration_range) in model.boosters.items()
+                ]
+            ).T
+
+        def numpy_engine():
+            return model.ensemble.predict(stacked)
+
+        max_diff = np.abs(xgboost_engine() - numpy_engine()).max()
+        xgboost_time = timeit(xgboost_engine, args.repeats)
+        numpy_time = timeit(numpy_engine, args.repeats)
+        print(
+            f"batch {batch_size}: xgboost {xgboost_time * 1000:.2f}ms | "
+            f"numpy {numpy_time * 1000:.2f}ms | "
+            f"speedup {xgboost_time / numpy_time:.1f}x | max diff {max_diff:.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,11 @@
 
 import numpy as np
 from feat.utils.io import get_resource_path
+from feat.utils.stats import StackedProjection, StackedLinearClassifier
 import joblib
 import pickle
 import os
+import json
 import xgboost as xgb
 
 
@@ -39,13 +41,82 @@ class SVMClassifier:
             os.path.join(get_resource_path(), "all_data_Fullpca_June30.pkl")
         )
 
+        # Every scaler + PCA pair is applied with one matrix product
+        self.projection_pairs = {
+            "upper": (self.scaler_upper, self.pca_model_upper),
+            "lower": (self.scaler_lower, self.pca_model_lower),
+            "full": (self.scaler_full, self.pca_model_full),
+        }
+        self.projection = StackedProjection(self.projection_pairs)
+
         self.classifier = load_classifier(
             os.path.join(get_resource_path(), "svm_60_July2023.pkl")
         )
+        self.aus_list = sorted(self.classifier.keys(), key=lambda x: int(x[2::]))
+
+        # Stack the decision functions of all AUs over the combined
+        # [upper | lower | full | landmarks] features so they are evaluated with one
+        # matrix product
+        n_components = {
+            name: pca.n_components_ for name, (_, pca) in self.projection_pairs.items()
+        }
+        starts = {
+            "upper": 0,
+            "lower": n_components["upper"],
+            "full": n_components["upper"] + n_components["lower"],
+        }
+        n_projected = sum(n_components.values())
+        feature_columns = []
+        for keys in self.aus_list:
+            block = self._au_block(keys)
+            n_landmark_features = (
+                self.classifier[keys].coef_.shape[1] - n_components[block]
+            )
+            feature_columns.append(
+                np.concatenate(
+                    [
+                        starts[block] + np.arange(n_components[block]),
+                        n_projected + np.arange(n_landmark_features),
+                    ]
+                )
+            )
+        self.stacked_classifier = StackedLinearClassifier(
+            [self.classifier[keys] for keys in self.aus_list], feature_columns
+        )
+
+    @staticmethod
+    def _au_block(keys):
+        """
+        helper function to find which face region's features an AU is predicted from
+        """
+        if keys in ["AU1", "AU4", "AU6"]:
+            return "upper"
+        elif keys in ["AU11", "AU12", "AU17"]:
+            return "lower"
+        elif keys in [
+            "AU2",
+            "AU5",
+            "AU7",
+            "AU9",
+            "AU10",
+            "AU14",
+            "AU15",
+            "AU20",
+            "AU23",
+            "AU24",
+            "AU25",
+            "AU26",
+            "AU28",
+            "AU43",
+        ]:
+            return "full"
+        else:
+            raise ValueError("unknown AU detected")
 
-    def detect_au(self, frame, landmarks):
+    def detect_au(self, frame, landmarks, projected=None):
         """
-        Note that here frame is represented by hogs
+        Note that here frame is represented by hogs. projected is an optional output of
+        self.projection(frame), e.g. computed once for several models
         """
         # landmarks = np.array(landmarks)
         # landmarks = landmarks.reshape(landmarks.shape[0]*landmarks.shape[1],landmarks.shape[2],landmarks.shape[3])
@@ -53,54 +124,143 @@ class SVMClassifier:
         landmarks = np.concatenate(landmarks)
         landmarks = landmarks.reshape(-1, landmarks.shape[1] * landmarks.shape[2])
 
-        pca_transformed_upper = self.pca_model_upper.transform(
-            self.scaler_upper.transform(frame)
-        )
-        pca_transformed_lower = self.pca_model_lower.transform(
-            self.scaler_lower.transform(frame)
-        )
-        pca_transformed_full = self.pca_model_full.transform(
-            self.scaler_full.transform(frame)
+        if projected is None:
+            projected = self.projection(frame)
+        features = np.concatenate(
+            (projected["upper"], projected["lower"], projected["full"], landmarks), 1
         )
+        return self.stacked_classifier.predict(features)
 
-        pca_transformed_upper = np.concatenate((pca_transformed_upper, landmarks), 1)
-        pca_transformed_lower = np.concatenate((pca_transformed_lower, landmarks), 1)
-        pca_transformed_full = np.concatenate((pca_transformed_full, landmarks), 1)
-        aus_list = sorted(self.classifier.keys(), key=lambda x: int(x[2::]))
 
-        pred_aus = []
-        for keys in aus_list:
-            if keys in ["AU1", "AU4", "AU6"]:
-                au_pred = self.classifier[keys].predict(pca_transformed_upper)
-            elif keys in ["AU11", "AU12", "AU17"]:
-                au_pred = self.classifier[keys].predict(pca_transformed_lower)
-            elif keys in [
-                "AU2",
-                "AU5",
-                "AU7",
-                "AU9",
-                "AU10",
-                "AU14",
-                "AU15",
-                "AU20",
-                "AU23",
-                "AU24",
-                "AU25",
-                "AU26",
-                "AU28",
-                "AU43",
-            ]:
-                au_pred = self.classifier[keys].predict(pca_transformed_full)
+class NumpyTreeEnsemble:
+    """Evaluates several binary xgboost tree ensembles at once with vectorized numpy
+    traversal. The boosters are parsed once into flat node arrays, so prediction
+    avoids the per-call overhead of the xgboost API, which dominates on the small batches
+    of faces found in a few frames. On batches of several hundred faces xgboost's own
+    predictor is faster.
+
+    Args:
+        boosters (list): xgboost Boosters with a binary:logistic or binary:hinge objective
+        iteration_ranges (list): (begin, end) boosting rounds used by each booster;
+        (0, 0) uses all rounds
+        feature_offsets (list): column of a combined feature matrix where the features
+        of each booster start; default None means all boosters use the same features
+    """
+
+    def __init__(self, boosters, iteration_ranges=None, feature_offsets=None):
+        if iteration_ranges is None:
+            iteration_ranges = [(0, 0)] * len(boosters)
+        if feature_offsets is None:
+            feature_offsets = [0] * len(boosters)
+
+        feature, threshold, left, right, default_left = [], [], [], [], []
+        value, roots, tree_model = [], [], []
+        self.base_margin = np.zeros(len(boosters))
+        self.hinge = np.zeros(len(boosters), dtype=bool)
+        n_nodes = 0
+        for i, (booster, (begin, end), offset) in enumerate(
+            zip(boosters, iteration_ranges, feature_offsets)
+        ):
+            learner = json.loads(booster.save_raw("json"))["learner"]
+            objective = learner["objective"]["name"]
+            base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+            if objective == "binary:logistic":
+                self.base_margin[i] = np.log(base_score / (1 - base_score))
+            elif objective == "binary:hinge":
+                self.base_margin[i] = base_score
+                self.hinge[i] = True
             else:
-                raise ValueError("unknown AU detected")
+                raise ValueError(f"unsupported xgboost objective {objective}")
 
-            pred_aus.append(au_pred)
-        pred_aus = np.array(pred_aus).T
-        return pred_aus
+            model = learner["gradient_booster"]["model"]
+            indptr = model["iteration_indptr"]
+            end = end if end > 0 else len(indptr) - 1
+            for tree in model["trees"][indptr[begin] : indptr[end]]:
+                if any(tree["split_type"]):
+                    raise ValueError("categorical splits are not supported")
+
+                # Leaves point to themselves so every tree can be traversed for the
+                # same number of steps
+                children = np.array(tree["left_children"])
+                is_leaf = children == -1
+                nodes = np.arange(len(children)) + n_nodes
+                left.append(np.where(is_leaf, nodes, children + n_nodes))
+                right.append(
+                    np.where(is_leaf, nodes, np.array(tree["right_children"]) + n_nodes)
+                )
+                feature.append(
+                    np.where(is_leaf, 0, np.array(tree["split_indices"]) + offset)
+                )
+                threshold.append(tree["split_conditions"])
+                default_left.append(np.array(tree["default_left"], dtype=bool))
+                value.append(np.where(is_leaf, tree["split_conditions"], 0))
+                roots.append(n_nodes)
+                tree_model.append(i)
+                n_nodes += len(children)
+
+        self.feature = np.concatenate(feature)
+        self.threshold = np.concatenate(threshold).astype(np.float32)
+        self.left = np.concatenate(left)
+        self.right = np.concatenate(right)
+        self.default_left = np.concatenate(default_left)
+        self.value = np.concatenate(value)
+        self.children = np.stack([self.left, self.right], axis=1).ravel()
+        self.roots = np.array(roots)
+        self.tree_to_model = np.zeros((len(roots), len(boosters)))
+        self.tree_to_model[np.arange(len(roots)), tree_model] = 1
+        self.n_models = len(boosters)
+
+        # Traversing for as many steps as the deepest tree reaches every leaf
+        node, self.depth = self.roots, 0
+        while True:
+            children = np.concatenate([self.left[node], self.right[node]])
+            children = np.unique(children[~np.isin(children, node)])
+            if len(children) == 0:
+                break
+            node = children
+            self.depth += 1
+
+    def predict(self, X):
+        """Predicts the positive class probability of every ensemble
+
+        Args:
+            X (np.ndarray): (n_samples, n_features) features; missing values are nan
+
+        Returns:
+            np.ndarray: (n_samples, n_models) probabilities
+        """
+
+        # xgboost compares features in single precision
+        X = np.asarray(X, dtype=np.float32)
+        has_nan = np.isnan(X).any()
+        offsets = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = np.take(X, offsets + self.feature[node])
+            go_right = x >= self.threshold[node]
+            if has_nan:
+                go_right = np.where(np.isnan(x), ~self.default_left[node], go_right)
+            node = np.take(self.children, 2 * node + go_right)
+
+        # Sum the leaf values of the trees of each ensemble
+        margin = self.value[node] @ self.tree_to_model
+        margin += self.base_margin
+        return np.where(
+            self.hinge, (margin > 0).astype(float), 1 / (1 + np.exp(-margin))
+        )
 
 
 class XGBClassifier:
-    def __init__(self) -> None:
+    def __init__(self, n_jobs=1, engine="xgboost") -> None:
+        """
+        Args:
+            n_jobs (int): number of threads each xgboost booster uses for prediction
+            engine (str): "xgboost" to predict with each booster in turn or "numpy" to
+            evaluate all AU ensembles at once with a NumpyTreeEnsemble
+        """
+        if engine not in ["xgboost", "numpy"]:
+            raise ValueError("engine must be 'xgboost' or 'numpy'")
+        self.engine = engine
         self.scaler_upper, self.pca_model_upper = load_classifier_pkl(
             os.path.join(get_resource_path(), "all_data_Upperscalar_June30.pkl")
         ), load_classifier_pkl(
@@ -119,6 +279,14 @@ class XGBClassifier:
             os.path.join(get_resource_path(), "all_data_Fullpca_June30.pkl")
         )
 
+        # Every scaler + PCA pair is applied with one matrix product
+        self.projection_pairs = {
+            "upper": (self.scaler_upper, self.pca_model_upper),
+            "lower": (self.scaler_lower, self.pca_model_lower),
+            "full": (self.scaler_full, self.pca_model_full),
+        }
+        self.projection = StackedProjection(self.projection_pairs)
+
         self.au_keys = [
             "AU1",
             "AU2",
@@ -142,9 +310,75 @@ class XGBClassifier:
             "AU43",
         ]
 
-    def detect_au(self, frame, landmarks):
+        # Load every booster once and pin its number of threads
+        self.boosters = {}
+        for keys in self.au_keys:
+            classifier = xgb.XGBClassifier()
+            classifier.load_model(
+                os.path.join(get_resource_path(), f"July4_{keys}_XGB.ubj")
+            )
+            booster = classifier.get_booster()
+            booster.set_param({"nthread": n_jobs})
+
+            # Same trees as predict_proba, which stops at the best iteration if any
+            best_iteration = booster.attr("best_iteration")
+            iteration_range = (
+                (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+            )
+            self.boosters[keys] = (booster, iteration_range)
+
+        if self.engine == "numpy":
+            # Features of each AU start at its block in [upper | lower | full]
+            n_features = {
+                block: booster.num_features()
+                for block, (booster, _) in zip(
+                    ["upper", "lower", "full"],
+                    [self.boosters["AU1"], self.boosters["AU11"], self.boosters["AU4"]],
+                )
+            }
+            offsets = {
+                "upper": 0,
+                "lower": n_features["upper"],
+                "full": n_features["upper"] + n_features["lower"],
+            }
+            self.ensemble = NumpyTreeEnsemble(
+                [self.boosters[keys][0] for keys in self.au_keys],
+                iteration_ranges=[self.boosters[keys][1] for keys in self.au_keys],
+                feature_offsets=[
+                    offsets[self._au_block(keys)] for keys in self.au_keys
+                ],
+            )
+
+    @staticmethod
+    def _au_block(keys):
+        """
+        helper function to find which face region's features an AU is predicted from
+        """
+        if keys in ["AU1", "AU2", "AU7"]:
+            return "upper"
+        elif keys in ["AU11", "AU14", "AU17", "AU23", "AU24", "AU26"]:
+            return "lower"
+        elif keys in [
+            "AU4",
+            "AU5",
+            "AU6",
+            "AU9",
+            "AU10",
+            "AU12",
+            "AU15",
+            "AU20",
+            "AU25",
+            "AU28",
+            "AU43",
+        ]:
+            return "full"
+        else:
+            raise ValueError("unknown AU detected")
+
+    def detect_au(self, frame, landmarks, projected=None):
         """
-        Note that here frame is represented by hogs
+        Note that here frame is represented by hogs. projected is an optional output of
+        self.projection(frame), e.g. computed once for several models
         """
 
         # landmarks = np.array(landmarks)
@@ -152,49 +386,33 @@ class XGBClassifier:
         # landmarks = landmarks.reshape(landmarks.shape[0]*landmarks.shape[1],landmarks.shape[2],landmarks.shape[3])
         landmarks = landmarks.reshape(-1, landmarks.shape[1] * landmarks.shape[2])
 
-        pca_transformed_upper = self.pca_model_upper.transform(
-            self.scaler_upper.transform(frame)
-        )
-        pca_transformed_lower = self.pca_model_lower.transform(
-            self.scaler_lower.transform(frame)
-        )
-        pca_transformed_full = self.pca_model_full.transform(
-            self.scaler_full.transform(frame)
-        )
+        if projected is None:
+            projected = self.projection(frame)
+        pca_transformed_upper = np.concatenate((projected["upper"], landmarks), 1)
+        pca_transformed_lower = np.concatenate((projected["lower"], landmarks), 1)
+        pca_transformed_full = np.concatenate((projected["full"], landmarks), 1)
 
-        pca_transformed_upper = np.concatenate((pca_transformed_upper, landmarks), 1)
-        pca_transformed_lower = np.concatenate((pca_transformed_lower, landmarks), 1)
-        pca_transformed_full = np.concatenate((pca_transformed_full, landmarks), 1)
+        features = {
+            "upper": pca_transformed_upper,
+            "lower": pca_transformed_lower,
+            "full": pca_transformed_full,
+        }
+        if self.engine == "numpy":
+            return self.ensemble.predict(
+                np.concatenate(
+                    [features["upper"], features["lower"], features["full"]], 1
+                )
+            )
 
         pred_aus = []
         for keys in self.au_keys:
-            classifier = xgb.XGBClassifier()
-            classifier.load_model(
-                os.path.join(get_resource_path(), f"July4_{keys}_XGB.ubj")
-            )
+            booster, iteration_range = self.boosters[keys]
 
-            if keys in ["AU1", "AU2", "AU7"]:
-                au_pred = classifier.predict_proba(pca_transformed_upper)[:, 1]
-            elif keys in ["AU11", "AU14", "AU17", "AU23", "AU24", "AU26"]:
-                au_pred = classifier.predict_proba(pca_transformed_lower)[:, 1]
-            elif keys in [
-                "AU4",
-                "AU5",
-                "AU6",
-                "AU9",
-                "AU10",
-                "AU12",
-                "AU15",
-                "AU20",
-                "AU25",
-                "AU28",
-                "AU43",
-            ]:
-                au_pred = classifier.predict_proba(pca_transformed_full)[:, 1]
-            else:
-                raise ValueError("unknown AU detected")
-
-            # au_pred = au_pred[:, 1]
+            # inplace_predict returns the probability of the positive class without
+            # building a DMatrix
+            au_pred = booster.inplace_predict(
+                features[self._au_block(keys)], iteration_range=iteration_range
+            )
             pred_aus.append(au_pred)
 
         pred_aus = np.array(pred_aus).T
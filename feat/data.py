@@ -50,6 +50,8 @@ __all__ = [
     "VideoDataset",
     "_inverse_face_transform",
     "_inverse_landmark_transform",
+    "_forward_face_transform",
+    "_forward_landmark_transform",
 ]
 
 
@@ -2200,6 +2202,70 @@ def _inverse_landmark_transform(landmarks, batch_data):
     return out_frame
 
 
+def _forward_face_transform(faces, batch_data):
+    """Helper function to apply the Image Data batch transforms to face bounding boxes
+    given in original image coordinates, e.g., from a previous detection. Inverse of
+    _inverse_face_transform.
+
+    Args:
+        faces (list): list of lists of [x1, y1, x2, y2, score] for each frame
+        batch_data (dict): batch data from Image Data Class
+
+    Returns:
+        transformed list of lists
+    """
+
+    logging.info("applying face transform...")
+
+    out_frame = []
+    for frame, left, top, scale in zip(
+        faces,
+        batch_data["Padding"]["Left"].numpy(),
+        batch_data["Padding"]["Top"].numpy(),
+        batch_data["Scale"].numpy(),
+    ):
+        out_face = []
+        for face in frame:
+            out_face.append(
+                list(
+                    np.append(
+                        np.array(face[:4]) * scale + np.array([left, top, left, top]),
+                        face[4],
+                    )
+                )
+            )
+        out_frame.append(out_face)
+    return out_frame
+
+
+def _forward_landmark_transform(landmarks, batch_data):
+    """Helper function to apply the Image Data batch transforms to facial landmarks
+    given in original image coordinates. Inverse of _inverse_landmark_transform.
+
+    Args:
+        landmarks (list): list of lists of (68, 2) landmark arrays for each frame
+        batch_data (dict): batch data from Image Data Class
+
+    Returns:
+        transformed list of lists
+    """
+
+    logging.info("applying landmark transform...")
+
+    out_frame = []
+    for frame, left, top, scale in zip(
+        landmarks,
+        batch_data["Padding"]["Left"].numpy(),
+        batch_data["Padding"]["Top"].numpy(),
+        batch_data["Scale"].numpy(),
+    ):
+        out_landmark = []
+        for landmark in frame:
+            out_landmark.append(np.asarray(landmark) * scale + np.array([left, top]))
+        out_frame.append(out_landmark)
+    return out_frame
+
+
 class VideoDataset(Dataset):
     """Torch Video Dataset
 
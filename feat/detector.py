@@ -7,7 +7,6 @@ perform detection
 import os
 import numpy as np
 import pandas as pd
-from skimage.feature import hog
 from feat.utils import (
     openface_2d_landmark_columns,
     FEAT_EMOTION_COLUMNS,
@@ -19,14 +18,18 @@ from feat.utils import (
     set_torch_device,
     is_list_of_lists_empty,
 )
-from feat.utils.io import get_resource_path
+from feat.utils.io import get_resource_path, StageMemo
+from feat.tracking import FaceTracker, MotionGate
 from feat.utils.image_operations import (
-    extract_face_from_landmarks,
+    batch_hog,
+    batch_extract_face_from_landmarks,
     extract_face_from_bbox,
     convert_image_to_tensor,
     BBox,
 )
-from feat.utils.stats import cluster_identities
+from feat.utils.stats import cluster_identities, StackedProjection
+from feat.utils.quantization import calibration_faces, quantize_model
+from feat.utils.inference import prepare_for_inference, TracedModelCache
 from feat.pretrained import get_pretrained_models, fetch_model, AU_LANDMARK_MAP
 from feat.data import (
     Fex,
@@ -34,18 +37,59 @@ from feat.data import (
     VideoDataset,
     _inverse_face_transform,
     _inverse_landmark_transform,
+    _forward_face_transform,
+    _forward_landmark_transform,
 )
 import torch
+import torch.multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from torch.utils.data import DataLoader
 from torchvision.transforms import Compose, Normalize, Grayscale, ToTensor
 import logging
 import warnings
 from tqdm import tqdm
-import torchvision.transforms as transforms
+from collections import deque, defaultdict
 
 # Supress sklearn warning about pickled estimators and diff sklearn versions
 warnings.filterwarnings("ignore", category=UserWarning, module="sklearn")
 
+# Detector instance owned by each worker process when a Detector uses n_jobs > 1, or
+# the error raised while building it
+_worker_detector = None
+_worker_error = None
+
+
+def _init_worker(detector_kwargs, num_threads):
+    """Initializer for the worker processes used when n_jobs > 1. Each worker builds
+    its own copy of the requested models exactly once and reuses it for every batch
+    it receives.
+
+    Args:
+        detector_kwargs (dict): keyword arguments used to construct the parent Detector
+        num_threads (int): number of intra-op torch threads each worker may use
+    """
+    global _worker_detector, _worker_error
+    torch.set_num_threads(num_threads)
+    # An initializer that raises only breaks the pool without saying why, so the error
+    # is kept and raised by the first batch the worker receives instead
+    try:
+        _worker_detector = Detector(n_jobs=1, **detector_kwargs)
+    except Exception as e:
+        _worker_error = RuntimeError(
+            f"Detector could not be built in worker process: {type(e).__name__}: {e}"
+        )
+
+
+def _run_worker_batch(batch_data, frame_counter, detection_kwargs):
+    """Runs detection on a single batch inside a worker process. Image tensors arrive
+    through shared memory so only their handles are pickled."""
+    if _worker_error is not None:
+        raise _worker_error
+    # Workers get batches in no particular order, so none carries over model state
+    _worker_detector._reset_sequence_state()
+    return _worker_detector._detect_batch(batch_data, frame_counter, **detection_kwargs)
+
 
 class Detector(object):
     def __init__(
@@ -57,6 +101,9 @@ class Detector(object):
         facepose_model="img2pose",
         identity_model="facenet",
         device="cpu",
+        quantize=False,
+        optimize=False,
+        model_cache_dir=None,
         n_jobs=1,
         verbose=False,
         **kwargs,
@@ -66,9 +113,29 @@ class Detector(object):
         Detector is a class used to detect faces, facial landmarks, emotions, and action units from images and videos.
 
         Args:
-            n_jobs (int, default=1): Number of processes to use for extraction.
+            n_jobs (int, default=1): Number of processes to use for extraction. When
+            n_jobs > 1, batches are distributed dynamically across a pool of worker
+            processes that each load the models once. -1 uses all available cores.
+            Scripts that use n_jobs > 1 should guard their entry point with
+            `if __name__ == "__main__":`
             device (str): specify device to process data (default='cpu'), can be
             ['auto', 'cpu', 'cuda', 'mps']
+            quantize (bool, default=False): quantize the mobilefacenet landmark,
+            resmasknet emotion and facenet identity models to int8 when they are
+            loaded. Only supported on cpu; faster, at the cost of small differences in
+            their outputs (see benchmarks/quantization_benchmark.py). Calibrating the
+            quantized models adds about 20 seconds to loading, which every worker
+            repeats when n_jobs > 1; set model_cache_dir so they are calibrated once
+            and the workers load them from the cache
+            optimize (bool, default=False): fold BatchNorm layers into the
+            preceding convolutions of the CNN models when they are loaded and run them
+            in the channels_last memory format (except on mps). Outputs only change
+            within floating point error (see benchmarks/inference_prep_benchmark.py)
+            model_cache_dir (str, default=None): directory to cache TorchScript versions
+            of the CNN models in. Each model is traced once, after any quantization or
+            optimization, and later Detectors (e.g., worker processes) load it from the
+            cache instead of preparing it again. Traced models don't accept
+            landmark_model_kwargs at detection time
             verbose (bool): print logging and debug messages during operation
             **kwargs: you can pass each detector specific kwargs using a dictionary
             like: `face_model_kwargs = {...}, au_model_kwargs={...}, ...`
@@ -99,6 +166,8 @@ class Detector(object):
             >> detector.detect_video("input.mp4")
         """
 
+        n_jobs = self._validate_n_jobs(n_jobs)
+
         # Initial info dict with model names only
         self.info = dict(
             face_model=None,
@@ -117,6 +186,32 @@ class Detector(object):
 
         # Setup device
         self.device = set_torch_device(device)
+        if quantize and self.device.type != "cpu":
+            raise ValueError("quantize=True is only supported with device='cpu'")
+        self.quantize = quantize
+        self.optimize = optimize
+        self._model_cache = (
+            None if model_cache_dir is None else TracedModelCache(model_cache_dir)
+        )
+        # How each loaded model was built, so memo store keys depend on it
+        self._model_configs = {}
+
+        # Everything a worker process needs to rebuild this detector when n_jobs > 1
+        self._pool = None
+        self._detector_kwargs = dict(
+            face_model=face_model,
+            landmark_model=landmark_model,
+            au_model=au_model,
+            emotion_model=emotion_model,
+            facepose_model=facepose_model,
+            identity_model=identity_model,
+            device=self.device,
+            quantize=quantize,
+            optimize=optimize,
+            model_cache_dir=model_cache_dir,
+            verbose=verbose,
+            **kwargs,
+        )
 
         # Verify model names and download if necessary
         face, landmark, au, emotion, facepose, identity = get_pretrained_models(
@@ -146,6 +241,41 @@ class Detector(object):
     def __getitem__(self, i):
         return self.info[i]
 
+    def __del__(self):
+        self._close_pool()
+
+    @staticmethod
+    def _validate_n_jobs(n_jobs):
+        """Helper function to resolve the number of worker processes to use"""
+        if not isinstance(n_jobs, int) or n_jobs == 0:
+            raise ValueError(f"n_jobs must be a non-zero integer, not {n_jobs}")
+        if n_jobs < 0:
+            n_jobs = max(1, os.cpu_count() + 1 + n_jobs)
+        return n_jobs
+
+    def _get_pool(self):
+        """Helper function that lazily starts the worker pool used when n_jobs > 1.
+        The pool persists across detect_* calls so models are only loaded once per
+        worker, and is restarted by change_model()."""
+        if self._pool is None:
+            n_jobs = self.info["n_jobs"]
+            num_threads = max(1, torch.get_num_threads() // n_jobs)
+            logging.info(f"Starting {n_jobs} worker processes...")
+            self._pool = ProcessPoolExecutor(
+                max_workers=n_jobs,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self._detector_kwargs, num_threads),
+            )
+        return self._pool
+
+    def _close_pool(self):
+        """Helper function to shut down the worker pool if one is running"""
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+            self._pool = None
+
     def _init_detectors(
         self,
         face,
@@ -172,9 +302,16 @@ class Detector(object):
         # Only initialize a model if the currently initialized model is diff than the
         # requested one. Lets us re-use this with .change_model
 
+        hog_models_changed = (
+            self.info["au_model"] != au or self.info["emotion_model"] != emotion
+        )
+
         # FACE MODEL
         if self.info["face_model"] != face:
             logging.info(f"Loading Face model: {face}")
+            self._model_configs["face_model"] = self._model_config(
+                face, face_model_kwargs
+            )
             self.face_detector = fetch_model("face_model", face)
             self.info["face_model"] = face
             self.info["face_detection_columns"] = FEAT_FACEBOX_COLUMNS
@@ -192,23 +329,37 @@ class Detector(object):
                     self.face_detector = self.face_detector(
                         device=self.device, **face_model_kwargs
                     )
+                if face in ["retinaface", "faceboxes"]:
+                    self.face_detector.net = self._prepare_model(
+                        face,
+                        self.face_detector.net,
+                        (1, 3, 480, 640),
+                        os.path.join(
+                            get_resource_path(),
+                            "mobilenet0.25_Final.pth"
+                            if face == "retinaface"
+                            else "FaceBoxesProd.pth",
+                        ),
+                        face_model_kwargs,
+                    )
 
         # LANDMARK MODEL
         if self.info["landmark_model"] != landmark:
             logging.info(f"Loading Facial Landmark model: {landmark}")
+            self._model_configs["landmark_model"] = self._model_config(
+                landmark, landmark_model_kwargs
+            )
             self.landmark_detector = fetch_model("landmark_model", landmark)
             if self.landmark_detector is not None:
                 if landmark == "mobilenet":
                     self.landmark_detector = self.landmark_detector(
                         136, **landmark_model_kwargs
                     )
-                    checkpoint = torch.load(
-                        os.path.join(
-                            get_resource_path(),
-                            "mobilenet_224_model_best_gdconv_external.pth.tar",
-                        ),
-                        map_location=self.device,
+                    weight_file = os.path.join(
+                        get_resource_path(),
+                        "mobilenet_224_model_best_gdconv_external.pth.tar",
                     )
+                    checkpoint = torch.load(weight_file, map_location=self.device)
                     ##################################
                     state_dict = checkpoint["state_dict"]
                     from collections import OrderedDict
@@ -226,23 +377,32 @@ class Detector(object):
                     self.landmark_detector = self.landmark_detector(
                         **landmark_model_kwargs
                     )
-                    checkpoint = torch.load(
-                        os.path.join(get_resource_path(), "pfld_model_best.pth.tar"),
-                        map_location=self.device,
+                    weight_file = os.path.join(
+                        get_resource_path(), "pfld_model_best.pth.tar"
                     )
+                    checkpoint = torch.load(weight_file, map_location=self.device)
                     self.landmark_detector.load_state_dict(checkpoint["state_dict"])
                 elif landmark == "mobilefacenet":
                     self.landmark_detector = self.landmark_detector(
                         [112, 112], 136, **landmark_model_kwargs
                     )
-                    checkpoint = torch.load(
-                        os.path.join(
-                            get_resource_path(), "mobilefacenet_model_best.pth.tar"
-                        ),
-                        map_location=self.device,
+                    weight_file = os.path.join(
+                        get_resource_path(), "mobilefacenet_model_best.pth.tar"
                     )
+                    checkpoint = torch.load(weight_file, map_location=self.device)
                     self.landmark_detector.load_state_dict(checkpoint["state_dict"])
             self.landmark_detector.eval()
+            face_size = 224 if landmark == "mobilenet" else 112
+            self.landmark_detector = self._prepare_model(
+                landmark,
+                self.landmark_detector,
+                (1, 3, face_size, face_size),
+                weight_file,
+                landmark_model_kwargs,
+                calibration=(lambda: calibration_faces(112))
+                if landmark == "mobilefacenet"
+                else None,
+            )
 
             self.info["landmark_model"] = landmark
             self.info["mapper"] = openface_2d_landmark_columns
@@ -258,6 +418,12 @@ class Detector(object):
         # FACEPOSE MODEL
         if self.info["facepose_model"] != facepose:
             logging.info(f"Loading facepose model: {facepose}")
+            self._model_configs["facepose_model"] = self._model_config(
+                facepose,
+                dict(facepose_model_kwargs, constrained="img2pose-c" == face)
+                if "img2pose" in facepose
+                else facepose_model_kwargs,
+            )
             self.facepose_detector = fetch_model("facepose_model", facepose)
             if "img2pose" in facepose:
                 self.facepose_detector = self.facepose_detector(
@@ -284,6 +450,7 @@ class Detector(object):
         # AU MODEL
         if self.info["au_model"] != au:
             logging.info(f"Loading AU model: {au}")
+            self._model_configs["au_model"] = self._model_config(au, au_model_kwargs)
             self.au_model = fetch_model("au_model", au)
             self.info["au_model"] = au
             if self.info["au_model"] in ["svm", "xgb"]:
@@ -305,20 +472,60 @@ class Detector(object):
         # EMOTION MODEL
         if self.info["emotion_model"] != emotion:
             logging.info(f"Loading emotion model: {emotion}")
+            self._model_configs["emotion_model"] = self._model_config(
+                emotion, emotion_model_kwargs
+            )
             self.emotion_model = fetch_model("emotion_model", emotion)
             self.info["emotion_model"] = emotion
             if self.emotion_model is not None:
                 self.emotion_model = self.emotion_model(
                     device=self.device, **emotion_model_kwargs
                 )
+                if emotion == "resmasknet":
+                    face_size = self.emotion_model.image_size[0]
+                    self.emotion_model.model = self._prepare_model(
+                        emotion,
+                        self.emotion_model.model,
+                        (1, 3, face_size, face_size),
+                        os.path.join(
+                            get_resource_path(),
+                            "ResMaskNet_Z_resmasking_dropout1_rot30.pth",
+                        ),
+                        emotion_model_kwargs,
+                        calibration=lambda: calibration_faces(
+                            face_size, grayscale=True
+                        ),
+                    )
                 self.info["emotion_model_columns"] = FEAT_EMOTION_COLUMNS
                 predictions = np.full_like(np.atleast_2d(FEAT_EMOTION_COLUMNS), np.nan)
                 empty_emotion = pd.DataFrame(predictions, columns=FEAT_EMOTION_COLUMNS)
                 self._empty_emotion = empty_emotion
 
+        # HOG based AU and emotion models project the same HOG features, so they share
+        # one StackedProjection that computes all of them with a single matrix product
+        if hog_models_changed:
+            hog_models = []
+            if self.info["au_model"] in ["svm", "xgb"]:
+                hog_models.append(self.au_model)
+            if self.info["emotion_model"] == "svm":
+                hog_models.append(self.emotion_model)
+            if hog_models:
+                projection = StackedProjection(
+                    {
+                        name: pair
+                        for model in hog_models
+                        for name, pair in model.projection_pairs.items()
+                    }
+                )
+                for model in hog_models:
+                    model.projection = projection
+
         # IDENTITY MODEL
         if self.info["identity_model"] != identity:
             logging.info(f"Loading Identity model: {identity}")
+            self._model_configs["identity_model"] = self._model_config(
+                identity, identity_model_kwargs
+            )
             self.identity_model = fetch_model("identity_model", identity)
             self.info["identity_model"] = identity
             self.info["identity_model_columns"] = FEAT_IDENTITY_COLUMNS
@@ -329,6 +536,17 @@ class Detector(object):
                 self.identity_model = self.identity_model(
                     device=self.device, **identity_model_kwargs
                 )
+                if identity == "facenet":
+                    self.identity_model.model = self._prepare_model(
+                        identity,
+                        self.identity_model.model,
+                        (1, 3, 112, 112),
+                        os.path.join(
+                            get_resource_path(), "facenet_20180402_114759_vggface2.pth"
+                        ),
+                        identity_model_kwargs,
+                        calibration=lambda: calibration_faces(112),
+                    )
 
         self.info["output_columns"] = (
             FEAT_TIME_COLUMNS
@@ -341,6 +559,58 @@ class Detector(object):
             + ["input"]
         )
 
+    def _model_config(self, name, model_kwargs):
+        """Helper function to describe how a model was built: its name, the kwargs it
+        was constructed with and the options that change its outputs"""
+        return (
+            name,
+            sorted(model_kwargs.items()),
+            self.quantize,
+            self.optimize,
+            self.device.type,
+        )
+
+    def _prepare_model(
+        self, name, model, example_shape, weight_file, model_kwargs, calibration=None
+    ):
+        """Helper function to prepare a CNN as requested by the quantize, optimize and
+        model_cache_dir options. Quantizable models (those with a calibration function
+        returning calibration data) are quantized; others have their BatchNorm layers
+        fused and use the channels_last memory format where the device supports it.
+        With a model cache, the prepared model is traced once with an input of
+        example_shape and later loaded from the cache instead, keyed on the weight_file
+        it was loaded from and the model_kwargs it was built with."""
+
+        quantize = self.quantize and calibration is not None
+        optimize = self.optimize and not quantize
+        channels_last = self.device.type != "mps"
+
+        if self._model_cache is not None:
+            key = self._model_cache.key(
+                name,
+                [weight_file],
+                model_kwargs=sorted(model_kwargs.items()),
+                quantize=quantize,
+                optimize=optimize,
+                channels_last=optimize and channels_last,
+                device=self.device.type,
+            )
+            cached = self._model_cache.load(key, self.device)
+            if cached is not None:
+                logging.info(f"Loaded {name} model from model cache")
+                return cached
+
+        if quantize:
+            model = quantize_model(model, calibration())
+        elif optimize:
+            model = prepare_for_inference(model, channels_last=channels_last)
+
+        if self._model_cache is not None:
+            model = self._model_cache.save(
+                key, model, torch.rand(example_shape, device=self.device)
+            )
+        return model
+
     def change_model(self, **kwargs):
         """Swap one or more pre-trained detector models for another one. Just pass in
         the the new models to use as kwargs, e.g. emotion_model='svm'"""
@@ -377,6 +647,8 @@ class Detector(object):
                 print(
                     f"Changing {current_name} from {self.info[current_name]} -> {requested}"
                 )
+                self._detector_kwargs[current_name] = requested
+                self._close_pool()
 
         self._init_detectors(
             face,
@@ -445,6 +717,13 @@ class Detector(object):
         """
 
         logging.info("detecting landmarks...")
+        if landmark_model_kwargs and isinstance(
+            self.landmark_detector, torch.jit.ScriptModule
+        ):
+            raise ValueError(
+                "landmark_model_kwargs are not supported with model_cache_dir; the "
+                "traced landmark model only takes the faces as input"
+            )
         frame = convert_image_to_tensor(frame)
 
         if is_list_of_lists_empty(detected_faces):
@@ -502,13 +781,14 @@ class Detector(object):
 
         When used with img2pose, returns *all* detected poses, and facebox and landmarks
         are ignored. Use `detect_face` method in order to obtain bounding boxes
-        corresponding to the detected poses returned by this method.
+        corresponding to the detected poses returned by this method. The pnp model
+        instead estimates one pose per face from its landmarks.
 
         Args:
             frame (np.ndarray): list of images
             landmarks (np.ndarray | None, optional): (num_images, num_faces, 68, 2)
             landmarks for the faces contained in list of images; Default None and
-            ignored for img2pose and img2pose-c detectors
+            ignored for img2pose and img2pose-c detectors; required for pnp
 
         Returns:
             list: poses (num_images, num_faces, [pitch, roll, yaw]) - Euler angles (in
@@ -532,12 +812,23 @@ class Detector(object):
 
         return output
 
-    def detect_aus(self, frame, landmarks, **au_model_kwargs):
+    def detect_aus(
+        self,
+        frame,
+        landmarks,
+        hog_features=None,
+        hog_projection=None,
+        **au_model_kwargs,
+    ):
         """Detect Action Units from image or video frame
 
         Args:
             frame (np.ndarray): image loaded in array format (n, m, 3)
             landmarks (array): 68 landmarks used to localize face.
+            hog_features (tuple): optional output of ._batch_hog() for these frames
+            and landmarks; skips recomputing it for the svm and xgb models
+            hog_projection (dict): optional output of the model's projection of
+            hog_features; skips recomputing it for the svm and xgb models
 
         Returns:
             array: Action Unit predictions
@@ -559,11 +850,14 @@ class Detector(object):
             if self["au_model"].lower() in ["svm", "xgb"]:
                 # transform = Grayscale(3)
                 # frame = transform(frame)
-                hog_features, new_landmarks = self._batch_hog(
-                    frames=frame, landmarks=landmarks
-                )
+                if hog_features is None:
+                    hog_features = self._batch_hog(frames=frame, landmarks=landmarks)
+                hog_features, new_landmarks = hog_features
                 au_predictions = self.au_model.detect_au(
-                    frame=hog_features, landmarks=new_landmarks, **au_model_kwargs
+                    frame=hog_features,
+                    landmarks=new_landmarks,
+                    projected=hog_projection,
+                    **au_model_kwargs,
                 )
             else:
                 au_predictions = self.au_model.detect_au(
@@ -585,31 +879,42 @@ class Detector(object):
             landmarks: updated landmarks
         """
 
+        # Every face in the batch is aligned, masked and described at once. Faces are
+        # quantized to uint8 the same way ToPILImage does, to reproduce the HOG
+        # features the models were trained on
+        faces = [
+            (i, np.asarray(face_landmark))
+            for i, frame_landmark in enumerate(landmarks)
+            for face_landmark in frame_landmark
+        ]
+        if faces:
+            frame_index, face_landmarks = zip(*faces)
+            convex_hulls, aligned_landmarks = batch_extract_face_from_landmarks(
+                frames,
+                np.stack(face_landmarks),
+                frame_index=list(frame_index),
+                face_size=112,
+            )
+            convex_hulls = (convex_hulls / 255.0).mul(255).byte()
+            face_hogs = (
+                batch_hog(
+                    convex_hulls, orientations=8, pixels_per_cell=8, cells_per_block=2
+                )
+                .cpu()
+                .numpy()
+            )
+
         hog_features = []
         new_landmark_frames = []
-        for i, frame_landmark in enumerate(landmarks):
+        n_faces = 0
+        for frame_landmark in landmarks:
             if len(frame_landmark) != 0:
-                new_landmarks_faces = []
-                for j in range(len(frame_landmark)):
-                    convex_hull, new_landmark = extract_face_from_landmarks(
-                        frame=frames[i],
-                        landmarks=frame_landmark[j],
-                        face_size=112,
-                    )
-
-                    hog_features.append(
-                        hog(
-                            transforms.ToPILImage()(convex_hull[0] / 255.0),
-                            orientations=8,
-                            pixels_per_cell=(8, 8),
-                            cells_per_block=(2, 2),
-                            visualize=False,
-                            channel_axis=-1,
-                        ).reshape(1, -1)
-                    )
-
-                    new_landmarks_faces.append(new_landmark)
-                new_landmark_frames.append(new_landmarks_faces)
+                n_frame_faces = len(frame_landmark)
+                hog_features.append(face_hogs[n_faces : n_faces + n_frame_faces])
+                new_landmark_frames.append(
+                    list(aligned_landmarks[n_faces : n_faces + n_frame_faces])
+                )
+                n_faces += n_frame_faces
             else:
                 hog_features.append(
                     np.zeros((1, 5408))
@@ -620,13 +925,25 @@ class Detector(object):
 
         return (hog_features, new_landmark_frames)
 
-    def detect_emotions(self, frame, facebox, landmarks, **emotion_model_kwargs):
+    def detect_emotions(
+        self,
+        frame,
+        facebox,
+        landmarks,
+        hog_features=None,
+        hog_projection=None,
+        **emotion_model_kwargs,
+    ):
         """Detect emotions from image or video frame
 
         Args:
             frame ([type]): [description]
             facebox ([type]): [description]
             landmarks ([type]): [description]
+            hog_features (tuple): optional output of ._batch_hog() for these frames
+            and landmarks; skips recomputing it for the svm model
+            hog_projection (dict): optional output of the model's projection of
+            hog_features; skips recomputing it for the svm model
 
         Returns:
             array: Action Unit predictions
@@ -656,14 +973,15 @@ class Detector(object):
                 )
 
             elif self.info["emotion_model"].lower() == "svm":
-                hog_features, new_landmarks = self._batch_hog(
-                    frames=frame, landmarks=landmarks
-                )
+                if hog_features is None:
+                    hog_features = self._batch_hog(frames=frame, landmarks=landmarks)
+                hog_features, new_landmarks = hog_features
                 return self._convert_detector_output(
                     landmarks,
                     self.emotion_model.detect_emo(
                         frame=hog_features,
                         landmarks=new_landmarks,
+                        projected=hog_projection,
                         **emotion_model_kwargs,
                     ),
                 )
@@ -710,6 +1028,10 @@ class Detector(object):
         emotion_model_kwargs,
         au_model_kwargs,
         identity_model_kwargs,
+        faces=None,
+        landmarks=None,
+        memo=None,
+        tracker=None,
         suppress_torchvision_warnings=True,
     ):
         """
@@ -726,6 +1048,13 @@ class Detector(object):
             emotion_model_kwargs (dict): emotion model kwargs
             au_model_kwargs (dict): au model kwargs
             identity_model_kwargs (dict): identity model kwargs
+            faces (list): precomputed faces for each frame in original image
+            coordinates; skips face detection
+            landmarks (list): precomputed landmarks for each face in original image
+            coordinates; skips landmark detection
+            memo (StageMemo): optional store to load/save the output of each stage
+            tracker (FaceTracker): optional tracker used to get faces and landmarks for
+            consecutive video frames instead of running face detection on each one
 
         Returns:
             tuple: faces, landmarks, poses, aus, emotions, identities
@@ -739,44 +1068,487 @@ class Detector(object):
                 "ignore", category=UserWarning, module="torchvision"
             )
 
-        faces = self.detect_faces(
-            batch_data["Image"],
-            threshold=face_detection_threshold,
-            **face_model_kwargs,
-        )
-
-        landmarks = self.detect_landmarks(
-            batch_data["Image"],
-            detected_faces=faces,
-            **landmark_model_kwargs,
+        if memo is not None:
+            frame_keys = memo.hash_frames(batch_data["Image"])
+
+        def memoized(stage, config, upstream_keys, detect):
+            """Loads a stage's output from the memo store or runs and saves it. Each
+            frame's entry is keyed on the stage's config and that frame's key of the
+            stage it depends on; returns the stage's key for each frame"""
+            if memo is None:
+                return detect(), None
+            if upstream_keys is None:
+                upstream_keys = [None] * len(frame_keys)
+            stage_keys = [
+                memo.stage_key(stage, *config, upstream_key)
+                for upstream_key in upstream_keys
+            ]
+            output = memo.load(frame_keys, stage_keys)
+            if output is None:
+                output = detect()
+                memo.save(frame_keys, stage_keys, output)
+            else:
+                logging.info(f"loaded {stage} from memo store...")
+            return output, stage_keys
+
+        def hash_detections(detections):
+            """Keys each frame's precomputed or tracked detections"""
+            return None if memo is None else memo.hash_detections(detections)
+
+        if tracker is not None:
+            faces, landmarks = tracker(
+                self,
+                batch_data["Image"],
+                list(batch_data["Frame"].numpy()),
+                face_detection_threshold,
+                face_model_kwargs,
+                landmark_model_kwargs,
+            )
+            faces_key = hash_detections(faces)
+            landmarks_key = hash_detections(landmarks)
+        else:
+            if faces is None:
+                faces, faces_key = memoized(
+                    "faces",
+                    (
+                        self._model_configs["face_model"],
+                        face_detection_threshold,
+                        face_model_kwargs,
+                    ),
+                    None,
+                    lambda: self.detect_faces(
+                        batch_data["Image"],
+                        threshold=face_detection_threshold,
+                        **face_model_kwargs,
+                    ),
+                )
+            else:
+                faces = _forward_face_transform(faces, batch_data)
+                faces_key = hash_detections(faces)
+
+            if landmarks is None:
+                landmarks, landmarks_key = memoized(
+                    "landmarks",
+                    (
+                        self._model_configs["landmark_model"],
+                        landmark_model_kwargs,
+                    ),
+                    faces_key,
+                    lambda: self.detect_landmarks(
+                        batch_data["Image"],
+                        detected_faces=faces,
+                        **landmark_model_kwargs,
+                    ),
+                )
+            else:
+                landmarks = _forward_landmark_transform(landmarks, batch_data)
+                landmarks_key = hash_detections(landmarks)
+
+        # The HOG based AU and emotion models describe the same aligned faces, so their
+        # features and the shared StackedProjection of them are computed at most once
+        # per batch and used by both stages
+        shared_hog = {}
+
+        def hog_features(model_name, hog_models):
+            """Returns the batch's HOG features if model_name uses them"""
+            if str(model_name).lower() not in hog_models or is_list_of_lists_empty(
+                landmarks
+            ):
+                return None
+            if "hog" not in shared_hog:
+                shared_hog["hog"] = self._batch_hog(
+                    frames=convert_image_to_tensor(
+                        batch_data["Image"], img_type="float32"
+                    ),
+                    landmarks=landmarks,
+                )
+            return shared_hog["hog"]
+
+        def hog_projection(model, model_name, hog_models):
+            """Returns the model's projection of the batch's HOG features if it uses
+            them"""
+            hog = hog_features(model_name, hog_models)
+            if hog is None:
+                return None
+            if "projection" not in shared_hog:
+                shared_hog["projection"] = model.projection(hog[0])
+            return shared_hog["projection"]
+
+        poses_dict, _ = memoized(
+            "facepose",
+            (
+                self._model_configs["facepose_model"],
+                facepose_model_kwargs,
+            ),
+            landmarks_key,
+            lambda: self.detect_facepose(
+                batch_data["Image"], landmarks, **facepose_model_kwargs
+            ),
         )
 
-        poses_dict = self.detect_facepose(
-            batch_data["Image"], landmarks, **facepose_model_kwargs
+        aus, _ = memoized(
+            "aus",
+            (self._model_configs["au_model"], au_model_kwargs),
+            landmarks_key,
+            lambda: self.detect_aus(
+                batch_data["Image"],
+                landmarks,
+                hog_features=hog_features(self.info["au_model"], ["svm", "xgb"]),
+                hog_projection=hog_projection(
+                    self.au_model, self.info["au_model"], ["svm", "xgb"]
+                ),
+                **au_model_kwargs,
+            ),
         )
 
-        aus = self.detect_aus(batch_data["Image"], landmarks, **au_model_kwargs)
-
-        emotions = self.detect_emotions(
-            batch_data["Image"], faces, landmarks, **emotion_model_kwargs
+        emotions, _ = memoized(
+            "emotions",
+            (
+                self._model_configs["emotion_model"],
+                emotion_model_kwargs,
+            ),
+            landmarks_key,
+            lambda: self.detect_emotions(
+                batch_data["Image"],
+                faces,
+                landmarks,
+                hog_features=hog_features(self.info["emotion_model"], ["svm"]),
+                hog_projection=hog_projection(
+                    self.emotion_model, self.info["emotion_model"], ["svm"]
+                ),
+                **emotion_model_kwargs,
+            ),
         )
 
-        identities = self.detect_identity(
-            batch_data["Image"],
-            faces,
-            **identity_model_kwargs,
+        identities, _ = memoized(
+            "identities",
+            (
+                self._model_configs["identity_model"],
+                identity_model_kwargs,
+            ),
+            faces_key,
+            lambda: self.detect_identity(
+                batch_data["Image"],
+                faces,
+                **identity_model_kwargs,
+            ),
         )
 
         faces = _inverse_face_transform(faces, batch_data)
         landmarks = _inverse_landmark_transform(landmarks, batch_data)
 
         # match faces to poses - sometimes face detector finds different faces than pose detector.
-        faces, poses = self._match_faces_to_poses(
-            faces, poses_dict["faces"], poses_dict["poses"]
-        )
+        # Landmark based pose models already return one pose per detected face.
+        if "faces" in poses_dict:
+            faces, poses = self._match_faces_to_poses(
+                faces, poses_dict["faces"], poses_dict["poses"]
+            )
+        else:
+            poses = poses_dict["poses"]
 
         return faces, landmarks, poses, aus, emotions, identities
 
+    def _detect_batch(
+        self,
+        batch_data,
+        frame_counter,
+        face_detection_threshold,
+        face_model_kwargs,
+        landmark_model_kwargs,
+        facepose_model_kwargs,
+        emotion_model_kwargs,
+        au_model_kwargs,
+        identity_model_kwargs,
+        faces=None,
+        landmarks=None,
+        memo=None,
+        tracker=None,
+    ):
+        """Runs the detection waterfall on a single batch from an ImageDataset or
+        VideoDataset and packages the results into a Fex.
+
+        Args:
+            batch_data (dict): batch from a DataLoader
+            frame_counter (int or list): starting frame number or frame number of each image
+            faces (list): optional precomputed faces for each image in the batch
+            landmarks (list): optional precomputed landmarks for each image in the batch
+            memo (StageMemo): optional store to load/save the output of each stage
+            tracker (FaceTracker): optional face tracker for consecutive video frames
+
+        Returns:
+            Fex: Prediction results dataframe for this batch
+        """
+        (
+            faces,
+            landmarks,
+            poses,
+            aus,
+            emotions,
+            identities,
+        ) = self._run_detection_waterfall(
+            batch_data,
+            face_detection_threshold,
+            face_model_kwargs,
+            landmark_model_kwargs,
+            facepose_model_kwargs,
+            emotion_model_kwargs,
+            au_model_kwargs,
+            identity_model_kwargs,
+            faces=faces,
+            landmarks=landmarks,
+            memo=memo,
+            tracker=tracker,
+        )
+
+        file_names = (
+            batch_data["FileNames"]
+            if "FileNames" in batch_data
+            else batch_data["FileName"]
+        )
+
+        return self._create_fex(
+            faces,
+            landmarks,
+            poses,
+            aus,
+            emotions,
+            identities,
+            file_names,
+            frame_counter,
+        )
+
+    def _detect_batches(
+        self,
+        data_loader,
+        frame_counter=0,
+        faces=None,
+        landmarks=None,
+        motion_gate=None,
+        sequential=False,
+        **detection_kwargs,
+    ):
+        """Generator that runs detection on every batch of a DataLoader and yields one
+        Fex per batch in input order. With n_jobs > 1 batches are handed out to the
+        worker pool as workers free up, with a bounded number in flight, and the image
+        tensors are moved to shared memory so they are not copied through the pipe.
+
+        Args:
+            data_loader (DataLoader): loader over an ImageDataset or VideoDataset
+            frame_counter (int): starting frame number for batches without a "Frame" key
+            faces (dict): optional precomputed faces keyed by frame number
+            landmarks (dict): optional precomputed landmarks keyed by frame number
+            motion_gate (MotionGate): optional gate that skips frames which barely
+            changed, forward-filling them with the last processed frame's output and
+            flagging them in a carried_forward column
+            sequential (bool): the batches are consecutive frames of one video, so
+            models that depend on the previous frame (img2pose with
+            border_fallback='previous') carry their state from one batch to the next
+            when run serially. Otherwise their state is reset before every batch
+            **detection_kwargs: face_detection_threshold, memo, tracker and
+            *_model_kwargs
+
+        Yields:
+            Fex: Prediction results dataframe for each batch
+        """
+
+        def batch_frames(batch_data):
+            nonlocal frame_counter
+            if "Frame" in batch_data:
+                return list(batch_data["Frame"].numpy())
+            n_frames = len(batch_data["Image"])
+            frames = list(range(frame_counter, frame_counter + n_frames))
+            frame_counter += n_frames
+            return frames
+
+        def batch_kwargs(frames):
+            kwargs = dict(detection_kwargs)
+            if faces is not None:
+                kwargs["faces"] = [faces[frame] for frame in frames]
+            if landmarks is not None:
+                kwargs["landmarks"] = [landmarks[frame] for frame in frames]
+            return kwargs
+
+        def gate(batch_data, frames):
+            """Drops the frames the motion gate skips from a batch"""
+            if motion_gate is None:
+                return batch_data, frames, None
+            keep = motion_gate(batch_data["Image"])
+            if not keep.any():
+                return None, [], keep
+            if not keep.all():
+                batch_data = self._select_from_batch(batch_data, np.flatnonzero(keep))
+            return batch_data, list(np.array(frames)[keep]), keep
+
+        last_rows = None
+
+        def fill_skipped(output, frames, keep):
+            """Forward-fills frames skipped by the motion gate with the output of the
+            last processed frame"""
+            nonlocal last_rows
+            if keep is None:
+                return output
+            rows = []
+            for frame, processed in zip(frames, keep):
+                if processed:
+                    last_rows = output[output["frame"] == frame]
+                    rows.append(last_rows.assign(carried_forward=False))
+                else:
+                    rows.append(last_rows.assign(frame=frame, carried_forward=True))
+            return pd.concat(rows)
+
+        batches = tqdm(self._load_batches(data_loader), total=len(data_loader))
+        self._reset_sequence_state()
+
+        # Tracking carries state from one frame to the next so it can't be distributed
+        if self.info["n_jobs"] == 1 or detection_kwargs.get("tracker") is not None:
+            for batch_data in batches:
+                if not sequential:
+                    self._reset_sequence_state()
+                frames = batch_frames(batch_data)
+                batch_data, detect_frames, keep = gate(batch_data, frames)
+                output = None
+                if batch_data is not None:
+                    output = self._detect_batch(
+                        batch_data, detect_frames, **batch_kwargs(detect_frames)
+                    )
+                yield fill_skipped(output, frames, keep)
+            return
+
+        pool = self._get_pool()
+        pending = deque()
+        max_pending = 2 * self.info["n_jobs"]
+        try:
+            for batch_data in batches:
+                frames = batch_frames(batch_data)
+                batch_data, detect_frames, keep = gate(batch_data, frames)
+                result = None
+                if batch_data is not None:
+                    batch_data["Image"].share_memory_()
+                    result = pool.submit(
+                        _run_worker_batch,
+                        batch_data,
+                        detect_frames,
+                        batch_kwargs(detect_frames),
+                    )
+                pending.append((result, frames, keep))
+                if len(pending) >= max_pending:
+                    result, frames, keep = pending.popleft()
+                    yield fill_skipped(result and result.result(), frames, keep)
+            while pending:
+                result, frames, keep = pending.popleft()
+                yield fill_skipped(result and result.result(), frames, keep)
+        except BrokenProcessPool as e:
+            # A worker that is killed mid-batch, e.g., for running out of memory, breaks
+            # the pool instead of leaving its batch unfinished forever
+            self._close_pool()
+            raise RuntimeError(
+                "A worker process died while detecting, e.g., because it ran out of "
+                "memory; each worker holds its own copy of the models, so try a "
+                "smaller n_jobs or batch_size"
+            ) from e
+        except Exception:
+            # Don't leave failed workers behind for the next call
+            for result, _, _ in pending:
+                if result is not None:
+                    result.cancel()
+            self._close_pool()
+            raise
+
+    def _reset_sequence_state(self):
+        """Helper function to make models that depend on the images they saw before
+        treat the next image as the first of a new sequence"""
+        for model in [self.face_detector, self.facepose_detector]:
+            if hasattr(model, "reset_sequence"):
+                model.reset_sequence()
+
+    @staticmethod
+    def _load_batches(data_loader):
+        """Generator over the batches of a DataLoader. The error raised when images of
+        different sizes can't be collated into one batch is explained; errors raised
+        while detecting are left alone."""
+        batches = iter(data_loader)
+        while True:
+            try:
+                batch_data = next(batches)
+            except StopIteration:
+                return
+            except RuntimeError as e:
+                raise ValueError(
+                    f"when using a batch_size > 1 all images must have the same dimensions or output_size must not be None so py-feat can rescale images to output_size. See pytorch error: \n{e}"
+                ) from e
+            yield batch_data
+
+    @staticmethod
+    def _select_from_batch(batch_data, idx):
+        """Helper function to select a subset of frames from a DataLoader batch"""
+        if isinstance(batch_data, dict):
+            return {
+                key: Detector._select_from_batch(value, idx)
+                for key, value in batch_data.items()
+            }
+        if isinstance(batch_data, torch.Tensor):
+            return batch_data[torch.as_tensor(idx)]
+        return [batch_data[i] for i in idx]
+
+    def _prepare_precomputed_detections(self, faces, landmarks, frames):
+        """Helper function to validate and index the precomputed faces and landmarks
+        passed to detect_image() or detect_video()"""
+
+        if landmarks is not None and faces is None:
+            raise ValueError("Precomputed landmarks also require precomputed faces")
+        if faces is not None:
+            faces = self._index_precomputed_detections(faces, frames)
+        if landmarks is not None:
+            landmarks = self._index_precomputed_detections(
+                landmarks, frames, landmarks=True
+            )
+        return faces, landmarks
+
+    def _index_precomputed_detections(self, detections, frames, landmarks=False):
+        """Helper function to organize precomputed faces or landmarks by frame number
+
+        Args:
+            detections (Fex or list): a Fex from a previous detection or a list with one
+            item per input frame, where each item is a list of faces [x1, y1, x2, y2,
+            score] or of (68, 2) landmark arrays in original image coordinates
+            frames (list): frame numbers of the inputs being detected
+            landmarks (bool): whether detections are landmarks rather than faces
+
+        Returns:
+            dict: list of faces or landmarks for each frame number
+        """
+
+        if isinstance(detections, Fex):
+            columns = (
+                self.info["face_landmark_columns"]
+                if landmarks
+                else self.info["face_detection_columns"]
+            )
+            indexed = defaultdict(list)
+            for frame, values in zip(
+                detections["frame"].to_numpy(), detections[columns].to_numpy(float)
+            ):
+                # Frames without a face are kept so they are reported as empty
+                frame_detections = indexed[frame]
+                if np.isnan(values).any():
+                    continue
+                if landmarks:
+                    frame_detections.append(values.reshape(-1, 2, order="F"))
+                else:
+                    x, y, width, height, score = values
+                    frame_detections.append([x, y, x + width, y + height, score])
+        else:
+            if len(detections) != len(frames):
+                raise ValueError(
+                    f"Precomputed detections must have one item per input frame: got {len(detections)} for {len(frames)} frames"
+                )
+            indexed = dict(zip(frames, detections))
+
+        missing = [frame for frame in frames if frame not in indexed]
+        if missing:
+            raise ValueError(f"No precomputed detections found for frames {missing}")
+        return indexed
+
     def detect_image(
         self,
         input_file_list,
@@ -787,6 +1559,9 @@ class Detector(object):
         frame_counter=0,
         face_detection_threshold=0.5,
         face_identity_threshold=0.8,
+        faces=None,
+        landmarks=None,
+        memo_dir=None,
         **kwargs,
     ):
         """
@@ -811,6 +1586,18 @@ class Detector(object):
             face_detection_threshold (float): value between 0-1 to report a detection based on the
                                 confidence of the face detector; Default >= 0.5
             face_identity_threshold (float): value between 0-1 to determine similarity of person using face identity embeddings; Default >= 0.8
+            faces (Fex or list): precomputed faces to use instead of running face
+                                detection, e.g., the output of a previous detect_image()
+                                call with the same frame_counter. A list must have one item
+                                per image, each a list of [x1, y1, x2, y2, score] faces in
+                                original image coordinates
+            landmarks (Fex or list): precomputed landmarks to use instead of running
+                                landmark detection. Requires faces. A list must have one
+                                item per image, each a list of (68, 2) arrays matching faces
+            memo_dir (str): optional directory in which to store the output of each
+                                detection stage for every frame. Later calls with the same
+                                memo_dir reuse the stored output of any stage whose model,
+                                parameters and upstream stages are unchanged
             **kwargs: you can pass each detector specific kwargs using a dictionary
                                 like: `face_model_kwargs = {...}, au_model_kwargs={...}, ...`
 
@@ -826,13 +1613,19 @@ class Detector(object):
         facepose_model_kwargs = kwargs.pop("facepose_model_kwargs", dict())
         identity_model_kwargs = kwargs.pop("identity_model_kwargs", dict())
 
+        dataset = ImageDataset(
+            input_file_list,
+            output_size=output_size,
+            preserve_aspect_ratio=True,
+            padding=True,
+        )
+
+        faces, landmarks = self._prepare_precomputed_detections(
+            faces, landmarks, range(frame_counter, frame_counter + len(dataset))
+        )
+
         data_loader = DataLoader(
-            ImageDataset(
-                input_file_list,
-                output_size=output_size,
-                preserve_aspect_ratio=True,
-                padding=True,
-            ),
+            dataset,
             num_workers=num_workers,
             batch_size=batch_size,
             pin_memory=pin_memory,
@@ -844,51 +1637,27 @@ class Detector(object):
                 "Currently using mobilenet for landmark detection with batch_size > 1 may lead to erroneous detections. We recommend either setting batch_size=1 or using mobilefacenet as the landmark detection model. You can follow this issue for more: https://github.com/cosanlab/py-feat/issues/151"
             )
 
-        try:
-            batch_output = []
-
-            for batch_id, batch_data in enumerate(tqdm(data_loader)):
-                (
-                    faces,
-                    landmarks,
-                    poses,
-                    aus,
-                    emotions,
-                    identities,
-                ) = self._run_detection_waterfall(
-                    batch_data,
-                    face_detection_threshold,
-                    face_model_kwargs,
-                    landmark_model_kwargs,
-                    facepose_model_kwargs,
-                    emotion_model_kwargs,
-                    au_model_kwargs,
-                    identity_model_kwargs,
-                )
-
-                output = self._create_fex(
-                    faces,
-                    landmarks,
-                    poses,
-                    aus,
-                    emotions,
-                    identities,
-                    batch_data["FileNames"],
-                    frame_counter,
-                )
-                batch_output.append(output)
-                frame_counter += 1 * batch_size
-
-            batch_output = pd.concat(batch_output)
-            batch_output.reset_index(drop=True, inplace=True)
-            batch_output.compute_identities(
-                threshold=face_identity_threshold, inplace=True
-            )
-            return batch_output
-        except RuntimeError as e:
-            raise ValueError(
-                f"when using a batch_size > 1 all images must have the same dimensions or output_size must not be None so py-feat can rescale images to output_size. See pytorch error: \n{e}"
+        batch_output = list(
+            self._detect_batches(
+                data_loader,
+                frame_counter=frame_counter,
+                faces=faces,
+                landmarks=landmarks,
+                memo=None if memo_dir is None else StageMemo(memo_dir),
+                face_detection_threshold=face_detection_threshold,
+                face_model_kwargs=face_model_kwargs,
+                landmark_model_kwargs=landmark_model_kwargs,
+                facepose_model_kwargs=facepose_model_kwargs,
+                emotion_model_kwargs=emotion_model_kwargs,
+                au_model_kwargs=au_model_kwargs,
+                identity_model_kwargs=identity_model_kwargs,
             )
+        )
+
+        batch_output = pd.concat(batch_output)
+        batch_output.reset_index(drop=True, inplace=True)
+        batch_output.compute_identities(threshold=face_identity_threshold, inplace=True)
+        return batch_output
 
     def detect_video(
         self,
@@ -900,6 +1669,12 @@ class Detector(object):
         pin_memory=False,
         face_detection_threshold=0.5,
         face_identity_threshold=0.8,
+        faces=None,
+        landmarks=None,
+        memo_dir=None,
+        face_tracking=None,
+        face_tracking_overlap=0.5,
+        motion_threshold=None,
         **kwargs,
     ):
         """Detects FEX from a video file.
@@ -917,6 +1692,32 @@ class Detector(object):
             face_detection_threshold (float): value between 0-1 to report a detection based on the
                                 confidence of the face detector; Default >= 0.5
             face_identity_threshold (float): value between 0-1 to determine similarity of person using face identity embeddings; Default >= 0.8
+            faces (Fex or list): precomputed faces to use instead of running face
+                                detection, e.g., the output of a previous detect_video()
+                                call with the same skip_frames. A list must have one item
+                                per processed frame, each a list of [x1, y1, x2, y2, score] faces in
+                                original image coordinates
+            landmarks (Fex or list): precomputed landmarks to use instead of running
+                                landmark detection. Requires faces. A list must have one
+                                item per processed frame, each a list of (68, 2) arrays matching faces
+            memo_dir (str): optional directory in which to store the output of each
+                                detection stage for every frame. Later calls with the same
+                                memo_dir reuse the stored output of any stage whose model,
+                                parameters and upstream stages are unchanged
+            face_tracking (int or None): if set, only run the face detector every this
+                                many processed frames and track faces in between by
+                                re-detecting landmarks inside boxes propagated from the
+                                previous frame's landmarks. Faces are re-detected early
+                                whenever a track is lost. Adds a "Track" column with a
+                                stable id for each tracked face; Default None
+            face_tracking_overlap (float): value between 0-1; minimum overlap between a
+                                propagated box and the box implied by its new landmarks to
+                                keep tracking a face; Default >= 0.5
+            motion_threshold (float or None): if set, frames whose small grayscale
+                                thumbnail differs from that of the last processed frame by
+                                less than this mean pixel intensity (0-255) are not
+                                processed. They are filled with the last processed frame's
+                                output and flagged in a "carried_forward" column; Default None
 
         Returns:
             Fex: Prediction results dataframe
@@ -934,6 +1735,18 @@ class Detector(object):
             video_path, skip_frames=skip_frames, output_size=output_size
         )
 
+        faces, landmarks = self._prepare_precomputed_detections(
+            faces, landmarks, dataset.video_frames
+        )
+
+        tracker = None
+        if face_tracking is not None:
+            if faces is not None:
+                raise ValueError("face_tracking can't be used with precomputed faces")
+            tracker = FaceTracker(
+                detect_every=face_tracking, min_overlap=face_tracking_overlap
+            )
+
         data_loader = DataLoader(
             dataset,
             num_workers=num_workers,
@@ -942,47 +1755,41 @@ class Detector(object):
             shuffle=False,
         )
 
-        batch_output = []
-
-        for batch_data in tqdm(data_loader):
-            (
-                faces,
-                landmarks,
-                poses,
-                aus,
-                emotions,
-                identities,
-            ) = self._run_detection_waterfall(
-                batch_data,
-                face_detection_threshold,
-                face_model_kwargs,
-                landmark_model_kwargs,
-                facepose_model_kwargs,
-                emotion_model_kwargs,
-                au_model_kwargs,
-                identity_model_kwargs,
-            )
-
-            frames = list(batch_data["Frame"].numpy())
-
-            output = self._create_fex(
-                faces,
-                landmarks,
-                poses,
-                aus,
-                emotions,
-                identities,
-                batch_data["FileName"],
-                frames,
+        batch_output = list(
+            self._detect_batches(
+                data_loader,
+                faces=faces,
+                landmarks=landmarks,
+                memo=None if memo_dir is None else StageMemo(memo_dir),
+                tracker=tracker,
+                sequential=True,
+                motion_gate=None
+                if motion_threshold is None
+                else MotionGate(motion_threshold),
+                face_detection_threshold=face_detection_threshold,
+                face_model_kwargs=face_model_kwargs,
+                landmark_model_kwargs=landmark_model_kwargs,
+                facepose_model_kwargs=facepose_model_kwargs,
+                emotion_model_kwargs=emotion_model_kwargs,
+                au_model_kwargs=au_model_kwargs,
+                identity_model_kwargs=identity_model_kwargs,
             )
-
-            batch_output.append(output)
+        )
 
         batch_output = pd.concat(batch_output)
         batch_output.reset_index(drop=True, inplace=True)
         batch_output["approx_time"] = [
             dataset.calc_approx_frame_time(x) for x in batch_output["frame"].to_numpy()
         ]
+        if tracker is not None:
+            # Frames without faces still get a row, with no track id. Frames skipped by
+            # the motion gate carry the ids of the last processed frame
+            track_ids = []
+            frame_ids = [np.nan]
+            for frame in dataset.video_frames:
+                frame_ids = tracker.track_ids.get(frame, frame_ids) or [np.nan]
+                track_ids.extend(frame_ids)
+            batch_output["Track"] = track_ids
         batch_output.compute_identities(threshold=face_identity_threshold, inplace=True)
 
         return batch_output.set_index("frame", drop=False)
@@ -10,7 +10,6 @@ import torch
 from torchvision.transforms import (
     Resize,
     Grayscale,
-    Compose,
     RandomHorizontalFlip,
 )
 import traceback
@@ -724,47 +723,55 @@ class ResMaskNet:
             )["net"]
         )
 
+        self.model.to(self.device)
         self.model.eval()
 
-    def detect_emo(self, frame, detected_face, *args, **kwargs):
+    def detect_emo(self, frame, detected_face, *args, max_batch_size=128, **kwargs):
         """Detect emotions.
         Args:
             frame ([type]): [description]
+            detected_face (list): list of lists of detected faces for each frame
+            max_batch_size (int): maximum number of faces passed through the network at
+            once; frames with many faces are processed in several batches to bound memory
         Returns:
             List of predicted emotions in probability: [angry, disgust, fear, happy, sad, surprise, neutral]
         """
 
-        face = self._batch_make(frame=frame, detected_face=detected_face)
+        faces = [
+            (i, face)
+            for i, frame_faces in enumerate(detected_face)
+            for face in frame_faces
+        ]
+        probas = [np.zeros((0, len(self.FER_2013_EMO_DICT)), dtype=np.float32)]
         with torch.no_grad():
-            output = self.model(face)
-            proba = torch.softmax(output, 1)
-            proba_np = proba.cpu().numpy()
-            return proba_np
+            for start in range(0, len(faces), max_batch_size):
+                face = self._batch_make(frame, faces[start : start + max_batch_size])
+                output = self.model(face)
+                proba = torch.softmax(output, 1)
+                probas.append(proba.cpu().numpy())
+        return np.concatenate(probas)
 
-    def _batch_make(self, frame, detected_face, *args, **kwargs):
+    def _batch_make(self, frame, faces):
+        """Crops, converts to grayscale and resizes a batch of faces
 
-        transform = Compose([Grayscale(3)])
-        gray = transform(frame)
+        Args:
+            frame (torch.Tensor): (B,C,H,W) frames in the 0-255 range
+            faces (list): (frame index, detected face) of each face
 
-        len_index = [len(aa) for aa in detected_face]
-        length_cumu = np.cumsum(len_index)
-        flat_faces = [item for sublist in detected_face for item in sublist]
+        Returns:
+            torch.Tensor: (N,3,H,W) faces on the model's device, scaled to 0-1
+        """
 
-        concat_batch = None
-        for i, face in enumerate(flat_faces):
-            frame_choice = np.where(i < length_cumu)[0][0]
-            #     frame0 = np.fliplr(frame[frame_choice]).astype(np.uint8) # not sure why we need to flip the face
+        # Faces are cropped before the grayscale conversion so only face pixels are
+        # converted, and written into one preallocated tensor
+        gray = Grayscale(3)
+        resize = Resize(self.image_size)
+        batch = torch.empty(
+            (len(faces), 3) + self.image_size, dtype=torch.float32, device=self.device
+        )
+        for i, (frame_choice, face) in enumerate(faces):
             bbox = BBox(face[:-1])
-            face = (
-                bbox.expand_by_factor(1.1)
-                .extract_from_image(gray[frame_choice])
-                .unsqueeze(0)
-            )
-            transform = Resize(self.image_size)
-            face = transform(face) / 255
-            if concat_batch is None:
-                concat_batch = face
-            else:
-                concat_batch = torch.cat((concat_batch, face), 0)
-
-        return concat_batch
+            face = bbox.expand_by_factor(1.1).extract_from_image(frame[frame_choice])
+            batch[i] = resize(gray(face).unsqueeze(0))[0] / 255
+
+        return batch
@@ -3,6 +3,7 @@
 # Currently support: SVM (as in the paper), RandomForest (new implementation).
 import numpy as np
 from feat.utils.io import get_resource_path
+from feat.utils.stats import StackedProjection, StackedLinearClassifier
 import joblib
 import os
 import torch.nn as nn
@@ -32,10 +33,19 @@ class EmoSVMClassifier:
         self.scaler = load_classifier(
             os.path.join(get_resource_path(), "emo_data_Fullscalar_Jun30.pkl")
         )
+        self.projection_pairs = {"emotion": (self.scaler, self.pca_model)}
+        self.projection = StackedProjection(self.projection_pairs)
 
-    def detect_emo(self, frame, landmarks, **kwargs):
+        # All emotions are evaluated with one matrix product
+        self.emo_columns = ["anger", "disgust", "fear", "happ", "sad", "sur", "neutral"]
+        self.stacked_classifier = StackedLinearClassifier(
+            [self.classifier[keys] for keys in self.emo_columns]
+        )
+
+    def detect_emo(self, frame, landmarks, projected=None, **kwargs):
         """
-        Note that here frame is represented by hogs
+        Note that here frame is represented by hogs. projected is an optional output of
+        self.projection(frame), e.g. computed once for several models
         """
         # landmarks = np.array(landmarks)
         # landmarks = landmarks.reshape(landmarks.shape[0]*landmarks.shape[1],landmarks.shape[2],landmarks.shape[3])
@@ -43,17 +53,8 @@ class EmoSVMClassifier:
         landmarks = np.concatenate(landmarks)
         landmarks = landmarks.reshape(-1, landmarks.shape[1] * landmarks.shape[2])
 
-        pca_transformed_frame = self.pca_model.transform(
-            self.scaler.fit_transform(frame)
-        )
+        if projected is None:
+            projected = self.projection(frame)
+        pca_transformed_frame = projected["emotion"]
         feature_cbd = np.concatenate((pca_transformed_frame, landmarks), 1)
-        emo_columns = ["anger", "disgust", "fear", "happ", "sad", "sur", "neutral"]
-
-        pred_emo = []
-        for keys in emo_columns:
-            emo_pred = self.classifier[keys].predict(feature_cbd)
-            emo_pred = emo_pred  # probably need to delete this
-            pred_emo.append(emo_pred)
-
-        pred_emos = np.array(pred_emo).T
-        return pred_emos
+        return self.stacked_classifier.predict(feature_cbd)
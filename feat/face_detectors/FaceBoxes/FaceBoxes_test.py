@@ -27,6 +27,7 @@
 
 import torch
 import numpy as np
+from functools import lru_cache
 
 # import cv2
 from feat.utils import set_torch_device
@@ -40,8 +41,7 @@ from feat.face_detectors.FaceBoxes.FaceBoxes_model import FaceBoxesNet, PriorBox
 from feat.utils.io import get_resource_path
 from feat.utils.image_operations import (
     convert_color_vector_to_tensor,
-    decode,
-    py_cpu_nms,
+    decode_detections,
 )
 
 
@@ -77,6 +77,9 @@ class FaceBoxes:
         net = net.to(self.device)
         self.net = net.eval()
 
+        # Priors only depend on the image size so we keep the ones for recent sizes
+        self._get_priors = lru_cache(maxsize=8)(self._calculate_priors)
+
         (
             self.confidence_threshold,
             self.top_k,
@@ -102,66 +105,24 @@ class FaceBoxes:
 
         im_height, im_width = img.shape[-2:]
 
-        scale = torch.Tensor([im_height, im_width, im_height, im_width])
         img = img.to(self.device)
-        scale = scale.to(self.device)
 
         loc, conf = self.net(img)  # forward pass
 
-        total_boxes = []
-        for i in range(loc.shape[0]):
-            tmp_box = self._calculate_boxinfo(
-                im_height=im_height,
-                im_width=im_width,
-                loc=loc[i],
-                conf=conf[i],
-                scale=scale,
-            )
-            total_boxes.append(tmp_box)
-
-        return total_boxes
-
-    def _calculate_boxinfo(self, im_height, im_width, loc, conf, scale):
+        return decode_detections(
+            loc.data,
+            conf.data,
+            self._get_priors(im_height, im_width),
+            self.cfg["variance"],
+            (im_height, im_width),
+            top_k=self.top_k,
+            confidence_threshold=self.confidence_threshold,
+            nms_threshold=self.nms_threshold,
+            keep_top_k=self.keep_top_k,
+            detection_threshold=self.detection_threshold,
+            resize=self.resize,
+        )
 
+    def _calculate_priors(self, im_height, im_width):
         priorbox = PriorBox(self.cfg, image_size=(im_height, im_width))
-        priors = priorbox.forward()
-        boxes = decode(loc.data.squeeze(0), priors.data, self.cfg["variance"])
-        boxes = boxes * scale / self.resize
-        boxes = boxes.cpu().numpy()
-        scores = conf.squeeze(0).data.cpu().numpy()[:, 1]
-
-        # ignore low scores
-        inds = np.where(scores > self.confidence_threshold)[0]
-        boxes = boxes[inds]
-        scores = scores[inds]
-
-        # keep top-K before NMS
-        order = scores.argsort()[::-1][: self.top_k]
-        boxes = boxes[order]
-        scores = scores[order]
-
-        # do NMS
-        dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
-        keep = py_cpu_nms(dets, self.nms_threshold)
-        dets = dets[keep, :]
-
-        # keep top-K faster NMS
-        dets = dets[: self.keep_top_k, :]
-
-        # filter using detection_threshold - rescale box size to be proportional to image size
-        scale_x, scale_y = (im_width / im_height, im_height / im_width)
-        det_bboxes = []
-        for b in dets:
-            if b[4] > self.detection_threshold:
-                xmin, ymin, xmax, ymax, score = b
-                det_bboxes.append(
-                    [
-                        xmin * scale_x,
-                        ymin * scale_y,
-                        xmax * scale_x,
-                        ymax * scale_y,
-                        score,
-                    ]
-                )
-
-        return det_bboxes
+        return priorbox.forward().to(self.device)
@@ -10,63 +10,7 @@ import numpy as np
 import os
 from torch.nn.functional import interpolate
 from torchvision.ops.boxes import batched_nms
-from feat.utils.image_operations import convert_image_to_tensor
-
-
-def nms_numpy(boxes, scores, threshold, method):
-    if boxes.size == 0:
-        return np.empty((0, 3))
-
-    x1 = boxes[:, 0].copy()
-    y1 = boxes[:, 1].copy()
-    x2 = boxes[:, 2].copy()
-    y2 = boxes[:, 3].copy()
-    s = scores
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-
-    I = np.argsort(s)
-    pick = np.zeros_like(s, dtype=np.int16)
-    counter = 0
-    while I.size > 0:
-        i = I[-1]
-        pick[counter] = i
-        counter += 1
-        idx = I[0:-1]
-
-        xx1 = np.maximum(x1[i], x1[idx]).copy()
-        yy1 = np.maximum(y1[i], y1[idx]).copy()
-        xx2 = np.minimum(x2[i], x2[idx]).copy()
-        yy2 = np.minimum(y2[i], y2[idx]).copy()
-
-        w = np.maximum(0.0, xx2 - xx1 + 1).copy()
-        h = np.maximum(0.0, yy2 - yy1 + 1).copy()
-
-        inter = w * h
-        if method == "Min":
-            o = inter / np.minimum(area[i], area[idx])
-        else:
-            o = inter / (area[i] + area[idx] - inter)
-        I = I[np.where(o <= threshold)]
-
-    pick = pick[:counter].copy()
-    return pick
-
-
-def batched_nms_numpy(boxes, scores, idxs, threshold, method):
-    device = boxes.device
-    if boxes.numel() == 0:
-        return torch.empty((0,), dtype=torch.int64, device=device)
-    # strategy: in order to perform NMS independently per class.
-    # we add an offset to all the boxes. The offset is dependent
-    # only on the class idx, and is large enough so that boxes
-    # from different classes do not overlap
-    max_coordinate = boxes.max()
-    offsets = idxs.to(boxes) * (max_coordinate + 1)
-    boxes_for_nms = boxes + offsets[:, None]
-    boxes_for_nms = boxes_for_nms.cpu().numpy()
-    scores = scores.cpu().numpy()
-    keep = nms_numpy(boxes_for_nms, scores, threshold, method)
-    return torch.as_tensor(keep, dtype=torch.long, device=device)
+from feat.utils.image_operations import convert_image_to_tensor, nms
 
 
 def bbreg(boundingbox, reg):
@@ -293,8 +237,7 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
         boxes = bbreg(boxes, mv)
 
         # NMS within each image using "Min" strategy
-        # pick = batched_nms(boxes[:, :4], boxes[:, 4], image_inds, 0.7)
-        pick = batched_nms_numpy(boxes[:, :4], boxes[:, 4], image_inds, 0.7, "Min")
+        pick = nms(boxes[:, :4], boxes[:, 4], 0.7, idxs=image_inds, method="Min")
         boxes, image_inds, points = boxes[pick], image_inds[pick], points[pick]
 
     boxes = boxes.cpu().numpy()
@@ -4,18 +4,18 @@ import numpy as np
 def expand_bbox_rectangle(
     w, h, bbox_x_factor=2.0, bbox_y_factor=2.0, lms=None, expand_forehead=0.3, roll=0
 ):
-    # get a good bbox for the facial landmarks
-    min_pt_x = np.min(lms[:, 0], axis=0)
-    max_pt_x = np.max(lms[:, 0], axis=0)
+    # get a good bbox for each set of facial landmarks [N, points, 2]
+    min_pt_x = np.min(lms[..., 0], axis=-1)
+    max_pt_x = np.max(lms[..., 0], axis=-1)
 
-    min_pt_y = np.min(lms[:, 1], axis=0)
-    max_pt_y = np.max(lms[:, 1], axis=0)
+    min_pt_y = np.min(lms[..., 1], axis=-1)
+    max_pt_y = np.max(lms[..., 1], axis=-1)
 
     # find out the bbox of the crop region
-    bbox_size_x = int(np.max(max_pt_x - min_pt_x) * bbox_x_factor)
+    bbox_size_x = ((max_pt_x - min_pt_x) * bbox_x_factor).astype(int)
     center_pt_x = 0.5 * min_pt_x + 0.5 * max_pt_x
 
-    bbox_size_y = int(np.max(max_pt_y - min_pt_y) * bbox_y_factor)
+    bbox_size_y = ((max_pt_y - min_pt_y) * bbox_y_factor).astype(int)
     center_pt_y = 0.5 * min_pt_y + 0.5 * max_pt_y
 
     bbox_min_x, bbox_max_x = (
@@ -28,40 +28,33 @@ def expand_bbox_rectangle(
         center_pt_y + bbox_size_y * 0.5,
     )
 
-    if abs(roll) > 2.5:
-        expand_forehead_size = expand_forehead * np.max(max_pt_y - min_pt_y)
-        bbox_max_y += expand_forehead_size
+    # expand towards the forehead depending on the roll of each face
+    roll = np.broadcast_to(roll, min_pt_x.shape)
+    upside_down = np.abs(roll) > 2.5
+    rolled_right = ~upside_down & (roll > 1)
+    rolled_left = ~upside_down & (roll < -1)
+    upright = ~upside_down & ~rolled_right & ~rolled_left
 
-    elif roll > 1:
-        expand_forehead_size = expand_forehead * np.max(max_pt_x - min_pt_x)
-        bbox_max_x += expand_forehead_size
-
-    elif roll < -1:
-        expand_forehead_size = expand_forehead * np.max(max_pt_x - min_pt_x)
-        bbox_min_x -= expand_forehead_size
-
-    else:
-        expand_forehead_size = expand_forehead * np.max(max_pt_y - min_pt_y)
-        bbox_min_y -= expand_forehead_size
+    expand_x = expand_forehead * (max_pt_x - min_pt_x)
+    expand_y = expand_forehead * (max_pt_y - min_pt_y)
+    bbox_max_y = np.where(upside_down, bbox_max_y + expand_y, bbox_max_y)
+    bbox_max_x = np.where(rolled_right, bbox_max_x + expand_x, bbox_max_x)
+    bbox_min_x = np.where(rolled_left, bbox_min_x - expand_x, bbox_min_x)
+    bbox_min_y = np.where(upright, bbox_min_y - expand_y, bbox_min_y)
 
     bbox_min_x = bbox_min_x.astype(np.int32)
     bbox_max_x = bbox_max_x.astype(np.int32)
     bbox_min_y = bbox_min_y.astype(np.int32)
     bbox_max_y = bbox_max_y.astype(np.int32)
 
-    # compute necessary padding
-    padding_left = abs(min(bbox_min_x, 0))
-    padding_top = abs(min(bbox_min_y, 0))
-    padding_right = max(bbox_max_x - w, 0)
-    padding_bottom = max(bbox_max_y - h, 0)
-
-    # crop the image properly by computing proper crop bounds
-    crop_left = 0 if padding_left > 0 else bbox_min_x
-    crop_top = 0 if padding_top > 0 else bbox_min_y
-    crop_right = w if padding_right > 0 else bbox_max_x
-    crop_bottom = h if padding_bottom > 0 else bbox_max_y
+    # crop the image properly by computing proper crop bounds; boxes that need
+    # padding are cropped at the image border instead
+    crop_left = np.maximum(bbox_min_x, 0)
+    crop_top = np.maximum(bbox_min_y, 0)
+    crop_right = np.where(bbox_max_x > w, w, bbox_max_x)
+    crop_bottom = np.where(bbox_max_y > h, h, bbox_max_y)
 
-    return np.array([crop_left, crop_top, crop_right, crop_bottom])
+    return np.stack([crop_left, crop_top, crop_right, crop_bottom], axis=-1)
 
 
 def bbox_is_dict(bbox):
@@ -1,77 +1,73 @@
 import numpy as np
 import torch
 from scipy.spatial.transform import Rotation
-from .image_operations import bbox_is_dict, expand_bbox_rectangle
+from .image_operations import expand_bbox_rectangle
 
 
-def get_bbox_intrinsics(image_intrinsics, bbox):
+def get_bbox_intrinsics(image_intrinsics, bboxes):
     # crop principle point of view
-    bbox_center_x = bbox["left"] + ((bbox["right"] - bbox["left"]) // 2)
-    bbox_center_y = bbox["top"] + ((bbox["bottom"] - bbox["top"]) // 2)
+    bbox_center_x = bboxes[:, 0] + ((bboxes[:, 2] - bboxes[:, 0]) // 2)
+    bbox_center_y = bboxes[:, 1] + ((bboxes[:, 3] - bboxes[:, 1]) // 2)
 
-    # create a camera intrinsics from the bbox center
-    bbox_intrinsics = image_intrinsics.copy()
-    bbox_intrinsics[0, 2] = bbox_center_x
-    bbox_intrinsics[1, 2] = bbox_center_y
+    # create a camera intrinsics from each bbox center
+    bbox_intrinsics = np.repeat(image_intrinsics[None], len(bboxes), 0)
+    bbox_intrinsics[:, 0, 2] = bbox_center_x
+    bbox_intrinsics[:, 1, 2] = bbox_center_y
 
     return bbox_intrinsics
 
 
-def pose_bbox_to_full_image(pose, image_intrinsics, bbox):
-    # check if bbox is np or dict
-    bbox = bbox_is_dict(bbox)
+def pose_bbox_to_full_image(poses, image_intrinsics, bboxes):
+    # rotation vectors
+    rvecs = poses[:, :3].copy()
 
-    # rotation vector
-    rvec = pose[:3].copy()
+    # translation and scale vectors
+    tvecs = poses[:, 3:].copy()
 
-    # translation and scale vector
-    tvec = pose[3:].copy()
-
-    # get camera intrinsics using bbox
-    bbox_intrinsics = get_bbox_intrinsics(image_intrinsics, bbox)
+    # get camera intrinsics using bboxes
+    bbox_intrinsics = get_bbox_intrinsics(image_intrinsics, bboxes)
 
     # focal length
     focal_length = image_intrinsics[0, 0]
 
     # bbox_size
-    bbox_width = bbox["right"] - bbox["left"]
-    bbox_height = bbox["bottom"] - bbox["top"]
+    bbox_width = bboxes[:, 2] - bboxes[:, 0]
+    bbox_height = bboxes[:, 3] - bboxes[:, 1]
     bbox_size = bbox_width + bbox_height
 
     # adjust scale
-    tvec[2] *= focal_length / bbox_size
+    tvecs[:, 2] *= focal_length / bbox_size
 
     # project crop points using the crop camera intrinsics
-    projected_point = bbox_intrinsics.dot(tvec.T)
+    projected_points = np.einsum("nij,nj->ni", bbox_intrinsics, tvecs)
 
     # reverse the projected points using the full image camera intrinsics
-    tvec = projected_point.dot(np.linalg.inv(image_intrinsics.T))
+    tvecs = projected_points.dot(np.linalg.inv(image_intrinsics.T))
 
     # same for rotation
-    rmat = Rotation.from_rotvec(rvec).as_matrix()
+    rmats = Rotation.from_rotvec(rvecs).as_matrix()
     # project crop points using the crop camera intrinsics
-    projected_point = bbox_intrinsics.dot(rmat)
+    projected_points = bbox_intrinsics @ rmats
     # reverse the projected points using the full image camera intrinsics
-    rmat = np.linalg.inv(image_intrinsics).dot(projected_point)
-    rvec = Rotation.from_matrix(rmat).as_rotvec()
+    rmats = np.linalg.inv(image_intrinsics) @ projected_points
+    rvecs = Rotation.from_matrix(rmats).as_rotvec()
 
-    return np.concatenate([rvec, tvec])
+    return np.concatenate([rvecs, tvecs], axis=1)
 
 
-def plot_3d_landmark(verts, campose, intrinsics):
-    lm_3d_trans = transform_points(verts, campose)
+def plot_3d_landmark(verts, camposes, intrinsics):
+    lm_3d_trans = transform_points(verts, camposes)
 
     # project to image plane
-    lms_3d_trans_proj = intrinsics.dot(lm_3d_trans.T).T
-    lms_projected = (
-        lms_3d_trans_proj[:, :2] / np.tile(lms_3d_trans_proj[:, 2], (2, 1)).T
-    )
+    lms_3d_trans_proj = lm_3d_trans.dot(intrinsics.T)
+    lms_projected = lms_3d_trans_proj[..., :2] / lms_3d_trans_proj[..., 2:]
 
     return lms_projected, lms_3d_trans_proj
 
 
-def transform_points(points, pose):
-    return points.dot(Rotation.from_rotvec(pose[:3]).as_matrix().T) + pose[3:]
+def transform_points(points, poses):
+    rmats = Rotation.from_rotvec(poses[:, :3]).as_matrix()
+    return np.einsum("pj,nij->npi", points, rmats) + poses[:, None, 3:]
 
 
 def transform_pose_global_project_bbox(
@@ -108,31 +104,24 @@ def transform_pose_global_project_bbox(
     dof_std = pose_stddev
     dofs = dofs * dof_std + dof_mean
 
-    projected_boxes = []
-    global_dofs = []
-
-    for i in range(dofs.shape[0]):
-        global_dof = pose_bbox_to_full_image(dofs[i], global_intrinsics, boxes[i])
-        global_dofs.append(global_dof)
-
-        if threed_68_points is not None:
-            # project points and get bbox
-            projected_lms, _ = plot_3d_landmark(
-                threed_68_points, global_dof, global_intrinsics
-            )
-            projected_bbox = expand_bbox_rectangle(
-                w,
-                h,
-                bbox_x_factor=bbox_x_factor,
-                bbox_y_factor=bbox_y_factor,
-                lms=projected_lms,
-                roll=global_dof[2],
-                expand_forehead=expand_forehead,
-            )
-        else:
-            projected_bbox = boxes[i]
-
-        projected_boxes.append(projected_bbox)
+    global_dofs = pose_bbox_to_full_image(dofs, global_intrinsics, boxes)
+
+    if threed_68_points is not None:
+        # project points and get bboxes
+        projected_lms, _ = plot_3d_landmark(
+            threed_68_points, global_dofs, global_intrinsics
+        )
+        projected_boxes = expand_bbox_rectangle(
+            w,
+            h,
+            bbox_x_factor=bbox_x_factor,
+            bbox_y_factor=bbox_y_factor,
+            lms=projected_lms,
+            roll=global_dofs[:, 2],
+            expand_forehead=expand_forehead,
+        )
+    else:
+        projected_boxes = boxes
 
     global_dofs = torch.from_numpy(np.asarray(global_dofs)).float()
     projected_boxes = torch.from_numpy(np.asarray(projected_boxes)).float()
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import torch
 import torchvision
 from torch import Tensor, nn
@@ -45,15 +46,20 @@ class AnchorGenerator(nn.Module):
     and AnchorGenerator will output a set of sizes[i] * aspect_ratios[i] anchors
     per spatial location for feature map i.
 
+    Grid anchors are kept in a bounded LRU cache keyed by grid sizes, strides,
+    dtype and device, so they are only generated once per image size.
+
     Arguments:
         sizes (Tuple[Tuple[int]]):
         aspect_ratios (Tuple[Tuple[float]]):
+        cache_size (int): maximum number of grid anchor sets kept in the cache
     """
 
     def __init__(
         self,
         sizes=(128, 256, 512),
         aspect_ratios=(0.5, 1.0, 2.0),
+        cache_size=8,
     ):
         super(AnchorGenerator, self).__init__()
 
@@ -68,7 +74,8 @@ class AnchorGenerator(nn.Module):
         self.sizes = sizes
         self.aspect_ratios = aspect_ratios
         self.cell_anchors = None
-        self._cache = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
 
     # TODO: https://github.com/pytorch/pytorch/issues/26792
     # For every (aspect_ratios, scales) combination, output a zero-centered
@@ -154,11 +161,24 @@ class AnchorGenerator(nn.Module):
 
     def cached_grid_anchors(self, grid_sizes, strides):
         # type: (List[List[int]], List[List[Tensor]]) -> List[Tensor]
-        key = str(grid_sizes) + str(strides)
+        cell_anchors = self.cell_anchors
+        assert cell_anchors is not None
+        key = str(
+            (
+                [[int(g) for g in size] for size in grid_sizes],
+                [[int(s) for s in stride] for stride in strides],
+                cell_anchors[0].dtype,
+                cell_anchors[0].device,
+            )
+        )
         if key in self._cache:
+            self._cache.move_to_end(key)
             return self._cache[key]
         anchors = self.grid_anchors(grid_sizes, strides)
         self._cache[key] = anchors
+        # Drop the least recently used anchors so the cache can't grow unbounded
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
         return anchors
 
     def forward(self, image_list, feature_maps):
@@ -182,8 +202,6 @@ class AnchorGenerator(nn.Module):
                 anchors_in_image.append(anchors_per_feature_map)
             anchors.append(anchors_in_image)
         anchors = [torch.cat(anchors_per_image) for anchors_per_image in anchors]
-        # Clear the cache in case that memory leaks.
-        self._cache.clear()
         return anchors
 
 
@@ -6,7 +6,7 @@ from feat.transforms import Rescale
 from .img2pose_model import img2poseModel
 from feat.utils import set_torch_device
 from feat.utils.io import get_resource_path
-from feat.utils.image_operations import convert_to_euler, py_cpu_nms
+from feat.utils.image_operations import convert_to_euler, nms
 import logging
 
 
@@ -21,6 +21,7 @@ class Img2Pose:
         top_k=5000,
         keep_top_k=750,
         BORDER_SIZE=100,
+        border_fallback="always",
         DEPTH=18,
         MAX_SIZE=1400,
         MIN_SIZE=400,
@@ -39,12 +40,28 @@ class Img2Pose:
         Args:
             device (str): device to execute code. can be ['auto', 'cpu', 'cuda', 'mps']
             contrained (bool): whether to run constrained (default) or unconstrained mode
+            border_fallback (str): when to run the model again on an image padded with a white border of BORDER_SIZE
+                                   pixels if no face was found. can be ['always' (default), 'off', 'previous'];
+                                   'previous' only retries when the previous image (e.g., video frame) had a face.
+                                   'previous' is only meaningful for the frames of a video processed serially:
+                                   Detector calls reset_sequence() at the start of every detect_image() and
+                                   detect_video() call, before every batch of images and before every batch
+                                   run by a worker process (n_jobs > 1). A frame's output can still depend on
+                                   the frames processed before it in the same detect_video() call
 
         Returns:
             Img2Pose object
 
         """
 
+        if border_fallback not in ["always", "off", "previous"]:
+            raise ValueError(
+                "border_fallback must be one of ['always', 'off', 'previous']"
+            )
+        self.border_fallback = border_fallback
+        self.n_fallbacks = 0
+        self._previous_had_face = True
+
         self.device = set_torch_device(device)
 
         pose_mean = np.load(POSE_MEAN, allow_pickle=True)
@@ -112,7 +129,7 @@ class Img2Pose:
             print("Optimizer not found in model path - cannot be loaded")
 
     def __call__(self, img_):
-        """Runs scale_and_predict on each image in the passed image list
+        """Runs scale_and_predict_batch on the passed batch of images
 
         Args:
             img_ (np.ndarray): (B,C,H,W), B is batch number, H is image height, W is width and C is channel.
@@ -122,15 +139,9 @@ class Img2Pose:
                                     F is face number
         """
 
-        # Notes: vectorized version runs, but only returns results from a single image. Switching back to list version for now.
-        # preds = self.scale_and_predict(img_)
-        # return preds["boxes"], preds["poses"]
-        faces = []
-        poses = []
-        for img in img_:
-            preds = self.scale_and_predict(img)
-            faces.append(preds["boxes"])
-            poses.append(preds["poses"])
+        preds = self.scale_and_predict_batch(list(img_))
+        faces = [pred["boxes"] for pred in preds]
+        poses = [pred["poses"] for pred in preds]
 
         return faces, poses
 
@@ -144,29 +155,79 @@ class Img2Pose:
             dict: key 'pose' contains array - [yaw, pitch, roll], key 'boxes' contains 2D array of bboxes
         """
 
-        # Transform image to improve model performance. Resize the image so that both dimensions are in the range [MIN_SIZE, MAX_SIZE]
-        scale = 1
-        border_size = 0
-        if min(img.shape[-2:]) < self.MIN_SIZE or max(img.shape[-2:]) > self.MAX_SIZE:
-            logging.info(
-                f"img2pose: RESCALING WARNING: img2pose has a min img size of {self.MIN_SIZE} and a max img size of {self.MAX_SIZE} but checked value is {img.shape[-2:]}."
-            )
-            transform = Compose([Rescale(self.MAX_SIZE, preserve_aspect_ratio=True)])
-            transformed_img = transform(img)
-            img = transformed_img["Image"]
-            scale = transformed_img["Scale"]
+        return self.scale_and_predict_batch([img], euler=euler)[0]
+
+    def scale_and_predict_batch(self, imgs, euler=True):
+        """Runs a prediction on a list of images in a single forward pass. Returns detected faces and associated
+        poses for each image.
+
+        Args:
+            imgs (list): list of torch tensor images (C,H,W)
+            euler (bool): set to True to obtain euler angles, False to obtain rotation vector
+
+        Returns:
+            list: one dict per image, see scale_and_predict()
+        """
+
+        # Transform images to improve model performance. Resize each image so that both dimensions are in the range [MIN_SIZE, MAX_SIZE]
+        scales = []
+        for i, img in enumerate(imgs):
+            scale = 1
+            if (
+                min(img.shape[-2:]) < self.MIN_SIZE
+                or max(img.shape[-2:]) > self.MAX_SIZE
+            ):
+                logging.info(
+                    f"img2pose: RESCALING WARNING: img2pose has a min img size of {self.MIN_SIZE} and a max img size of {self.MAX_SIZE} but checked value is {img.shape[-2:]}."
+                )
+                transform = Compose(
+                    [Rescale(self.MAX_SIZE, preserve_aspect_ratio=True)]
+                )
+                transformed_img = transform(img)
+                imgs[i] = transformed_img["Image"]
+                scale = transformed_img["Scale"]
+            scales.append(scale)
 
         # Predict
-        preds = self.predict(img, border_size=border_size, scale=scale, euler=euler)
+        preds = self.predict_batch(imgs, border_size=0, scales=scales, euler=euler)
 
         # If the prediction is unsuccessful, try adding a white border to the image. This can improve bounding box
-        # performance on images where face takes up entire frame, and images located at edge of frame.
-        if len(preds["boxes"]) == 0:
+        # performance on images where face takes up entire frame, and images located at edge of frame. All retries
+        # of a round run together; with 'previous' a successful retry can make the next image eligible in another round
+        had_face = [len(preds_i["boxes"]) > 0 for preds_i in preds]
+        pending = [not has_face for has_face in had_face]
+        while self.border_fallback != "off":
+            retry = [
+                i
+                for i in range(len(preds))
+                if pending[i]
+                and (
+                    self.border_fallback == "always"
+                    or (had_face[i - 1] if i > 0 else self._previous_had_face)
+                )
+            ]
+            if not retry:
+                break
+
             WHITE = 255
-            border_size = self.BORDER_SIZE
-            transform = Compose([Pad(border_size, fill=WHITE)])
-            img = transform(img)
-            preds = self.predict(img, border_size=border_size, scale=scale, euler=euler)
+            transform = Compose([Pad(self.BORDER_SIZE, fill=WHITE)])
+            retry_preds = self.predict_batch(
+                [transform(imgs[i]) for i in retry],
+                border_size=self.BORDER_SIZE,
+                scales=[scales[i] for i in retry],
+                euler=euler,
+            )
+            for i, preds_i in zip(retry, retry_preds):
+                preds[i] = preds_i
+                had_face[i] = len(preds_i["boxes"]) > 0
+                pending[i] = False
+            self.n_fallbacks += len(retry)
+            logging.info(
+                f"img2pose: ran the white border fallback on {self.n_fallbacks} images so far..."
+            )
+
+        if had_face:
+            self._previous_had_face = had_face[-1]
 
         return preds
 
@@ -182,6 +243,25 @@ class Img2Pose:
         Returns:
             dict: A dictionary of bboxes and poses
 
+        """
+
+        return self.predict_batch(
+            [img], border_size=border_size, scales=[scale], euler=euler
+        )[0]
+
+    def predict_batch(self, imgs, border_size=0, scales=None, euler=True):
+        """Runs the img2pose model on a list of images in a single forward pass and returns bboxes and face poses
+        for each image.
+
+        Args:
+            imgs (list): list of torch tensor images (C,H,W); images can differ in size
+            border_size (int): if the images have a border, the width of the border (in pixels)
+            scales (list): if the images were resized, the scale factor used to resize each image
+            euler (bool): set to True to obtain euler angles, False to obtain rotation vector
+
+        Returns:
+            list: one dictionary of bboxes and poses per image
+
         """
         # For device='mps'
         # Uncommenting this line at least gets img2pose running but errors with
@@ -190,9 +270,21 @@ class Img2Pose:
 
         # img = img.to(self.device)
 
-        # Obtain prediction
-        pred = self.model.predict([img])[0]
-        # pred = self.model.predict(img)[0]
+        if scales is None:
+            scales = [1.0] * len(imgs)
+
+        # Obtain predictions for all images at once
+        preds = self.model.predict(list(imgs))
+        return [
+            self._postprocess(pred, border_size=border_size, scale=scale, euler=euler)
+            for pred, scale in zip(preds, scales)
+        ]
+
+    def _postprocess(self, pred, border_size=0, scale=1.0, euler=True):
+        """
+        helper function to filter the raw model output for one image and convert it to bboxes and face poses
+        """
+
         boxes = pred["boxes"].cpu().numpy().astype("float")
         scores = pred["scores"].cpu().numpy().astype("float")
         dofs = pred["dofs"].cpu().numpy().astype("float")
@@ -205,41 +297,40 @@ class Img2Pose:
 
         # Perform NMS
         dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
-        keep = py_cpu_nms(dets, self.nms_threshold)
-
-        # Prepare predictions
-        det_bboxes = []
-        det_dofs = []
-        for i in keep:
-            bbox = dets[i]
-
-            # Remove added image borders
-            bbox[0] = max(bbox[0] - border_size, 0) // scale
-            bbox[1] = max(bbox[1] - border_size, 0) // scale
-            bbox[2] = (bbox[2] - border_size) // scale
-            bbox[3] = (bbox[3] - border_size) // scale
-
-            # Keep bboxes with sufficiently high scores
-            score = bbox[4]
-            if score > self.detection_threshold:
-                det_bboxes.append(list(bbox))
-                det_dofs.append(dofs[i])
+        keep = nms(
+            torch.from_numpy(dets[:, :4]),
+            torch.from_numpy(dets[:, 4]),
+            self.nms_threshold,
+        ).numpy()
+
+        dets, dofs = dets[keep], dofs[keep]
+
+        # Remove added image borders
+        dets[:, :2] = np.maximum(dets[:, :2] - border_size, 0) // scale
+        dets[:, 2:4] = (dets[:, 2:4] - border_size) // scale
+
+        # Keep bboxes with sufficiently high scores
+        high_scores = dets[:, 4] > self.detection_threshold
+        dets, dofs = dets[high_scores], dofs[high_scores]
 
         # Obtain pitch, roll, yaw estimates
-        det_pose = []
-        for pose_pred in det_dofs:
-            if euler:  # Convert rotation vector into euler angles
-                pose_pred[:3] = convert_to_euler(pose_pred[:3])
+        if euler and len(dofs):  # Convert rotation vectors into euler angles
+            dofs[:, :3] = convert_to_euler(dofs[:, :3])
 
-            if self.RETURN_DIM == 3:
-                dof_pose = pose_pred[:3]  # pitch, roll, yaw (when euler=True)
-            else:
-                dof_pose = pose_pred[:]  # pitch, roll, yaw, x, y, z
+        if self.RETURN_DIM == 3:
+            dofs = dofs[:, :3]  # pitch, roll, yaw (when euler=True)
+        # otherwise pitch, roll, yaw, x, y, z
 
-            dof_pose = dof_pose.reshape(1, -1)
-            det_pose.append(list(dof_pose.flatten()))
+        return {"boxes": dets.tolist(), "poses": dofs.tolist()}
 
-        return {"boxes": det_bboxes, "poses": det_pose}
+    def reset_sequence(self):
+        """Forget the images seen so far, so that with border_fallback='previous' the next image is treated as the
+        first of a new sequence
+
+        Returns:
+            None
+        """
+        self._previous_had_face = True
 
     def set_threshold(self, threshold):
         """Alter the threshold for face detection.
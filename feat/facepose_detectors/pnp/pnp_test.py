@@ -0,0 +1,185 @@
+"""
+Landmark based head pose estimation. Solves the Perspective-n-Point (PnP) problem
+between the 68 detected facial landmarks and the reference 3D face model bundled with
+img2pose, for all faces in a batch at once.
+"""
+
+import os
+import numpy as np
+from scipy.spatial.transform import Rotation
+from feat.utils.io import get_resource_path
+from feat.utils.image_operations import convert_to_euler
+
+
+class PnP:
+    def __init__(
+        self,
+        n_iter=10,
+        RETURN_DIM=3,
+        THREED_FACE_MODEL=os.path.join(
+            get_resource_path(), "reference_3d_68_points_trans.npy"
+        ),
+    ):
+        """Creates a landmark based head pose estimator. Poses are obtained by fitting the rotation and translation
+        of a reference 3D face model so that its projection matches the detected landmarks, using the same camera
+        model as img2pose (focal length of image width + height, principal point at the image center).
+
+        Args:
+            n_iter (int): number of Levenberg-Marquardt iterations refining the initial weak perspective solution
+            RETURN_DIM (int): 3 to return [pitch, roll, yaw] or 6 to also return the [x, y, z] translation
+
+        Returns:
+            PnP object
+        """
+
+        self.threed_points = np.load(THREED_FACE_MODEL, allow_pickle=True).astype(float)
+        self.n_iter = n_iter
+        self.RETURN_DIM = RETURN_DIM
+
+    def __call__(self, frame, landmarks):
+        """Estimates the head pose of every face in a batch of images
+
+        Args:
+            frame (torch.Tensor): (B,C,H,W), B is batch number, H is image height, W is width and C is channel.
+            landmarks (list): list of lists of (68, 2) landmarks for each face in each image
+
+        Returns:
+            list: poses (B, F, [pitch, roll, yaw]) - Euler angles (in degrees) for each face in each image
+        """
+
+        height, width = frame.shape[-2:]
+        n_faces = [len(frame_landmarks) for frame_landmarks in landmarks]
+        if sum(n_faces) == 0:
+            return [[] for _ in landmarks]
+
+        points = np.stack(
+            [
+                np.asarray(face, dtype=float).reshape(-1, 2)
+                for frame_landmarks in landmarks
+                for face in frame_landmarks
+            ]
+        )
+        poses = self.solve(points, width, height)
+
+        # Obtain pitch, roll, yaw estimates
+        poses[:, :3] = convert_to_euler(poses[:, :3])
+        if self.RETURN_DIM == 3:
+            poses = poses[:, :3]
+
+        splits = np.cumsum(n_faces)[:-1]
+        return [frame_poses.tolist() for frame_poses in np.split(poses, splits)]
+
+    def solve(self, points, width, height):
+        """Solves PnP for a batch of faces
+
+        Args:
+            points (np.ndarray): (N, 68, 2) landmarks of N faces
+            width (int): image width
+            height (int): image height
+
+        Returns:
+            np.ndarray: (N, 6) rotation vectors and translations mapping the reference 3D face model to each face
+        """
+
+        focal_length = width + height
+        center = np.array([width // 2, height // 2], dtype=float)
+        model = self.threed_points
+
+        # Initialize with a weak perspective camera: a least squares affine fit of the centered points gives a
+        # scaled rotation, and the scale gives the distance to the camera
+        model_mean = model.mean(0)
+        points_mean = points.mean(1)
+        centered_model = model - model_mean
+        centered_points = points - points_mean[:, None]
+        affine = np.einsum(
+            "npi,pj->nij",
+            centered_points,
+            centered_model @ np.linalg.pinv(centered_model.T @ centered_model),
+        )
+        u, s, vt = np.linalg.svd(affine, full_matrices=False)
+        rows = u @ vt
+        rotation = np.concatenate(
+            [rows, np.cross(rows[:, 0], rows[:, 1])[:, None]], axis=1
+        )
+        depth = focal_length / s.mean(1)
+        translation = np.concatenate(
+            [(points_mean - center) * depth[:, None] / focal_length, depth[:, None]], 1
+        ) - np.einsum("nij,j->ni", rotation, model_mean)
+
+        # Refine on the full perspective camera with damped Gauss-Newton steps for all faces at once
+        damping = np.full(len(points), 1e-3)
+        residuals = self._residuals(rotation, translation, points, focal_length, center)
+        cost = (residuals**2).sum((1, 2))
+        for _ in range(self.n_iter):
+            jacobian = self._jacobian(rotation, translation, focal_length)
+            jacobian = jacobian.reshape(len(points), -1, 6)
+            hessian = np.einsum("nki,nkj->nij", jacobian, jacobian)
+            gradient = np.einsum(
+                "nki,nk->ni", jacobian, residuals.reshape(len(points), -1)
+            )
+            hessian += (
+                damping[:, None, None]
+                * np.eye(6)
+                * hessian.diagonal(axis1=1, axis2=2).mean(1)[:, None, None]
+            )
+            step = -np.linalg.solve(hessian, gradient[..., None])[..., 0]
+
+            new_rotation = Rotation.from_rotvec(step[:, :3]).as_matrix() @ rotation
+            new_translation = translation + step[:, 3:]
+            new_residuals = self._residuals(
+                new_rotation, new_translation, points, focal_length, center
+            )
+            new_cost = (new_residuals**2).sum((1, 2))
+
+            # Only accept steps that reduce the reprojection error
+            better = new_cost < cost
+            rotation = np.where(better[:, None, None], new_rotation, rotation)
+            translation = np.where(better[:, None], new_translation, translation)
+            residuals = np.where(better[:, None, None], new_residuals, residuals)
+            cost = np.where(better, new_cost, cost)
+            damping = np.where(better, damping / 10, damping * 10)
+
+        rotvec = Rotation.from_matrix(rotation).as_rotvec()
+        return np.concatenate([rotvec, translation], axis=1)
+
+    def _residuals(self, rotation, translation, points, focal_length, center):
+        """
+        helper function to compute the reprojection error of the reference 3D face model for each face
+        """
+
+        camera_points = np.einsum("nij,pj->npi", rotation, self.threed_points)
+        camera_points += translation[:, None]
+        projected = focal_length * camera_points[..., :2] / camera_points[..., 2:]
+        return projected + center - points
+
+    def _jacobian(self, rotation, translation, focal_length):
+        """
+        helper function to compute the derivative of the projected points with respect to a small rotation
+        (applied on the left) and a translation of each face; returns (N, 68, 2, 6)
+        """
+
+        rotated = np.einsum("nij,pj->npi", rotation, self.threed_points)
+        x, y, z = np.moveaxis(rotated + translation[:, None], -1, 0)
+
+        # derivative of the projection with respect to the camera coordinates
+        d_projection = np.zeros(x.shape + (2, 3))
+        d_projection[..., 0, 0] = focal_length / z
+        d_projection[..., 0, 2] = -focal_length * x / z**2
+        d_projection[..., 1, 1] = focal_length / z
+        d_projection[..., 1, 2] = -focal_length * y / z**2
+
+        # derivative of the camera coordinates: rotating by w moves a point p by w x p = -[p]x w
+        rx, ry, rz = np.moveaxis(rotated, -1, 0)
+        zeros = np.zeros_like(rx)
+        cross = np.stack(
+            [
+                np.stack([zeros, rz, -ry], -1),
+                np.stack([-rz, zeros, rx], -1),
+                np.stack([ry, -rx, zeros], -1),
+            ],
+            -2,
+        )
+        d_camera = np.concatenate(
+            [cross, np.broadcast_to(np.eye(3), cross.shape)], axis=-1
+        )
+        return d_projection @ d_camera
@@ -9,6 +9,7 @@ from feat.landmark_detectors.basenet_test import MobileNet_GDConv
 from feat.landmark_detectors.pfld_compressed_test import PFLDInference
 from feat.landmark_detectors.mobilefacenet_test import MobileFaceNet
 from feat.facepose_detectors.img2pose.img2pose_test import Img2Pose
+from feat.facepose_detectors.pnp.pnp_test import PnP
 from feat.au_detectors.StatLearning.SL_test import SVMClassifier, XGBClassifier
 from feat.emo_detectors.ResMaskNet.resmasknet_test import ResMaskNet
 from feat.emo_detectors.StatLearning.EmoSL_test import (
@@ -42,6 +43,7 @@ PRETRAINED_MODELS = {
     "facepose_model": [
         {"img2pose": Img2Pose},
         {"img2pose-c": Img2Pose},
+        {"pnp": PnP},
     ],
     "identity_model": [{"facenet": Facenet}],
 }
@@ -1,9 +1,12 @@
-from feat.detector import Detector
+import feat.detector
+from concurrent.futures.process import BrokenProcessPool
+from feat.detector import Detector, _init_worker, _run_worker_batch
 from feat.data import Fex
 from feat.utils.io import get_test_data_path
 import os
 import pytest
 import numpy as np
+import torch
 import warnings
 
 EXPECTED_FEX_WIDTH = 686
@@ -239,6 +242,244 @@ def test_detect_video(
     assert out.aus.iloc[7:].isnull().all().all()
 
 
+def test_detect_with_precomputed_faces(
+    default_detector, single_face_img, multi_face_img
+):
+    """Detection from a previous Fex should skip face/landmark detection and give the
+    same downstream predictions"""
+    imgs = [multi_face_img, single_face_img]
+    expected = default_detector.detect_image(imgs)
+
+    out = default_detector.detect_image(imgs, faces=expected, landmarks=expected)
+    assert out.shape == expected.shape
+    assert np.allclose(out.faceboxes.astype(float), expected.faceboxes.astype(float))
+    assert np.allclose(out.landmarks.astype(float), expected.landmarks.astype(float))
+    assert np.allclose(out.aus.astype(float), expected.aus.astype(float))
+
+    # Faceboxes as lists in original image coordinates, landmarks get re-detected
+    faces = [
+        [[100.0, 100.0, 300.0, 340.0, 0.99]],
+        [],
+    ]
+    out = default_detector.detect_image(
+        imgs, faces=faces, batch_size=2, output_size=512
+    )
+    assert out.shape == (2, EXPECTED_FEX_WIDTH)
+    assert np.allclose(out.faceboxes.iloc[0], [100.0, 100.0, 200.0, 240.0, 0.99])
+    assert out.aus.iloc[1].isnull().all()
+
+    with pytest.raises(ValueError):
+        _ = default_detector.detect_image(imgs, faces=faces[:1])
+
+    with pytest.raises(ValueError):
+        _ = default_detector.detect_image(imgs, landmarks=expected)
+
+
+STAGES = [
+    "detect_faces",
+    "detect_landmarks",
+    "detect_facepose",
+    "detect_aus",
+    "detect_emotions",
+    "detect_identity",
+]
+
+
+def _record_stages(detector):
+    """Wraps each stage of a detector to record the stages that run instead of being
+    loaded from a memo store"""
+    ran = []
+    for stage in STAGES:
+
+        def recorded(*args, _stage=stage, _detect=getattr(detector, stage), **kwargs):
+            ran.append(_stage)
+            return _detect(*args, **kwargs)
+
+        setattr(detector, stage, recorded)
+    return ran
+
+
+def test_detect_with_memo_dir(
+    default_detector, single_face_img, multi_face_img, tmp_path
+):
+    """Stage outputs saved to a memo_dir should be reused on later calls"""
+    memo_dir = str(tmp_path / "memo")
+    expected = default_detector.detect_image(single_face_img)
+    ran = _record_stages(default_detector)
+    out = default_detector.detect_image(single_face_img, memo_dir=memo_dir)
+    assert ran == STAGES
+
+    ran.clear()
+    out = default_detector.detect_image(single_face_img, memo_dir=memo_dir)
+    assert ran == []
+    assert np.allclose(out.aus.astype(float), expected.aus.astype(float))
+    assert np.allclose(out.emotions.astype(float), expected.emotions.astype(float))
+
+    # Changing a stage's parameters recomputes that stage and those after it
+    ran.clear()
+    _ = default_detector.detect_image(
+        single_face_img, memo_dir=memo_dir, face_detection_threshold=0.9
+    )
+    assert ran == STAGES
+
+    # Entries of precomputed faces are kept per frame, so they are reused whatever
+    # the other frames of the batch
+    imgs = [single_face_img, multi_face_img]
+    faces = default_detector.detect_image(imgs, output_size=512)
+    ran.clear()
+    _ = default_detector.detect_image(
+        imgs, output_size=512, faces=faces, memo_dir=memo_dir
+    )
+    assert ran == STAGES[1:] * 2
+    ran.clear()
+    _ = default_detector.detect_image(
+        imgs, output_size=512, batch_size=2, faces=faces, memo_dir=memo_dir
+    )
+    assert ran == []
+
+    # Detectors built differently don't share stored outputs
+    optimized = Detector(optimize=True)
+    ran = _record_stages(optimized)
+    _ = optimized.detect_image(single_face_img, memo_dir=memo_dir)
+    assert ran == STAGES
+
+
+def test_model_cache_dir(single_face_img, tmp_path):
+    """Traced models are cached and reject kwargs they can't take"""
+    cache_dir = str(tmp_path / "cache")
+    detector = Detector(model_cache_dir=cache_dir)
+    assert isinstance(detector.landmark_detector, torch.jit.ScriptModule)
+    assert len(os.listdir(cache_dir)) > 0
+
+    with pytest.raises(ValueError, match="landmark_model_kwargs"):
+        detector.detect_image(single_face_img, landmark_model_kwargs={"scale": 2})
+
+
+def test_detect_with_multiple_jobs(single_face_img, multi_face_img, single_face_mov):
+    """Parallel detection should match serial detection and preserve input order"""
+    # Lighter models keep memory down as each worker holds its own copy
+    model_kwargs = dict(au_model="svm", emotion_model="svm")
+    serial = Detector(**model_kwargs)
+    parallel = Detector(n_jobs=2, **model_kwargs)
+    assert parallel.info["n_jobs"] == 2
+
+    imgs = [multi_face_img, single_face_img] * 2
+    expected = serial.detect_image(imgs)
+    out = parallel.detect_image(imgs)
+    assert out.shape == expected.shape
+    assert (out.input == expected.input).all()
+    assert (out.frame == expected.frame).all()
+    assert np.allclose(
+        out.aus.astype(float), expected.aus.astype(float), equal_nan=True
+    )
+
+    expected = serial.detect_video(single_face_mov, skip_frames=24)
+    out = parallel.detect_video(single_face_mov, skip_frames=24)
+    assert (out.frame == expected.frame).all()
+    assert np.allclose(
+        out.emotions.astype(float), expected.emotions.astype(float), equal_nan=True
+    )
+    parallel._close_pool()
+
+    with pytest.raises(ValueError):
+        _ = Detector(n_jobs=0)
+
+
+def test_worker_init_error_is_raised(single_face_img, multi_face_img):
+    """A Detector that can't be built in a worker should raise instead of hanging"""
+    _init_worker({"face_model": "bogus"}, 1)
+    try:
+        with pytest.raises(RuntimeError, match="bogus"):
+            _run_worker_batch(None, 0, {})
+    finally:
+        feat.detector._worker_error = None
+
+    # The parent validates model names, so only the workers get the bad one
+    detector = Detector(n_jobs=2, au_model="svm", emotion_model="svm")
+    detector._detector_kwargs["face_model"] = "bogus"
+    try:
+        with pytest.raises(RuntimeError, match="could not be built.*bogus"):
+            detector.detect_image(single_face_img)
+    finally:
+        detector._close_pool()
+
+    # Only images that can't be batched together are blamed on their sizes
+    with pytest.raises(ValueError, match="same dimensions"):
+        detector.detect_image(
+            [single_face_img, multi_face_img], batch_size=2, output_size=None
+        )
+
+
+def test_worker_death_is_raised(single_face_img):
+    """A worker that dies mid-batch should raise instead of hanging"""
+    detector = Detector(n_jobs=2, au_model="svm", emotion_model="svm")
+    # Workers don't need working models to die
+    detector._detector_kwargs["face_model"] = "bogus"
+    pool = detector._get_pool()
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    with pytest.raises(RuntimeError, match="worker process died"):
+        detector.detect_image(single_face_img)
+    assert detector._pool is None
+
+
+def test_sequence_state_is_reset(default_detector, single_face_img, single_face_mov):
+    """Only the batches of one video carry state from one batch to the next"""
+    reset_sequence_state = default_detector._reset_sequence_state
+    calls = []
+
+    def counted_reset_sequence_state():
+        calls.append(1)
+        reset_sequence_state()
+
+    default_detector._reset_sequence_state = counted_reset_sequence_state
+    try:
+        default_detector.detect_image([single_face_img] * 2)
+        # Once per call and before every batch of images
+        assert len(calls) == 3
+
+        calls.clear()
+        default_detector.detect_video(single_face_mov, skip_frames=24)
+        assert len(calls) == 1
+    finally:
+        del default_detector._reset_sequence_state
+
+
+def test_detect_video_with_face_tracking(default_detector, single_face_mov):
+    """Tracking should return the same frames with a track id for every face"""
+    expected = default_detector.detect_video(single_face_mov, skip_frames=24)
+    out = default_detector.detect_video(
+        single_face_mov, skip_frames=24, face_tracking=2
+    )
+    assert len(out) == len(expected)
+    assert (out.frame == expected.frame).all()
+    assert "Track" in out.columns
+    assert out.Track.notnull().sum() == out.FaceScore.notnull().sum()
+
+
+def test_detect_video_with_motion_gate(default_detector, single_face_mov):
+    """Frames that barely change should be carried forward instead of processed"""
+    expected = default_detector.detect_video(single_face_mov, skip_frames=24)
+
+    out = default_detector.detect_video(
+        single_face_mov, skip_frames=24, motion_threshold=0
+    )
+    assert len(out) == len(expected)
+    assert not out.carried_forward.any()
+
+    out = default_detector.detect_video(
+        single_face_mov, skip_frames=24, motion_threshold=255
+    )
+    assert (out.frame == expected.frame).all()
+    assert out.carried_forward.tolist() == [False] + [True] * (len(out) - 1)
+    assert np.allclose(
+        out.aus.astype(float),
+        expected.aus.iloc[[0] * len(out)].astype(float),
+        equal_nan=True,
+    )
+
+
 def test_detect_mismatch_face_pose(default_detector):
     # Multiple Faces, 1 pose
     faces = [
@@ -1,8 +1,24 @@
+import math
+import pytest
 import numpy as np
+import torch
+from kornia.geometry.transform import warp_affine
 from torchvision.io import read_image
 from feat.transforms import Rescale
 from torchvision.transforms import Compose
 from feat.data import ImageDataset
+from feat.utils.image_operations import (
+    align_face,
+    batch_align_face,
+    batch_extract_face_from_landmarks,
+    batch_hog,
+    convert_to_euler,
+    landmark_hull_masks,
+    decode,
+    decode_detections,
+    nms,
+    py_cpu_nms,
+)
 
 # TODO: write me
 def test_rescale_single_image(single_face_img):
@@ -228,9 +244,96 @@ def test_convert68to49():
     pass
 
 
-# TODO: write me
+def _align_face_reference(img, landmarks, box_enlarge=2.5, img_size=112):
+    """Original np.mat implementation of align_face for one face and 68 landmarks"""
+    landmarks = np.asarray(landmarks).reshape(-1, 2)
+    left_eye = [float(sum(landmarks[36:42, i])) / 6.0 for i in range(2)]
+    right_eye = [float(sum(landmarks[42:48, i])) / 6.0 for i in range(2)]
+    mat2 = np.mat(
+        [left_eye + [1.0], right_eye + [1.0]]
+        + [[float(landmarks[j, 0]), float(landmarks[j, 1]), 1.0] for j in [30, 48, 54]]
+    )
+
+    delta_x = right_eye[0] - left_eye[0]
+    delta_y = right_eye[1] - left_eye[1]
+    length = math.sqrt(delta_x**2 + delta_y**2)
+    sin_val, cos_val = delta_y / length, delta_x / length
+    mat1 = np.mat([[cos_val, sin_val, 0.0], [-sin_val, cos_val, 0.0], [0.0, 0.0, 1.0]])
+    mat2 = (mat1 * mat2.T).T
+
+    center_x = (max(mat2[:, 0]).item() + min(mat2[:, 0]).item()) / 2.0
+    center_y = (max(mat2[:, 1]).item() + min(mat2[:, 1]).item()) / 2.0
+    if (max(mat2[:, 0]) - min(mat2[:, 0])) > (max(mat2[:, 1]) - min(mat2[:, 1])):
+        half_size = (
+            0.5 * box_enlarge * (max(mat2[:, 0]).item() - min(mat2[:, 0]).item())
+        )
+    else:
+        half_size = (
+            0.5 * box_enlarge * (max(mat2[:, 1]).item() - min(mat2[:, 1]).item())
+        )
+    scale = (img_size - 1) / 2.0 / half_size
+    mat3 = np.mat(
+        [
+            [scale, 0.0, scale * (half_size - center_x)],
+            [0.0, scale, scale * (half_size - center_y)],
+            [0.0, 0.0, 1.0],
+        ]
+    )
+
+    mat = mat3 * mat1
+    affine_matrix = torch.tensor(mat[0:2, :]).type(torch.float32).unsqueeze(0)
+    aligned_img = warp_affine(
+        img[None],
+        affine_matrix,
+        (img_size, img_size),
+        mode="bilinear",
+        padding_mode="zeros",
+        align_corners=False,
+    )
+
+    land_3d = np.ones((len(landmarks), 3))
+    land_3d[:, 0:2] = landmarks
+    new_landmarks = np.array((mat * np.mat(land_3d).T).T)[:, :2].astype(int)
+    return (aligned_img, new_landmarks)
+
+
 def test_align_face():
-    pass
+    rng = np.random.default_rng(0)
+    frames = torch.rand(3, 3, 200, 200) * 255
+    landmarks = rng.uniform(40, 160, size=(8, 1, 2)) + rng.normal(
+        0, 15, size=(8, 68, 2)
+    )
+    frame_index = [0, 0, 1, 2, 2, 2, 1, 0]
+
+    aligned, new_landmarks = batch_align_face(frames, landmarks, frame_index)
+    assert aligned.shape == (8, 3, 112, 112)
+    assert new_landmarks.shape == (8, 68, 2)
+
+    # Identical to the original implementation that aligned each face on its own
+    for face, face_landmarks, i, face_aligned in zip(
+        landmarks, new_landmarks, frame_index, aligned
+    ):
+        expected, expected_landmarks = _align_face_reference(frames[i], face)
+        assert torch.equal(face_aligned, expected[0])
+        assert np.array_equal(face_landmarks, expected_landmarks)
+
+        expected, expected_landmarks = align_face(frames[i], face.flatten())
+        assert torch.equal(face_aligned, expected[0])
+        assert np.array_equal(face_landmarks, expected_landmarks)
+
+    # The eyes end up level
+    eyes = new_landmarks[:, 36:48].reshape(8, 2, 6, 2).mean(2)
+    assert np.allclose(eyes[:, 0, 1], eyes[:, 1, 1], atol=1)
+
+    masked, masked_landmarks = batch_extract_face_from_landmarks(
+        frames, landmarks, frame_index
+    )
+    assert np.array_equal(masked_landmarks, new_landmarks)
+    masks = landmark_hull_masks(new_landmarks)
+    assert torch.equal(masked, aligned * masks[:, None])
+
+    with pytest.raises(ValueError):
+        batch_align_face(frames, landmarks, frame_index, landmark_type=5)
 
 
 # TODO: write me
@@ -253,21 +356,162 @@ def test_mask_image():
     pass
 
 
-# TODO: write me
 def test_convert_to_euler():
-    pass
-
-
-# TODO: write me
-def test_py_cpu_nms():
-    pass
+    rotvecs = np.random.default_rng(0).normal(size=(20, 3))
+    euler = convert_to_euler(rotvecs)
+    assert euler.shape == (20, 3)
+    for rotvec, angles in zip(rotvecs, euler):
+        assert np.allclose(convert_to_euler(rotvec), angles)
+
+    # A rotation about the x axis only changes pitch
+    assert np.allclose(convert_to_euler(np.array([np.pi / 6, 0, 0])), [-30, 0, 0])
+
+
+def test_nms():
+    boxes = torch.tensor(
+        [
+            [0.0, 0, 9, 9],
+            [1, 1, 10, 10],  # IoU ~0.68 with box 0
+            [2, 2, 7, 7],  # inside box 0: small IoU but full "Min" overlap
+            [50, 50, 59, 59],
+        ]
+    )
+    scores = torch.tensor([0.9, 0.8, 0.7, 0.6])
+
+    assert nms(boxes, scores, 0.5).tolist() == [0, 2, 3]
+    assert nms(boxes, scores, 0.7).tolist() == [0, 1, 2, 3]
+    assert nms(boxes, scores, 0.5, method="Min").tolist() == [0, 3]
+    # +1 pixel convention: boxes 0 and 1 overlap by 9x9 / (2 * 100 - 81) pixels
+    assert nms(boxes[:2], scores[:2], 81 / 119 - 1e-4).tolist() == [0]
+    assert nms(boxes[:2], scores[:2], 81 / 119 + 1e-4).tolist() == [0, 1]
+
+    # Images in a batch are processed independently
+    batch_boxes = torch.cat([boxes, boxes])
+    batch_scores = torch.cat([scores, scores + 0.05])
+    idxs = torch.tensor([0, 0, 0, 0, 1, 1, 1, 1])
+    for method in ["IoU", "Min"]:
+        keep = nms(batch_boxes, batch_scores, 0.5, idxs=idxs, method=method)
+        single = nms(boxes, scores, 0.5, method=method)
+        assert sorted(keep.tolist()) == sorted(single.tolist() + (single + 4).tolist())
+        assert (batch_scores[keep].diff() <= 0).all()
+
+    assert len(nms(torch.zeros(0, 4), torch.zeros(0), 0.5)) == 0
+    assert py_cpu_nms(torch.cat([boxes, scores[:, None]], 1).numpy(), 0.5) == [0, 2, 3]
+    with pytest.raises(ValueError):
+        nms(boxes, scores, 0.5, method="Union")
 
 
-# TODO: write me
 def test_decode():
-    pass
+    torch.manual_seed(0)
+    priors = torch.rand(100, 4)
+    loc = torch.randn(3, 100, 4) * 0.1
+    variances = [0.1, 0.2]
+
+    boxes = decode(loc[0], priors, variances)
+    assert boxes.shape == (100, 4)
+    # Boxes are centered on their priors when there is no offset
+    centered = decode(torch.zeros(100, 4), priors, variances)
+    assert torch.allclose((centered[:, :2] + centered[:, 2:]) / 2, priors[:, :2])
+
+    # Batches decode the same as individual images
+    batch_boxes = decode(loc, priors, variances)
+    assert batch_boxes.shape == (3, 100, 4)
+    for i in range(3):
+        assert torch.allclose(batch_boxes[i], decode(loc[i], priors, variances))
+
+
+def test_decode_detections():
+    torch.manual_seed(0)
+    priors = torch.rand(100, 4)
+    loc = torch.randn(3, 100, 4) * 0.1
+    conf = torch.rand(3, 100, 2)
+    conf[1, :, 1] = 0  # no faces in the second image
+    variances = [0.1, 0.2]
+    kwargs = dict(
+        top_k=50,
+        confidence_threshold=0.3,
+        nms_threshold=0.4,
+        keep_top_k=5,
+        detection_threshold=0.5,
+    )
+
+    faces = decode_detections(loc, conf, priors, variances, (40, 40), **kwargs)
+    assert len(faces) == 3
+    assert faces[1] == []
+    for i, image_faces in enumerate(faces):
+        assert len(image_faces) <= 5
+        assert all(len(face) == 5 and face[4] > 0.5 for face in image_faces)
+        # Images in a batch are processed independently
+        single = decode_detections(
+            loc[i : i + 1], conf[i : i + 1], priors, variances, (40, 40), **kwargs
+        )
+        assert single == [image_faces]
+
+    # Boxes are scaled to the image and the resize factor is undone
+    boxes = decode(loc[0], priors, variances) * 40
+    best = conf[0, :, 1].argmax()
+    assert np.allclose(faces[0][0][:4], boxes[best].tolist(), atol=1e-4)
+    resized = decode_detections(
+        loc, conf, priors, variances, (40, 40), resize=2, **kwargs
+    )
+    assert np.allclose(resized[0][0][:4], np.array(faces[0][0][:4]) / 2, atol=1e-4)
 
 
 # TODO: write me
 def test_HOGLayer_class():
     pass
+
+
+def test_batch_hog(single_face_img):
+    from skimage.feature import hog
+
+    # Real image content plus flat regions, where gradient ties are common
+    img = read_image(single_face_img)[:, :112, :112]
+    flat = (img // 64) * 64
+    images = torch.stack([img, flat, torch.flip(img, [0])])
+
+    features = batch_hog(images, orientations=8, pixels_per_cell=8, cells_per_block=2)
+    assert features.shape == (3, 5408)
+    for image, feature in zip(images, features):
+        expected = hog(
+            image.permute(1, 2, 0).numpy(),
+            orientations=8,
+            pixels_per_cell=(8, 8),
+            cells_per_block=(2, 2),
+            channel_axis=-1,
+        )
+        assert np.allclose(feature.numpy(), expected, atol=1e-6)
+
+    # Grayscale images with partial cells
+    gray = images[:, :1, :50, :45]
+    expected = hog(
+        gray[0, 0].numpy(),
+        orientations=8,
+        pixels_per_cell=(8, 8),
+        cells_per_block=(2, 2),
+    )
+    assert np.allclose(batch_hog(gray)[0].numpy(), expected, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        batch_hog(images[..., :12, :12])
+
+
+def test_landmark_hull_masks():
+    from scipy.spatial import ConvexHull
+    from skimage.measure import grid_points_in_poly
+
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(20, 90, size=(40, 1, 2))
+    landmarks = (centers + rng.normal(size=(40, 68, 2)) * 25).astype(int)
+    # Collinear landmarks on the hull and forehead slices outside of the image
+    landmarks[::3] = (landmarks[::3] // 8) * 8
+    landmarks[1::5, 0] = [-5, -3]
+    landmarks[1::5, 16] = [130, 120]
+
+    masks = landmark_hull_masks(landmarks, shape=(112, 112))
+    assert masks.shape == (40, 112, 112)
+    for mask, face in zip(masks, landmarks):
+        hull = face[ConvexHull(face).vertices]
+        expected = grid_points_in_poly((112, 112), hull[:, ::-1])
+        expected[0 : min(face[0][1], face[16][1]), face[0][0] : face[16][0]] = True
+        assert np.array_equal(mask.numpy(), expected)
@@ -1,8 +1,31 @@
 from feat.detector import Detector
 from feat.data import Fex
+from feat.facepose_detectors.img2pose.img2pose_test import Img2Pose
+from feat.facepose_detectors.img2pose.deps.rpn import AnchorGenerator
+from feat.facepose_detectors.pnp.pnp_test import PnP
+from feat.au_detectors.StatLearning.SL_test import (
+    SVMClassifier,
+    XGBClassifier,
+    NumpyTreeEnsemble,
+)
+from feat.emo_detectors.StatLearning.EmoSL_test import EmoSVMClassifier
+from feat.emo_detectors.ResMaskNet.resmasknet_test import ResMaskNet
+from feat.utils.io import get_resource_path
+from feat.utils.image_operations import convert_to_euler
+from feat.utils.inference import prepare_for_inference
+from feat.face_detectors.Retinaface.Retinaface_test import Retinaface
+from feat.face_detectors.FaceBoxes.FaceBoxes_test import FaceBoxes
+from feat.landmark_detectors.mobilefacenet_test import MobileFaceNet
+from feat.landmark_detectors.pfld_compressed_test import PFLDInference
+from feat.landmark_detectors.basenet_test import MobileNet_GDConv
+from scipy.spatial.transform import Rotation
+import xgboost as xgb
 import pytest
+import os
 import numpy as np
+import torch
 from torchvision.io import read_image
+from torchvision.models.detection.image_list import ImageList
 
 
 def is_not_third_sunday():
@@ -45,6 +68,32 @@ def test_detector_combos(
     assert out.shape[0] == 1
 
 
+def test_prepare_for_inference_parity():
+    torch.manual_seed(0)
+    models = [
+        (Retinaface(device="cpu").net, (1, 3, 120, 160)),
+        (FaceBoxes(device="cpu").net, (1, 3, 128, 160)),
+        (MobileFaceNet([112, 112], 136).eval(), (2, 3, 112, 112)),
+        (PFLDInference().eval(), (2, 3, 112, 112)),
+        (MobileNet_GDConv(136).eval(), (2, 3, 224, 224)),
+        (ResMaskNet(device="cpu").model, (2, 3, 224, 224)),
+    ]
+    for model, shape in models:
+        # Non trivial BatchNorm statistics so folding them actually changes weights
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.1, 0.1)
+                module.running_var.uniform_(0.5, 1.5)
+        x = torch.rand(shape)
+        with torch.no_grad():
+            expected = model(x)
+            output = prepare_for_inference(model)(x)
+        if isinstance(expected, torch.Tensor):
+            expected, output = [expected], [output]
+        for e, o in zip(expected, output):
+            assert torch.allclose(o, e, rtol=1e-4, atol=1e-5 * e.abs().max())
+
+
 @pytest.mark.usefixtures("default_detector", "single_face_img_data")
 class Test_Face_Models:
     """Test all pretrained face models"""
@@ -166,6 +215,80 @@ class Test_AU_Models:
         assert np.sum(np.isnan(aus)) == 0
         assert aus[0].shape[-1] == 20
 
+    def test_svm_au_matches_predict(self):
+        model = SVMClassifier()
+        rng = np.random.default_rng(0)
+        hogs = rng.normal(size=(6, model.scaler_full.n_features_in_))
+        landmarks = [rng.uniform(0, 112, size=(6, 68, 2))]
+        aus = model.detect_au(hogs, landmarks)
+        assert aus.shape == (6, 20)
+
+        # Stacked decision functions agree with each sklearn classifier
+        projected = model.projection(hogs)
+        for i, au in enumerate(model.aus_list):
+            features = np.concatenate(
+                [projected[model._au_block(au)], landmarks[0].reshape(6, -1)], 1
+            )
+            assert np.array_equal(aus[:, i], model.classifier[au].predict(features))
+        # A projection computed beforehand gives the same predictions
+        assert np.array_equal(
+            model.detect_au(hogs, landmarks, projected=projected), aus
+        )
+
+        # Predictions do not depend on the other faces in the batch
+        assert np.array_equal(model.detect_au(hogs[:1], [landmarks[0][:1]]), aus[:1])
+
+    def test_xgb_au_matches_predict_proba(self):
+        model = XGBClassifier()
+        rng = np.random.default_rng(0)
+        hogs = rng.normal(size=(6, model.scaler_full.n_features_in_))
+        landmarks = [rng.uniform(0, 112, size=(6, 68, 2))]
+        aus = model.detect_au(hogs, landmarks)
+        assert aus.shape == (6, 20)
+
+        # Cached boosters give the same probabilities as freshly loaded classifiers
+        landmarks = landmarks[0].reshape(6, -1)
+        for i, au in enumerate(model.au_keys):
+            if au in ["AU1", "AU2", "AU7"]:
+                scaler, pca = model.scaler_upper, model.pca_model_upper
+            elif au in ["AU11", "AU14", "AU17", "AU23", "AU24", "AU26"]:
+                scaler, pca = model.scaler_lower, model.pca_model_lower
+            else:
+                scaler, pca = model.scaler_full, model.pca_model_full
+            features = np.concatenate(
+                [pca.transform(scaler.transform(hogs)), landmarks], 1
+            )
+            classifier = xgb.XGBClassifier()
+            classifier.load_model(
+                os.path.join(get_resource_path(), f"July4_{au}_XGB.ubj")
+            )
+            assert np.allclose(aus[:, i], classifier.predict_proba(features)[:, 1])
+
+    def test_xgb_au_numpy_engine(self):
+        model = XGBClassifier()
+        numpy_model = XGBClassifier(engine="numpy")
+        rng = np.random.default_rng(0)
+        hogs = rng.normal(size=(8, model.scaler_full.n_features_in_))
+        landmarks = [rng.uniform(0, 112, size=(8, 68, 2))]
+        aus = numpy_model.detect_au(hogs, landmarks)
+        assert aus.shape == (8, 20)
+        assert np.allclose(aus, model.detect_au(hogs, landmarks), atol=1e-5)
+
+        # Missing values follow each split's default direction
+        features = rng.normal(size=(8, numpy_model.boosters["AU1"][0].num_features()))
+        features[::2, ::3] = np.nan
+        classifier = xgb.XGBClassifier()
+        classifier.load_model(os.path.join(get_resource_path(), "July4_AU1_XGB.ubj"))
+        ensemble = NumpyTreeEnsemble([classifier.get_booster()])
+        assert np.allclose(
+            ensemble.predict(features)[:, 0],
+            classifier.predict_proba(features)[:, 1],
+            atol=1e-5,
+        )
+
+        with pytest.raises(ValueError):
+            XGBClassifier(engine="onnx")
+
 
 @pytest.mark.usefixtures("default_detector", "single_face_img")
 class Test_Emotion_Models:
@@ -176,11 +299,100 @@ class Test_Emotion_Models:
         out = default_detector.detect_image(single_face_img)
         assert out.emotions["happiness"].values > 0.5
 
+    def test_resmasknet_batching(self):
+        model = ResMaskNet(device="cpu")
+        assert next(model.model.parameters()).device == model.device
+        rng = np.random.default_rng(0)
+        frames = torch.from_numpy(
+            rng.uniform(0, 255, size=(3, 3, 120, 160)).astype(np.float32)
+        )
+        faces = [
+            [[10, 20, 60, 80, 0.9], [-5, 70, 40, 125, 0.9]],
+            [],
+            [[100, 30, 150, 90, 0.9]],
+        ]
+        batch = model._batch_make(
+            frames, [(i, face) for i, frame in enumerate(faces) for face in frame]
+        )
+        assert batch.shape == (3, 3) + model.image_size
+        # Grayscale crops
+        assert torch.equal(batch[:, 0], batch[:, 1])
+        assert batch.min() >= 0 and batch.max() <= 1
+
+        emotions = model.detect_emo(frames, faces)
+        assert emotions.shape == (3, 7)
+        assert np.allclose(emotions.sum(1), 1, atol=1e-5)
+        assert np.allclose(
+            model.detect_emo(frames, faces, max_batch_size=2), emotions, atol=1e-5
+        )
+
+    def test_svm_emotion_matches_predict(self):
+        model = EmoSVMClassifier()
+        rng = np.random.default_rng(0)
+        hogs = rng.normal(size=(6, model.scaler.n_features_in_))
+        landmarks = [rng.uniform(0, 112, size=(6, 68, 2))]
+        emotions = model.detect_emo(hogs, landmarks)
+        assert emotions.shape == (6, 7)
+
+        features = np.concatenate(
+            [
+                model.pca_model.transform(model.scaler.transform(hogs)),
+                landmarks[0].reshape(6, -1),
+            ],
+            1,
+        )
+        for i, emotion in enumerate(model.emo_columns):
+            assert np.array_equal(
+                emotions[:, i], model.classifier[emotion].predict(features)
+            )
+
+        # The fitted scaler is used, so predictions do not depend on the batch
+        assert np.array_equal(
+            model.detect_emo(hogs[:1], [landmarks[0][:1]]), emotions[:1]
+        )
+
     def test_svm_emotion(self, default_detector, single_face_img):
         default_detector.change_model(emotion_model="svm")
+        # HOG based AU and emotion models share one stacked projection
+        assert (
+            default_detector.emotion_model.projection
+            is default_detector.au_model.projection
+        )
         out = default_detector.detect_image(single_face_img)
         assert out.emotions["happiness"].values > 0.5
 
+    def test_svm_emotion_shares_hog(self, default_detector, single_face_img):
+        default_detector.change_model(au_model="svm", emotion_model="svm")
+        batch_hog = default_detector._batch_hog
+        calls = []
+
+        def counted_batch_hog(*args, **kwargs):
+            calls.append(1)
+            return batch_hog(*args, **kwargs)
+
+        projection = default_detector.au_model.projection
+        projections = []
+
+        def counted_projection(*args, **kwargs):
+            projections.append(1)
+            return projection(*args, **kwargs)
+
+        default_detector._batch_hog = counted_batch_hog
+        default_detector.au_model.projection = counted_projection
+        default_detector.emotion_model.projection = counted_projection
+        try:
+            out = default_detector.detect_image(single_face_img)
+        finally:
+            del default_detector._batch_hog
+            default_detector.au_model.projection = projection
+            default_detector.emotion_model.projection = projection
+        # AU and emotion models reuse the same HOG features and projection within a
+        # batch
+        assert len(calls) == 1
+        assert len(projections) == 1
+        assert not out.aus.isnull().all().all()
+        assert not out.emotions.isnull().all().all()
+
 
 @pytest.mark.usefixtures("default_detector", "single_face_img", "single_face_img_data")
 class Test_Facepose_Models:
@@ -211,6 +423,117 @@ class Test_Facepose_Models:
         poses = default_detector.detect_facepose(single_face_img_data)
         assert np.allclose(poses["poses"], [0.86, -3.80, 6.60], atol=0.5)
 
+    def test_img2pose_batch(self, default_detector, single_face_img_data):
+        default_detector.change_model(facepose_model="img2pose")
+        img2pose = default_detector.facepose_detector
+
+        # A batch runs in a single forward pass with the same results per image
+        imgs = [single_face_img_data.float(), single_face_img_data.flip(-1).float()]
+        faces, poses = img2pose(torch.stack(imgs))
+        assert len(faces) == len(poses) == 2
+        for img, img_faces, img_poses in zip(imgs, faces, poses):
+            single_faces, single_poses = img2pose(img.unsqueeze(0))
+            assert np.allclose(single_faces[0], img_faces)
+            assert np.allclose(single_poses[0], img_poses)
+
+    def test_img2pose_border_fallback(self):
+        img2pose = Img2Pose(device="cpu", border_fallback="previous")
+        calls = []
+
+        def predict_batch(imgs, border_size=0, scales=None, euler=True):
+            # Images filled with 1 have a face, images filled with 2 only once padded
+            calls.append((len(imgs), border_size))
+            values = [img[0, border_size, border_size] for img in imgs]
+            return [
+                {
+                    "boxes": [[0, 0, 1, 1, 1.0]]
+                    if v == 1 or (v == 2 and border_size)
+                    else []
+                }
+                for v in values
+            ]
+
+        img2pose.predict_batch = predict_batch
+        frames = [torch.full((3, 400, 400), v) for v in [1.0, 2, 2, 0, 2]]
+
+        # Retries of a round run together; a successful retry can enable the next one
+        preds = img2pose.scale_and_predict_batch(list(frames))
+        assert [len(p["boxes"]) for p in preds] == [1, 1, 1, 0, 0]
+        assert calls == [(5, 0), (1, 100), (1, 100), (1, 100)]
+        assert img2pose.n_fallbacks == 3
+        # The last frame of the previous batch had no face
+        calls.clear()
+        img2pose.scale_and_predict_batch([frames[1]])
+        assert calls == [(1, 0)]
+        # A new sequence starts as if the previous frame had a face
+        img2pose.reset_sequence()
+        calls.clear()
+        img2pose.scale_and_predict_batch([frames[1]])
+        assert calls == [(1, 0), (1, 100)]
+
+        img2pose.border_fallback = "always"
+        calls.clear()
+        preds = img2pose.scale_and_predict_batch(list(frames))
+        assert [len(p["boxes"]) for p in preds] == [1, 1, 1, 0, 1]
+        assert calls == [(5, 0), (4, 100)]
+
+        img2pose.border_fallback = "off"
+        calls.clear()
+        preds = img2pose.scale_and_predict_batch(list(frames))
+        assert [len(p["boxes"]) for p in preds] == [1, 0, 0, 0, 0]
+        assert calls == [(5, 0)]
+
+        with pytest.raises(ValueError):
+            Img2Pose(device="cpu", border_fallback="never")
+
+    def test_pnp_facepose(self, default_detector, single_face_img):
+        pnp = PnP()
+        rotations = Rotation.from_euler(
+            "xyz", [[10, -20, 5], [-15, 30, 0]], degrees=True
+        ) * Rotation.from_rotvec([np.pi, 0, 0])
+        translations = np.array([[0.2, -0.1, 5], [-0.5, 0.3, 7]])
+        points = (
+            np.einsum("nij,pj->npi", rotations.as_matrix(), pnp.threed_points)
+            + translations[:, None]
+        )
+        landmarks = 1120 * points[..., :2] / points[..., 2:] + [320, 240]
+
+        # Poses of all faces in a batch are solved at once
+        poses = pnp(torch.zeros(3, 3, 480, 640), [[landmarks[0]], [], [landmarks[1]]])
+        assert poses[1] == []
+        expected = convert_to_euler(rotations.as_rotvec())
+        assert np.allclose(poses[0] + poses[2], expected, atol=1e-4)
+        solved = pnp.solve(
+            landmarks + np.random.default_rng(0).normal(size=(2, 68, 2)), 640, 480
+        )
+        assert np.allclose(solved[:, 3:], translations, atol=0.2)
+
+        default_detector.change_model(facepose_model="pnp")
+        out = default_detector.detect_image(single_face_img)
+        assert out.poses.shape == (len(out), 3)
+        assert not out.poses.isnull().any().any()
+        default_detector.change_model(facepose_model="img2pose")
+
+    def test_img2pose_anchor_cache(self):
+        generator = AnchorGenerator(((32,),), ((1.0,),), cache_size=2)
+
+        def generate(size):
+            images = ImageList(torch.zeros(1, 3, size, size), [(size, size)])
+            return generator(images, [torch.zeros(1, 8, size // 4, size // 4)])[0]
+
+        anchors = generate(64)
+        cached = generator._cache[next(iter(generator._cache))]
+        # Anchors for the same image size are generated once and reused
+        assert torch.equal(generate(64), anchors)
+        assert generator._cache[next(iter(generator._cache))] is cached
+        assert anchors.shape == (16 * 16, 4)
+
+        # Least recently used anchors are dropped once the cache is full
+        generate(128)
+        generate(256)
+        assert len(generator._cache) == 2
+        assert all("[16, 16]" not in key for key in generator._cache)
+
 
 @pytest.mark.usefixtures("default_detector", "multi_face_img")
 class Test_Identity_Models:
@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+import torch
+from feat.tracking import FaceTracker, MotionGate
+from feat.utils import is_list_of_lists_empty
+
+
+class MovingFaceDetector:
+    """Minimal stand-in for a Detector that 'sees' a square face moving to the right by
+    a few pixels per frame, read from the first pixel of each frame"""
+
+    def __init__(self, jump_at=None):
+        self.n_face_detections = 0
+        self.jump_at = jump_at
+
+    def face_position(self, frame):
+        x = float(frame[0, 0, 0, 0])
+        if self.jump_at is not None and x >= self.jump_at:
+            x += 200
+        return x
+
+    def detect_faces(self, frame, threshold=0.5):
+        self.n_face_detections += 1
+        x = self.face_position(frame)
+        return [[[x, 50.0, x + 100.0, 150.0, 0.99]]]
+
+    def detect_landmarks(self, frame, detected_faces):
+        if is_list_of_lists_empty(detected_faces):
+            return detected_faces
+        # Landmarks follow the true face as long as it's inside the box we were given
+        x = self.face_position(frame)
+        landmarks = []
+        for face in detected_faces[0]:
+            if face[0] - 20 < x < face[2]:
+                points = np.stack(
+                    [np.linspace(x + 10, x + 90, 68), np.linspace(60, 140, 68)], axis=1
+                )
+            else:
+                points = np.stack(
+                    [np.linspace(face[0], face[0] + 5, 68), np.linspace(60, 65, 68)],
+                    axis=1,
+                )
+            landmarks.append(points)
+        return [landmarks]
+
+
+def make_frames(n_frames, step=3):
+    frames = torch.zeros(n_frames, 3, 4, 4)
+    frames[:, 0, 0, 0] = torch.arange(n_frames) * step
+    return frames
+
+
+def test_face_tracker_amortizes_detection():
+    detector = MovingFaceDetector()
+    tracker = FaceTracker(detect_every=5)
+    frames = make_frames(20)
+
+    faces, landmarks = tracker(detector, frames, list(range(20)), 0.5, {}, {})
+    assert len(faces) == len(landmarks) == 20
+    assert detector.n_face_detections == 4
+    # Propagated boxes follow the face
+    for i, frame_faces in enumerate(faces):
+        assert np.allclose(frame_faces[0][:4], [3 * i, 50, 3 * i + 100, 150], atol=4)
+    # One stable track
+    assert all(ids == [0] for ids in tracker.track_ids.values())
+
+    # State carries across batches
+    faces, _ = tracker(detector, make_frames(25)[20:], list(range(20, 25)), 0.5, {}, {})
+    assert detector.n_face_detections == 5
+    assert tracker.track_ids[24] == [0]
+
+
+def test_face_tracker_redetects_lost_track():
+    detector = MovingFaceDetector(jump_at=30)
+    tracker = FaceTracker(detect_every=100)
+    frames = make_frames(20)
+
+    faces, _ = tracker(detector, frames, list(range(20)), 0.5, {}, {})
+    # Face jumps away at frame 10, which forces a new detection and a new track
+    assert detector.n_face_detections == 2
+    assert np.allclose(faces[10][0][:4], [230, 50, 330, 150], atol=4)
+    assert tracker.track_ids[9] == [0]
+    assert tracker.track_ids[10] == [1]
+
+    with pytest.raises(ValueError):
+        FaceTracker(detect_every=0)
+
+
+def test_motion_gate():
+    gate = MotionGate(threshold=5)
+    frames = torch.zeros(6, 3, 64, 64)
+    frames[2:] += 3
+    frames[4:] += 3
+    # Compared to the last processed frame rather than the previous one
+    assert gate(frames).tolist() == [True, False, False, False, True, False]
+    # State carries across batches
+    assert gate(frames[-1:] + 10).tolist() == [True]
+    assert gate.n_skipped == 4
+    assert gate.thumbnails(frames).shape == (6, 32, 32)
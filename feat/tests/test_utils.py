@@ -1,15 +1,25 @@
+import os
 import pytest
 import numpy as np
 from os.path import join
 from feat.utils.io import (
+    StageMemo,
     get_test_data_path,
     read_feat,
     read_openface,
 )
 from feat.utils.image_operations import registration
 from feat.plotting import load_viz_model
-from feat.utils.stats import softmax
-from feat import Fex
+from feat.utils.stats import softmax, StackedProjection
+from feat.utils.quantization import calibration_faces, quantize_model
+from feat.utils.inference import (
+    fuse_conv_bn,
+    prepare_for_inference,
+    ChannelsLast,
+    TracedModelCache,
+)
+from feat import Fex, Detector
+import torch
 
 
 def test_read_feat():
@@ -44,6 +54,168 @@ def test_utils():
         load_viz_model("badfile")
 
 
+def test_stacked_projection():
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(50, 30)) * rng.uniform(1, 5, size=30) + 2
+    scaler = StandardScaler().fit(X)
+    pca = PCA(n_components=5).fit(scaler.transform(X))
+    centerer = StandardScaler(with_std=False).fit(X)
+    whitened = PCA(n_components=3, whiten=True).fit(centerer.transform(X))
+    projection = StackedProjection(
+        {"pca": (scaler, pca), "whitened": (centerer, whitened)}
+    )
+    assert projection.weight.shape == (30, 8)
+
+    out = projection(X[:7])
+    assert np.allclose(out["pca"], pca.transform(scaler.transform(X[:7])))
+    assert np.allclose(out["whitened"], whitened.transform(centerer.transform(X[:7])))
+
+
 # TODO: write me
 def test_set_torch_device():
     pass
+
+
+def test_quantize_model():
+    faces = calibration_faces(112)
+    assert faces.shape == (10, 3, 112, 112)
+    assert faces.min() >= 0 and faces.max() <= 1
+    gray = calibration_faces(112, grayscale=True)
+    assert torch.equal(gray[:, 0], gray[:, 2])
+
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=2),
+        torch.nn.BatchNorm2d(8),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, 4),
+    ).eval()
+    with torch.no_grad():
+        expected = model(faces)
+    quantized = quantize_model(model, faces)
+    assert any(
+        isinstance(module, torch.ao.nn.quantized.Conv2d)
+        for module in quantized.modules()
+    )
+    with torch.no_grad():
+        output = quantized(faces)
+    assert output.dtype == torch.float32
+    assert torch.allclose(output, expected, atol=0.05 * expected.abs().max())
+
+    # Targeting another backend leaves the process' quantized engine alone
+    engine = torch.backends.quantized.engine
+    other = [
+        backend
+        for backend in torch.backends.quantized.supported_engines
+        if backend not in [engine, "none"]
+    ]
+    if other:
+        quantized = quantize_model(model, faces, backend=other[0])
+        assert torch.backends.quantized.engine == engine
+        with torch.no_grad():
+            assert quantized(faces).shape == expected.shape
+
+    with pytest.raises(ValueError):
+        Detector(device="cuda", quantize=True)
+
+
+class ConvBNResidual(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv1 = torch.nn.Conv2d(3, 8, 3, padding=1)
+        self.bn1 = torch.nn.BatchNorm2d(8)
+        self.conv2 = torch.nn.Conv2d(8, 8, 3, padding=1)
+        self.bn2 = torch.nn.BatchNorm2d(8)
+
+    def forward(self, x):
+        x = torch.relu(self.bn1(self.conv1(x)))
+        y = self.conv2(x)
+        # conv2's output is also used by the residual, so bn2 can't be folded into it
+        return self.bn2(y) + y
+
+
+def test_prepare_for_inference():
+    torch.manual_seed(0)
+    model = ConvBNResidual().eval()
+    for bn in [model.bn1, model.bn2]:
+        bn.running_mean.uniform_(-1, 1)
+        bn.running_var.uniform_(0.5, 2)
+    x = torch.rand(2, 3, 16, 16)
+    with torch.no_grad():
+        expected = model(x)
+
+    fused = fuse_conv_bn(model)
+    n_bn = sum(isinstance(m, torch.nn.BatchNorm2d) for m in fused.modules())
+    assert n_bn == 1
+    prepared = prepare_for_inference(model)
+    assert isinstance(prepared, ChannelsLast)
+    with torch.no_grad():
+        assert torch.allclose(fused(x), expected, atol=1e-5)
+        assert torch.allclose(prepared(x), expected, atol=1e-5)
+
+    # Models that can't be traced are left as they are
+    class Untraceable(torch.nn.Module):
+        def forward(self, x):
+            return x if x.sum() > 0 else -x
+
+    untraceable = Untraceable()
+    assert fuse_conv_bn(untraceable) is untraceable
+
+
+def test_traced_model_cache(tmp_path, monkeypatch):
+    torch.manual_seed(0)
+    model = ConvBNResidual().eval()
+    weight_file = str(tmp_path / "weights.pth")
+    torch.save(model.state_dict(), weight_file)
+    cache = TracedModelCache(str(tmp_path / "cache"))
+    key = cache.key("model", [weight_file], optimize=True)
+    assert key == cache.key("model", [weight_file], optimize=True)
+    assert key != cache.key("model", [weight_file], optimize=False)
+    assert key != cache.key("other", [weight_file], optimize=True)
+    assert cache.load(key) is None
+    # Models traced by another py-feat version aren't reused
+    with monkeypatch.context() as patch:
+        patch.setattr("feat.utils.inference.__version__", "0.0.0")
+        assert cache.key("model", [weight_file], optimize=True) != key
+
+    x = torch.rand(2, 3, 16, 16)
+    with torch.no_grad():
+        expected = model(x)
+        traced = cache.save(key, prepare_for_inference(model), x[:1])
+        assert torch.allclose(traced(x), expected, atol=1e-5)
+        loaded = cache.load(key)
+        assert isinstance(loaded, torch.jit.ScriptModule)
+        # Traced models also run on other input sizes
+        assert torch.allclose(loaded(x), expected, atol=1e-5)
+        x = torch.rand(1, 3, 24, 20)
+        assert torch.allclose(loaded(x), model(x), atol=1e-5)
+
+    # Replacing the weight file gives a different key
+    mtime = os.stat(weight_file).st_mtime_ns
+    torch.save(model.state_dict(), weight_file)
+    os.utime(weight_file, ns=(mtime + 10**9, mtime + 10**9))
+    assert cache.key("model", [weight_file], optimize=True) != key
+
+
+def test_hash_detections():
+    landmarks = np.random.default_rng(0).uniform(0, 500, size=(68, 2))
+    [key] = StageMemo.hash_detections([[landmarks]])
+    assert [key] == StageMemo.hash_detections([[landmarks.tolist()]])
+
+    # Differences numpy's repr would round away or truncate still change the key
+    changed = landmarks.copy()
+    changed[30, 1] += 1e-12
+    assert repr([[changed]]) == repr([[landmarks]])
+    assert StageMemo.hash_detections([[changed]]) != [key]
+    # Each frame is keyed on its own detections only
+    faces = [[0, 0, 10, 10, 0.9], [5, 5, 20, 20, 0.8]]
+    keys = StageMemo.hash_detections([faces, [], faces[:1]])
+    assert keys[0] not in keys[1:]
+    assert keys == StageMemo.hash_detections([faces]) + StageMemo.hash_detections(
+        [[], faces[:1]]
+    )
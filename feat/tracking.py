@@ -0,0 +1,235 @@
+"""
+Helpers to amortize detection across consecutive video frames
+"""
+
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from feat.utils.image_operations import BBox
+
+__all__ = ["FaceTracker", "MotionGate"]
+
+
+class FaceTracker(object):
+    """Tracks faces across consecutive frames of a video so the face detector only
+    needs to run every `detect_every` frames. In between, each face's bounding box is
+    propagated from its landmarks in the previous frame and landmarks are re-detected
+    inside it. If a propagated box no longer agrees with the box implied by the new
+    landmarks, the track is considered lost and the face detector is run again on that
+    frame. Every track keeps a stable id for as long as it is followed.
+
+    Args:
+        detect_every (int): run the face detector at least every this many frames
+        min_overlap (float): value between 0-1; minimum overlap between a propagated
+        box and the box implied by its new landmarks to keep tracking without
+        re-detecting faces
+        match_overlap (float): value between 0-1; minimum overlap to assign a newly
+        detected face to an existing track rather than starting a new one
+    """
+
+    def __init__(self, detect_every=10, min_overlap=0.5, match_overlap=0.3):
+        if detect_every < 1:
+            raise ValueError("detect_every must be at least 1")
+        self.detect_every = detect_every
+        self.min_overlap = min_overlap
+        self.match_overlap = match_overlap
+        self.reset()
+
+    def reset(self):
+        """Forget all tracks and per-frame track ids"""
+        self.tracks = []
+        self.next_id = 0
+        self.frames_since_detection = 0
+        self.track_ids = {}
+        self.n_detections = 0
+        self.n_frames = 0
+
+    def __call__(
+        self,
+        detector,
+        frames,
+        frame_numbers,
+        threshold,
+        face_model_kwargs,
+        landmark_model_kwargs,
+    ):
+        """Get faces and landmarks for a batch of consecutive frames
+
+        Args:
+            detector (Detector): detector whose face and landmark models are used
+            frames (torch.Tensor): batch of frames [batch, channels, height, width]
+            frame_numbers (list): frame number of each frame, used to record track ids
+            threshold (float): face detection threshold
+            face_model_kwargs (dict): face model kwargs
+            landmark_model_kwargs (dict): landmark model kwargs
+
+        Returns:
+            tuple: faces, landmarks in the same format as Detector.detect_faces() and
+            Detector.detect_landmarks()
+        """
+
+        faces, landmarks = [], []
+        for frame, frame_number in zip(frames, frame_numbers):
+            frame = frame.unsqueeze(0)
+            frame_faces, frame_landmarks = None, None
+
+            if self.tracks and self.frames_since_detection < self.detect_every:
+                frame_faces, frame_landmarks = self._propagate(
+                    detector, frame, landmark_model_kwargs
+                )
+
+            if frame_faces is None:
+                frame_faces = detector.detect_faces(
+                    frame, threshold=threshold, **face_model_kwargs
+                )[0]
+                frame_landmarks = detector.detect_landmarks(
+                    frame, detected_faces=[frame_faces], **landmark_model_kwargs
+                )[0]
+                self._start_tracks(frame_faces, frame_landmarks)
+                self.frames_since_detection = 0
+                self.n_detections += 1
+
+            self.frames_since_detection += 1
+            self.n_frames += 1
+            self.track_ids[frame_number] = [track["id"] for track in self.tracks]
+            faces.append(frame_faces)
+            landmarks.append(frame_landmarks)
+
+        logging.info(
+            f"face tracking: ran face detection on {self.n_detections}/{self.n_frames} frames..."
+        )
+        return faces, landmarks
+
+    def _propagate(self, detector, frame, landmark_model_kwargs):
+        """Helper function to move every track to the next frame. Returns None, None if
+        any track is lost."""
+
+        faces = [self._box_from_landmarks(track) for track in self.tracks]
+        landmarks = detector.detect_landmarks(
+            frame, detected_faces=[faces], **landmark_model_kwargs
+        )[0]
+
+        updated = []
+        for face, landmark, track in zip(faces, landmarks, self.tracks):
+            track = dict(track, landmarks=np.asarray(landmark))
+            new_face = self._box_from_landmarks(track)
+            if BBox(face[:4]).overlap(BBox(new_face[:4])) < self.min_overlap:
+                logging.info(f"face tracking: lost track {track['id']}...")
+                return None, None
+            updated.append(track)
+
+        self.tracks = updated
+        return faces, landmarks
+
+    def _start_tracks(self, faces, landmarks):
+        """Helper function to replace the current tracks with newly detected faces,
+        keeping the id of the existing track each face overlaps the most"""
+
+        tracks = []
+        unmatched = list(self.tracks)
+        for face, landmark in zip(faces, landmarks):
+            overlaps = [
+                BBox(face[:4]).overlap(BBox(track["face"][:4])) for track in unmatched
+            ]
+            if overlaps and max(overlaps) >= self.match_overlap:
+                track_id = unmatched.pop(int(np.argmax(overlaps)))["id"]
+            else:
+                track_id = self.next_id
+                self.next_id += 1
+
+            landmark = np.asarray(landmark)
+            tracks.append(
+                {
+                    "id": track_id,
+                    "face": list(face),
+                    "landmarks": landmark,
+                    "offset": self._box_offset(face, landmark),
+                }
+            )
+        self.tracks = tracks
+
+    @staticmethod
+    def _box_offset(face, landmarks):
+        """Helper function to express a face box relative to its landmarks' extent"""
+        left, top = landmarks.min(axis=0)
+        right, bottom = landmarks.max(axis=0)
+        width, height = max(right - left, 1), max(bottom - top, 1)
+        return (np.array(face[:4]) - [left, top, left, top]) / [
+            width,
+            height,
+            width,
+            height,
+        ]
+
+    @staticmethod
+    def _box_from_landmarks(track):
+        """Helper function to place a track's face box around its current landmarks"""
+        landmarks = track["landmarks"]
+        left, top = landmarks.min(axis=0)
+        right, bottom = landmarks.max(axis=0)
+        width, height = max(right - left, 1), max(bottom - top, 1)
+        box = np.array([left, top, left, top]) + track["offset"] * [
+            width,
+            height,
+            width,
+            height,
+        ]
+        return list(box) + [track["face"][4]]
+
+
+class MotionGate(object):
+    """Cheap frame-difference gate that decides which video frames changed enough to be
+    worth running detection on. Frames are compared as tiny grayscale thumbnails to
+    the last frame that was let through, so slow drift still eventually triggers
+    detection.
+
+    Args:
+        threshold (float): minimum mean absolute difference in pixel intensity (0-255)
+        between thumbnails for a frame to be processed
+        thumbnail_size (int): size of the square grayscale thumbnails
+    """
+
+    def __init__(self, threshold, thumbnail_size=32):
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.reset()
+
+    def reset(self):
+        """Forget the reference frame"""
+        self.reference = None
+        self.n_skipped = 0
+        self.n_frames = 0
+
+    def thumbnails(self, frames):
+        """Convert a batch of frames [batch, channels, height, width] to grayscale
+        thumbnails [batch, thumbnail_size, thumbnail_size]"""
+        frames = frames.float()
+        if frames.shape[1] == 3:
+            weights = torch.tensor([0.299, 0.587, 0.114], device=frames.device)
+            frames = (frames * weights.view(1, 3, 1, 1)).sum(1, keepdim=True)
+        else:
+            frames = frames.mean(1, keepdim=True)
+        return F.adaptive_avg_pool2d(frames, self.thumbnail_size)[:, 0]
+
+    def __call__(self, frames):
+        """Decide which frames in a batch of consecutive frames should be processed
+
+        Args:
+            frames (torch.Tensor): batch of frames [batch, channels, height, width]
+
+        Returns:
+            np.ndarray: boolean mask of frames to process
+        """
+        keep = np.zeros(len(frames), dtype=bool)
+        for i, thumbnail in enumerate(self.thumbnails(frames)):
+            if (
+                self.reference is None
+                or (thumbnail - self.reference).abs().mean() >= self.threshold
+            ):
+                self.reference = thumbnail
+                keep[i] = True
+        self.n_frames += len(keep)
+        self.n_skipped += int((~keep).sum())
+        logging.info(f"motion gate: skipped {self.n_skipped}/{self.n_frames} frames...")
+        return keep
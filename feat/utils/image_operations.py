@@ -8,15 +8,14 @@ from .io import get_resource_path
 import math
 import numpy as np
 import pandas as pd
-from scipy.spatial import ConvexHull
 from scipy.spatial.transform import Rotation
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torchvision.transforms import PILToTensor, Compose
+from torchvision.ops import batched_nms
 import PIL
 from kornia.geometry.transform import warp_affine
-from skimage.morphology.convex_hull import grid_points_in_poly
 from feat.transforms import Rescale
 from feat.utils import set_torch_device
 from copy import deepcopy
@@ -31,9 +30,12 @@ __all__ = [
     "registration",
     "convert68to49",
     "extract_face_from_landmark",
+    "batch_extract_face_from_landmarks",
     "extract_face_from_bbox",
+    "landmark_hull_masks",
     "convert68to49",
     "align_face",
+    "batch_align_face",
     "BBox",
     "round_vals",
     "reverse_color_order",
@@ -42,8 +44,10 @@ __all__ = [
     "convert_color_vector_to_tensor",
     "mask_image",
     "convert_to_euler",
+    "nms",
     "py_cpu_nms",
     "decode",
+    "batch_hog",
 ]
 
 # Neutral face coordinates
@@ -120,36 +124,149 @@ def extract_face_from_landmarks(frame, landmarks, face_size=112):
     if len(frame.shape) != 4:
         frame = frame.unsqueeze(0)
 
-    landmarks = np.array(landmarks).copy()
+    masked_image, new_landmarks = batch_extract_face_from_landmarks(
+        frame, np.array(landmarks)[None], frame_index=[0], face_size=face_size
+    )
+    return (masked_image, new_landmarks[0])
+
+
+def batch_extract_face_from_landmarks(
+    frames, landmarks, frame_index=None, face_size=112
+):
+    """Extract a batch of faces like extract_face_from_landmarks: every face is
+    aligned, then everything outside of the convex hull of its landmarks and its
+    forehead is masked out, all in one pass.
+
+    Args:
+        frames (torch.Tensor): (B, C, H, W) frames containing the faces
+        landmarks (np.ndarray): (N, 68, 2) landmarks of N faces
+        frame_index (list): index of the frame each face is in; default None means
+        face i is in frame i
+        face_size (int): output size of the faces
+
+    Returns:
+        masked_image (torch.Tensor): (N, C, face_size, face_size) masked faces
+        new_landmarks (np.ndarray): (N, 68, 2) landmarks of the aligned faces
+    """
 
-    aligned_img, new_landmarks = align_face(
-        frame,
-        landmarks.flatten(),
+    aligned_img, new_landmarks = batch_align_face(
+        frames,
+        landmarks,
+        frame_index=frame_index,
         landmark_type=68,
         box_enlarge=2.5,
         img_size=face_size,
     )
-
-    hull = ConvexHull(new_landmarks)
-    mask = grid_points_in_poly(
-        shape=aligned_img.shape[-2:],
-        # for some reason verts need to be flipped
-        verts=list(
-            zip(
-                new_landmarks[hull.vertices][:, 1],
-                new_landmarks[hull.vertices][:, 0],
-            )
-        ),
-    )
-    mask[
-        0 : np.min([new_landmarks[0][1], new_landmarks[16][1]]),
-        new_landmarks[0][0] : new_landmarks[16][0],
-    ] = True
-    masked_image = mask_image(aligned_img, mask)
+    masks = landmark_hull_masks(new_landmarks, shape=aligned_img.shape[-2:])
+    masked_image = aligned_img * masks[:, None].to(aligned_img.device, torch.float32)
 
     return (masked_image, new_landmarks)
 
 
+def landmark_hull_masks(landmarks, shape=(112, 112)):
+    """Rasterize the convex hull of the landmarks of a batch of faces, together with
+    the rectangle above the eyebrows between the outer landmarks of the jaw (0 and 16)
+    that covers the forehead.
+
+    Hull edges are the pairs of landmarks that have every other landmark on their left
+    and a pixel is in the hull if it is on the left of (or on) every edge. With integer
+    landmarks all tests are exact, so pixels on the boundary are included like
+    skimage's grid_points_in_poly does.
+
+    Args:
+        landmarks (np.ndarray): (N, 68, 2) integer [x, y] landmarks of N faces
+        shape (tuple): (height, width) of the masks
+
+    Returns:
+        torch.Tensor: (N, height, width) boolean masks
+    """
+
+    landmarks = torch.as_tensor(np.asarray(landmarks), dtype=torch.int64)
+    height, width = shape
+
+    def cross(origin, end, point):
+        # > 0 if point is on the left of origin -> end
+        edge, offset = end - origin, point - origin
+        return edge[..., 0] * offset[..., 1] - edge[..., 1] * offset[..., 0]
+
+    # Landmarks strictly inside the octagon of the extreme landmarks along the axes
+    # and diagonals can't be hull vertices, so only the others are candidates
+    x, y = landmarks[..., 0], landmarks[..., 1]
+    extremes = torch.stack(
+        [
+            x.argmin(1),
+            (x + y).argmin(1),
+            y.argmin(1),
+            (y - x).argmin(1),
+            x.argmax(1),
+            (x + y).argmax(1),
+            y.argmax(1),
+            (y - x).argmax(1),
+        ],
+        1,
+    )
+    octagon = torch.gather(landmarks, 1, extremes[..., None].expand(-1, -1, 2))
+    next_octagon = octagon.roll(-1, 1)
+    sides = cross(octagon[:, :, None], next_octagon[:, :, None], landmarks[:, None])
+    # The same landmark can be extreme along several directions
+    degenerate = (octagon == next_octagon).all(-1)[..., None]
+    inside = ((sides > 0) | degenerate).all(1) | ((sides < 0) | degenerate).all(1)
+    order = torch.argsort(inside.to(torch.int8), dim=1, stable=True)
+    candidates = torch.gather(landmarks, 1, order[..., None].expand(-1, -1, 2))
+
+    # Faces with fewer candidates are padded with some of their interior landmarks,
+    # which don't change the hull
+    candidates = candidates[:, : int((~inside).sum(1).max())]
+
+    # Hull edges are the pairs of candidates with every candidate on their left.
+    # With pairwise[i, j] = x_i * y_j - y_i * x_j, the orientation of the triangle
+    # (i, j, k) is pairwise[i, j] + pairwise[j, k] + pairwise[k, i]
+    cx, cy = candidates[..., 0], candidates[..., 1]
+    pairwise = cx[:, :, None] * cy[:, None, :] - cy[:, :, None] * cx[:, None, :]
+    orientation = (
+        pairwise[:, :, :, None]
+        + pairwise[:, None, :, :]
+        + pairwise.transpose(1, 2)[:, :, None, :]
+    )
+    is_edge = (orientation >= 0).all(-1)
+    is_edge &= (candidates[:, :, None] != candidates[:, None, :]).any(-1)
+
+    # Each edge (start -> start + direction) keeps the pixels with
+    # dx * (row - sy) - dy * (col - sx) >= 0. On every row that bounds col from above
+    # when dy > 0, from below when dy < 0 and keeps or drops the whole row when
+    # dy == 0. Bounds are rounded with exact integer division.
+    face, start, end = is_edge.nonzero(as_tuple=True)
+    sx, sy = candidates[face, start].T
+    dx, dy = (candidates[face, end] - candidates[face, start]).T
+    rows = torch.arange(height)
+    offset = dx[:, None] * (rows[None, :] - sy[:, None])
+    bound = torch.div(offset, dy.clamp(min=1)[:, None], rounding_mode="floor")
+    upper = torch.where(dy[:, None] > 0, sx[:, None] + bound, width)
+    bound = torch.div(offset, (-dy).clamp(min=1)[:, None], rounding_mode="floor")
+    lower = torch.where(dy[:, None] < 0, sx[:, None] - bound, 0)
+    empty = (dy[:, None] == 0) & (offset < 0)
+    upper = torch.where(empty, -1, upper)
+
+    right = torch.full((len(landmarks), height), width, dtype=torch.int64)
+    right = right.scatter_reduce(0, face[:, None].expand(-1, height), upper, "amin")
+    left = torch.zeros((len(landmarks), height), dtype=torch.int64)
+    left = left.scatter_reduce(0, face[:, None].expand(-1, height), lower, "amax")
+
+    rows, cols = rows[None, :, None], torch.arange(width)[None, None, :]
+    masks = (cols >= left[..., None]) & (cols <= right[..., None])
+
+    # Forehead: mask[0 : min(y0, y16), x0 : x16] with python slicing semantics
+    def slice_index(index, length):
+        index = torch.where(index < 0, index + length, index)
+        return index.clamp(0, length)[:, None, None]
+
+    bottom = slice_index(torch.minimum(landmarks[:, 0, 1], landmarks[:, 16, 1]), height)
+    start = slice_index(landmarks[:, 0, 0], width)
+    stop = slice_index(landmarks[:, 16, 0], width)
+    forehead = (rows < bottom) & (cols >= start) & (cols < stop)
+    return masks | forehead
+
+
 def extract_face_from_bbox(frame, detected_faces, face_size=112, expand_bbox=1.2):
     """Extract face from image and resize
 
@@ -248,175 +365,116 @@ def align_face(img, landmarks, landmark_type=68, box_enlarge=2.5, img_size=112):
         new_landmarks: aligned landmarks
     """
 
-    if landmark_type == 68:
-        left_eye0 = (
-            float(
-                landmarks[2 * 36]
-                + landmarks[2 * 37]
-                + landmarks[2 * 38]
-                + landmarks[2 * 39]
-                + landmarks[2 * 40]
-                + landmarks[2 * 41]
-            )
-            / 6.0
-        )
-        left_eye1 = (
-            float(
-                landmarks[2 * 36 + 1]
-                + landmarks[2 * 37 + 1]
-                + landmarks[2 * 38 + 1]
-                + landmarks[2 * 39 + 1]
-                + landmarks[2 * 40 + 1]
-                + landmarks[2 * 41 + 1]
-            )
-            / 6.0
-        )
-        right_eye0 = (
-            float(
-                landmarks[2 * 42]
-                + landmarks[2 * 43]
-                + landmarks[2 * 44]
-                + landmarks[2 * 45]
-                + landmarks[2 * 46]
-                + landmarks[2 * 47]
-            )
-            / 6.0
-        )
-        right_eye1 = (
-            float(
-                landmarks[2 * 42 + 1]
-                + landmarks[2 * 43 + 1]
-                + landmarks[2 * 44 + 1]
-                + landmarks[2 * 45 + 1]
-                + landmarks[2 * 46 + 1]
-                + landmarks[2 * 47 + 1]
-            )
-            / 6.0
-        )
+    # warp_affine expects [batch, channel, height, width]
+    if img.ndim == 3:
+        img = img[None, :]
 
-        mat2 = np.mat(
-            [
-                [left_eye0, left_eye1, 1],
-                [right_eye0, right_eye1, 1],
-                [float(landmarks[2 * 30]), float(landmarks[2 * 30 + 1]), 1.0],
-                [float(landmarks[2 * 48]), float(landmarks[2 * 48 + 1]), 1.0],
-                [float(landmarks[2 * 54]), float(landmarks[2 * 54 + 1]), 1.0],
-            ]
-        )
-    elif landmark_type == 49:
-        left_eye0 = (
-            float(
-                landmarks[2 * 19]
-                + landmarks[2 * 20]
-                + landmarks[2 * 21]
-                + landmarks[2 * 22]
-                + landmarks[2 * 23]
-                + landmarks[2 * 24]
-            )
-            / 6.0
-        )
-        left_eye1 = (
-            float(
-                landmarks[2 * 19 + 1]
-                + landmarks[2 * 20 + 1]
-                + landmarks[2 * 21 + 1]
-                + landmarks[2 * 22 + 1]
-                + landmarks[2 * 23 + 1]
-                + landmarks[2 * 24 + 1]
-            )
-            / 6.0
-        )
-        right_eye0 = (
-            float(
-                landmarks[2 * 25]
-                + landmarks[2 * 26]
-                + landmarks[2 * 27]
-                + landmarks[2 * 28]
-                + landmarks[2 * 29]
-                + landmarks[2 * 30]
-            )
-            / 6.0
-        )
-        right_eye1 = (
-            float(
-                landmarks[2 * 25 + 1]
-                + landmarks[2 * 26 + 1]
-                + landmarks[2 * 27 + 1]
-                + landmarks[2 * 28 + 1]
-                + landmarks[2 * 29 + 1]
-                + landmarks[2 * 30 + 1]
-            )
-            / 6.0
-        )
+    aligned_img, new_landmarks = batch_align_face(
+        img,
+        np.asarray(landmarks)[None],
+        frame_index=[0],
+        landmark_type=landmark_type,
+        box_enlarge=box_enlarge,
+        img_size=img_size,
+    )
+    return (aligned_img, new_landmarks[0])
 
-        mat2 = np.mat(
-            [
-                [left_eye0, left_eye1, 1],
-                [right_eye0, right_eye1, 1],
-                [float(landmarks[2 * 13]), float(landmarks[2 * 13 + 1]), 1.0],
-                [float(landmarks[2 * 31]), float(landmarks[2 * 31 + 1]), 1.0],
-                [float(landmarks[2 * 37]), float(landmarks[2 * 37 + 1]), 1.0],
-            ]
-        )
-    else:
-        raise ValueError("landmark_type must be (68,49).")
 
-    delta_x = right_eye0 - left_eye0
-    delta_y = right_eye1 - left_eye1
+def batch_align_face(
+    frames, landmarks, frame_index=None, landmark_type=68, box_enlarge=2.5, img_size=112
+):
+    """Aligns a batch of faces by their eyes like align_face, computing the affine
+    matrices of every face with array operations and warping all the faces of a frame
+    at once. The frame is expanded rather than copied for each of its faces, so a
+    crowded frame takes no more memory than its aligned faces.
 
-    l = math.sqrt(delta_x**2 + delta_y**2)
-    sin_val = delta_y / l
-    cos_val = delta_x / l
-    mat1 = np.mat([[cos_val, sin_val, 0.0], [-sin_val, cos_val, 0.0], [0.0, 0.0, 1.0]])
+    Args:
+        frames (torch.Tensor): (B, C, H, W) frames containing the faces
+        landmarks (np.ndarray): (N, n_landmarks, 2) or flattened (N, 2 * n_landmarks)
+        landmarks of N faces
+        frame_index (list): index of the frame each face is in; default None means
+        face i is in frame i
+        landmark_type (int): Landmark system (68, 49)
+        box_enlarge (float): relative size of face on the image. Smaller value indicate
+        larger proportion
+        img_size (int): output image size
 
-    mat2 = (mat1 * mat2.T).T
+    Returns:
+        aligned_img (torch.Tensor): (N, C, img_size, img_size) aligned faces
+        new_landmarks (np.ndarray): (N, n_landmarks, 2) aligned landmarks
+    """
 
-    center_x = (max(mat2[:, 0]).item() + min(mat2[:, 0]).item()) / 2.0
-    center_y = (max(mat2[:, 1]).item() + min(mat2[:, 1]).item()) / 2.0
+    landmarks = np.asarray(landmarks)
+    landmarks = landmarks.reshape(len(landmarks), -1, 2)
+    if frame_index is None:
+        frame_index = np.arange(len(landmarks))
 
-    if (max(mat2[:, 0]) - min(mat2[:, 0])) > (max(mat2[:, 1]) - min(mat2[:, 1])):
-        half_size = (
-            0.5 * box_enlarge * (max(mat2[:, 0]).item() - min(mat2[:, 0]).item())
-        )
+    if landmark_type == 68:
+        left_eye, right_eye, anchors = slice(36, 42), slice(42, 48), [30, 48, 54]
+    elif landmark_type == 49:
+        left_eye, right_eye, anchors = slice(19, 25), slice(25, 31), [13, 31, 37]
     else:
-        half_size = (
-            0.5 * box_enlarge * (max(mat2[:, 1]).item() - min(mat2[:, 1]).item())
-        )
+        raise ValueError("landmark_type must be (68,49).")
 
+    # Eye centers and the nose and mouth corners, as homogeneous coordinates
+    left_eye = landmarks[:, left_eye].sum(1).astype(float) / 6.0
+    right_eye = landmarks[:, right_eye].sum(1).astype(float) / 6.0
+    points = np.concatenate(
+        [left_eye[:, None], right_eye[:, None], landmarks[:, anchors].astype(float)], 1
+    )
+    points = np.concatenate([points, np.ones(points.shape[:2] + (1,))], 2)
+
+    # Rotate so the eyes are level
+    delta_x, delta_y = (right_eye - left_eye).T
+    length = np.sqrt(delta_x**2 + delta_y**2)
+    sin_val, cos_val = delta_y / length, delta_x / length
+    rotation = np.zeros((len(landmarks), 3, 3))
+    rotation[:, 0, 0], rotation[:, 0, 1] = cos_val, sin_val
+    rotation[:, 1, 0], rotation[:, 1, 1] = -sin_val, cos_val
+    rotation[:, 2, 2] = 1.0
+    points = points @ rotation.transpose(0, 2, 1)
+
+    # Scale and translate the rotated points to the center of the output image
+    lowest, highest = points[..., :2].min(1), points[..., :2].max(1)
+    center_x, center_y = ((highest + lowest) / 2.0).T
+    extent = highest - lowest
+    half_size = (
+        0.5
+        * box_enlarge
+        * np.where(extent[:, 0] > extent[:, 1], extent[:, 0], extent[:, 1])
+    )
     scale = (img_size - 1) / 2.0 / half_size
 
-    mat3 = np.mat(
-        [
-            [scale, 0.0, scale * (half_size - center_x)],
-            [0.0, scale, scale * (half_size - center_y)],
-            [0.0, 0.0, 1.0],
-        ]
-    )
+    translation = np.zeros((len(landmarks), 3, 3))
+    translation[:, 0, 0], translation[:, 1, 1] = scale, scale
+    translation[:, 0, 2] = scale * (half_size - center_x)
+    translation[:, 1, 2] = scale * (half_size - center_y)
+    translation[:, 2, 2] = 1.0
 
-    mat = mat3 * mat1
-    affine_matrix = torch.tensor(mat[0:2, :]).type(torch.float32).unsqueeze(0)
+    mat = translation @ rotation
+    affine_matrix = torch.tensor(mat[:, 0:2, :]).type(torch.float32)
 
-    # warp_affine expects [batch, channel, height, width]
-    if img.ndim == 3:
-        img = img[None, :]
-
-    aligned_img = warp_affine(
-        img,
-        affine_matrix,
-        (img_size, img_size),
-        mode="bilinear",
-        padding_mode="zeros",
-        align_corners=False,
-        fill_value=(128, 128, 128),
+    affine_matrix = affine_matrix.to(frames.device)
+    frame_index = np.asarray(frame_index)
+    aligned_img = frames.new_empty(
+        (len(landmarks), frames.shape[1], img_size, img_size)
     )
+    for i in np.unique(frame_index):
+        faces = torch.as_tensor(np.flatnonzero(frame_index == i), device=frames.device)
+        aligned_img[faces] = warp_affine(
+            frames[i : i + 1].expand(len(faces), -1, -1, -1),
+            affine_matrix[faces],
+            (img_size, img_size),
+            mode="bilinear",
+            padding_mode="zeros",
+            align_corners=False,
+            fill_value=(128, 128, 128),
+        )
 
-    land_3d = np.ones((len(landmarks) // 2, 3))
-    land_3d[:, 0:2] = np.reshape(np.array(landmarks), (len(landmarks) // 2, 2))
-    mat_land_3d = np.mat(land_3d)
-    new_landmarks = np.array((mat * mat_land_3d.T).T)
-    new_landmarks = np.array(
-        list(zip(new_landmarks[:, 0], new_landmarks[:, 1]))
-    ).astype(int)
+    land_3d = np.concatenate(
+        [landmarks.astype(float), np.ones(landmarks.shape[:2] + (1,))], 2
+    )
+    new_landmarks = (land_3d @ mat.transpose(0, 2, 1))[..., :2].astype(int)
 
     return (aligned_img, new_landmarks)
 
@@ -777,68 +835,180 @@ def mask_image(img, mask):
     #         f"img must be pytorch tensor, not {type(img)} and mask must be np array not {type(mask)}"
     #     )
     return (
-        torch.sgn(torch.tensor(mask).to(torch.float32)).unsqueeze(0).unsqueeze(0) * img
+        torch.sgn(torch.as_tensor(mask, device=img.device).to(torch.float32))
+        .unsqueeze(0)
+        .unsqueeze(0)
+        * img
     )
 
 
 def convert_to_euler(rotvec, is_rotvec=True):
     """
     Converts the rotation vector or matrix (the standard output for head pose models) into euler angles in the form
-    of a ([pitch, roll, yaw]) vector. Adapted from https://github.com/vitoralbiero/img2pose.
+    of a ([pitch, roll, yaw]) vector. Adapted from https://github.com/vitoralbiero/img2pose. Also accepts a batch of
+    rotation vectors [N, 3] or matrices [N, 3, 3], which are all converted at once.
 
     Args:
         rotvec: The rotation vector produced by the headpose model
         is_rotvec:
 
     Returns:
-        np.ndarray: euler angles ([pitch, roll, yaw])
+        np.ndarray: euler angles ([pitch, roll, yaw]), or [N, 3] euler angles for a batch
     """
     if is_rotvec:
         rotvec = Rotation.from_rotvec(rotvec).as_matrix()
-    rot_mat_2 = np.transpose(rotvec)
+    rot_mat_2 = np.swapaxes(rotvec, -1, -2)
     angle = Rotation.from_matrix(rot_mat_2).as_euler("xyz", degrees=True)
+    if angle.ndim == 2:
+        return np.stack([angle[:, 0], -angle[:, 2], -angle[:, 1]], axis=1)
     return [angle[0], -angle[2], -angle[1]]  # pitch, roll, yaw
 
 
-def py_cpu_nms(dets, thresh):
-    """Pure Python NMS baseline
+def nms(boxes, scores, threshold, idxs=None, method="IoU"):
+    """Non-maximum suppression shared by all face detectors. Boxes are suppressed
+    when they overlap a higher scoring box by more than `threshold`. Widths and
+    heights follow the (x2 - x1 + 1) pixel convention of the original Fast R-CNN and
+    MTCNN implementations. When `idxs` is given, NMS runs independently for each
+    index, so all the images of a batch can be processed in a single call.
 
-    # --------------------------------------------------------
-    # Fast R-CNN
-    # Copyright (c) 2015 Microsoft
-    # Licensed under The MIT License [see LICENSE for details]
-    # Written by Ross Girshick
-    # --------------------------------------------------------
+    Args:
+        boxes (torch.Tensor): [N, 4] boxes as (x1, y1, x2, y2)
+        scores (torch.Tensor): [N] box scores
+        threshold (float): overlap above which lower scoring boxes are suppressed
+        idxs (torch.Tensor): [N] group of each box (e.g., image in batch); default None
+        method (str): "IoU" for intersection over union or "Min" for intersection
+        over the smaller box
 
+    Returns:
+        torch.Tensor: indices of kept boxes sorted by decreasing score
     """
 
-    x1 = dets[:, 0]
-    y1 = dets[:, 1]
-    x2 = dets[:, 2]
-    y2 = dets[:, 3]
-    scores = dets[:, 4]
+    if method not in ["IoU", "Min"]:
+        raise ValueError("method must be 'IoU' or 'Min'")
 
-    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-    order = scores.argsort()[::-1]
+    if idxs is None:
+        idxs = torch.zeros(len(boxes), dtype=torch.int64, device=boxes.device)
+    if boxes.numel() == 0:
+        return torch.empty((0,), dtype=torch.int64, device=boxes.device)
 
+    boxes = boxes + torch.tensor([0, 0, 1, 1], dtype=boxes.dtype, device=boxes.device)
+    if method == "IoU":
+        return batched_nms(boxes, scores, idxs, threshold)
+
+    # torchvision only supports IoU, so "Min" computes the pairwise overlaps of each
+    # group at once and only runs the greedy selection in a loop
     keep = []
-    while order.size > 0:
-        i = order[0]
-        keep.append(i)
-        xx1 = np.maximum(x1[i], x1[order[1:]])
-        yy1 = np.maximum(y1[i], y1[order[1:]])
-        xx2 = np.minimum(x2[i], x2[order[1:]])
-        yy2 = np.minimum(y2[i], y2[order[1:]])
+    for group in idxs.unique():
+        inds = torch.where(idxs == group)[0]
+        inds = inds[scores[inds].argsort(descending=True)]
+        group_boxes = boxes[inds]
+        lt = torch.max(group_boxes[:, None, :2], group_boxes[None, :, :2])
+        rb = torch.min(group_boxes[:, None, 2:], group_boxes[None, :, 2:])
+        inter = (rb - lt).clamp(min=0).prod(2)
+        areas = (group_boxes[:, 2:] - group_boxes[:, :2]).prod(1)
+        suppress = inter / torch.min(areas[:, None], areas[None, :]) > threshold
+        suppress = suppress.cpu().numpy()
+
+        suppressed = np.zeros(len(inds), dtype=bool)
+        for i in range(len(inds)):
+            if not suppressed[i]:
+                keep.append(inds[i])
+                suppressed |= suppress[i]
+    keep = torch.stack(keep)
+    return keep[scores[keep].argsort(descending=True)]
+
+
+def decode_detections(
+    loc,
+    conf,
+    priors,
+    variances,
+    image_size,
+    top_k,
+    confidence_threshold,
+    nms_threshold,
+    keep_top_k,
+    detection_threshold,
+    resize=1,
+):
+    """Turn the outputs of a prior box face detector (Retinaface, FaceBoxes) for a
+    batch of images into faces. The top_k priors of each image scoring above
+    confidence_threshold are decoded, NMS runs on all images at once and the
+    keep_top_k best faces of each image scoring above detection_threshold are kept.
+    Everything stays on the device until the final boxes.
 
-        w = np.maximum(0.0, xx2 - xx1 + 1)
-        h = np.maximum(0.0, yy2 - yy1 + 1)
-        inter = w * h
-        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+    Args:
+        loc (torch.Tensor): [batch, num_priors, 4] location predictions
+        conf (torch.Tensor): [batch, num_priors, 2] class scores
+        priors (torch.Tensor): [num_priors, 4] prior boxes in center-offset form
+        variances (list[float]): variances of the prior boxes
+        image_size (tuple): (height, width) of the images
+        top_k (int): number of priors of each image kept before NMS
+        confidence_threshold (float): minimum score of the priors kept before NMS
+        nms_threshold (float): NMS overlap threshold
+        keep_top_k (int): number of faces of each image kept after NMS
+        detection_threshold (float): minimum score of the faces returned
+        resize (float): factor the images were resized by
 
-        inds = np.where(ovr <= thresh)[0]
-        order = order[inds + 1]
+    Returns:
+        list: [x1, y1, x2, y2, score] faces of each image
+    """
 
-    return keep
+    im_height, im_width = image_size
+
+    # ignore low scores and keep top-K before NMS
+    scores = conf[..., 1]
+    top_scores, top_idx = scores.topk(min(top_k, scores.shape[1]), dim=1)
+    keep = top_scores > confidence_threshold
+    batch_idx = torch.arange(scores.shape[0], device=scores.device)
+    batch_idx = batch_idx.unsqueeze(1).expand_as(top_idx)[keep]
+    prior_idx = top_idx[keep]
+    scores = top_scores[keep]
+
+    # decode only the surviving priors
+    boxes = decode(loc[batch_idx, prior_idx], priors[prior_idx], variances)
+    scale = torch.tensor(
+        [im_height, im_width, im_height, im_width],
+        dtype=boxes.dtype,
+        device=boxes.device,
+    )
+    boxes = boxes * scale / resize
+
+    # do NMS for all images at once
+    keep = nms(boxes, scores, nms_threshold, idxs=batch_idx)
+
+    # rescale box size to be proportional to image size
+    scale_x, scale_y = (im_width / im_height, im_height / im_width)
+    boxes = boxes[keep] * torch.tensor(
+        [scale_x, scale_y, scale_x, scale_y], device=boxes.device
+    )
+    dets = torch.cat([boxes, scores[keep].unsqueeze(1)], dim=1).cpu().tolist()
+
+    # keep top-K faster NMS and filter using detection_threshold
+    total_boxes = [[] for _ in range(loc.shape[0])]
+    n_kept = [0] * loc.shape[0]
+    for i, det in zip(batch_idx[keep].tolist(), dets):
+        n_kept[i] += 1
+        if n_kept[i] <= keep_top_k and det[4] > detection_threshold:
+            total_boxes[i].append(det)
+
+    return total_boxes
+
+
+def py_cpu_nms(dets, thresh):
+    """NMS on a numpy array of detections [N, 5] as (x1, y1, x2, y2, score). Wrapper
+    around nms() kept for backwards compatibility.
+
+    Args:
+        dets (np.ndarray): detections
+        thresh (float): IoU threshold
+
+    Returns:
+        list: indices of kept detections sorted by decreasing score
+    """
+
+    dets = torch.as_tensor(np.asarray(dets))
+    return nms(dets[:, :4], dets[:, 4], thresh).tolist()
 
 
 def decode(loc, priors, variances):
@@ -849,7 +1019,7 @@ def decode(loc, priors, variances):
 
     Args:
         loc (tensor): location predictions for loc layers,
-            Shape: [num_priors,4]
+            Shape: [num_priors,4] or [batch,num_priors,4]
         priors (tensor): Prior boxes in center-offset form.
             Shape: [num_priors,4].
         variances: (list[float]) Variances of priorboxes
@@ -860,13 +1030,13 @@ def decode(loc, priors, variances):
 
     boxes = torch.cat(
         (
-            priors[:, :2] + loc[:, :2] * variances[0] * priors[:, 2:],
-            priors[:, 2:] * torch.exp(loc[:, 2:] * variances[1]),
+            priors[..., :2] + loc[..., :2] * variances[0] * priors[..., 2:],
+            priors[..., 2:] * torch.exp(loc[..., 2:] * variances[1]),
         ),
-        1,
+        -1,
     )
-    boxes[:, :2] -= boxes[:, 2:] / 2
-    boxes[:, 2:] += boxes[:, :2]
+    boxes[..., :2] -= boxes[..., 2:] / 2
+    boxes[..., 2:] += boxes[..., :2]
     return boxes
 
 
@@ -1079,3 +1249,87 @@ class HOGLayer(torch.nn.Module):
                             i, o, r, c
                         ].numpy()
         return hog_image
+
+
+def batch_hog(images, orientations=8, pixels_per_cell=8, cells_per_block=2):
+    """Computes HOG features of a batch of images at once. Unlike HOGLayer, this
+    reproduces skimage.feature.hog(image, orientations, (pixels_per_cell,
+    pixels_per_cell), (cells_per_block, cells_per_block), block_norm="L2-Hys",
+    channel_axis=-1) for each image, which is what the AU and emotion models were
+    trained on: central difference gradients of the channel with the largest gradient
+    magnitude, hard orientation binning over [0, 180) degrees and L2-Hys normalized
+    blocks.
+
+    Args:
+        images (torch.Tensor): (N, C, H, W) images, e.g. uint8 RGB faces
+        orientations (int): number of orientation bins
+        pixels_per_cell (int): size (in pixels) of a square cell
+        cells_per_block (int): number of cells along each side of a block
+
+    Returns:
+        torch.Tensor: (N, n_features) float64 HOG features
+    """
+
+    # skimage computes everything in double precision, which mps does not support
+    if images.device.type == "mps":
+        images = images.cpu()
+    images = images.to(torch.float64)
+
+    g_row = torch.zeros_like(images)
+    g_row[..., 1:-1, :] = images[..., 2:, :] - images[..., :-2, :]
+    g_col = torch.zeros_like(images)
+    g_col[..., :, 1:-1] = images[..., :, 2:] - images[..., :, :-2]
+
+    # For each pixel keep the channel with the largest gradient magnitude
+    channel = (g_row**2 + g_col**2).argmax(1, keepdim=True)
+    g_row = g_row.gather(1, channel)[:, 0]
+    g_col = g_col.gather(1, channel)[:, 0]
+
+    # Pixels are only counted in complete cells
+    n_cells_row = images.shape[-2] // pixels_per_cell
+    n_cells_col = images.shape[-1] // pixels_per_cell
+    g_row = g_row[:, : n_cells_row * pixels_per_cell, : n_cells_col * pixels_per_cell]
+    g_col = g_col[:, : n_cells_row * pixels_per_cell, : n_cells_col * pixels_per_cell]
+
+    magnitude = torch.hypot(g_col, g_row)
+    orientation = torch.rad2deg(torch.atan2(g_row, g_col)) % 180
+    boundaries = (
+        180.0
+        / orientations
+        * torch.arange(1, orientations + 1, dtype=torch.float64, device=images.device)
+    )
+    # Angles that round to 180 fall outside of every bin, as in skimage
+    bins = torch.bucketize(orientation, boundaries, right=True)
+
+    # Accumulate the magnitudes of every (image, cell, orientation) in one pass
+    rows = torch.arange(g_row.shape[1], device=images.device) // pixels_per_cell
+    cols = torch.arange(g_row.shape[2], device=images.device) // pixels_per_cell
+    cells = rows[:, None] * n_cells_col + cols[None, :]
+    n_cells = n_cells_row * n_cells_col
+    index = torch.arange(len(images), device=images.device)[:, None, None] * n_cells
+    index = (index + cells) * (orientations + 1) + bins
+    histogram = torch.bincount(
+        index.flatten(),
+        weights=magnitude.flatten(),
+        minlength=len(images) * n_cells * (orientations + 1),
+    )
+    histogram = histogram.reshape(
+        len(images), n_cells_row, n_cells_col, orientations + 1
+    )[..., :orientations] / (pixels_per_cell**2)
+
+    if n_cells_row < cells_per_block or n_cells_col < cells_per_block:
+        raise ValueError(
+            "The input image is too small given the values of pixels_per_cell and "
+            f"cells_per_block. It should have at least: "
+            f"{cells_per_block * pixels_per_cell} rows and cols."
+        )
+
+    # (N, n_blocks_row, n_blocks_col, cells_per_block, cells_per_block, orientations)
+    blocks = histogram.unfold(1, cells_per_block, 1).unfold(2, cells_per_block, 1)
+    blocks = blocks.permute(0, 1, 2, 4, 5, 3).flatten(3)
+
+    eps = 1e-5
+    blocks = blocks / torch.sqrt((blocks**2).sum(-1, keepdim=True) + eps**2)
+    blocks = blocks.clamp(max=0.2)
+    blocks = blocks / torch.sqrt((blocks**2).sum(-1, keepdim=True) + eps**2)
+    return blocks.flatten(1)
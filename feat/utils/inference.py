@@ -0,0 +1,163 @@
+"""
+Feat utility and helper functions to prepare trained CNN models for faster inference.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import torch
+import torch.nn as nn
+from feat.version import __version__
+
+__all__ = ["fuse_conv_bn", "ChannelsLast", "prepare_for_inference", "TracedModelCache"]
+
+
+def fuse_conv_bn(model):
+    """Fold every BatchNorm layer that directly follows a convolution into that
+    convolution's weights and bias. The model is traced with torch.fx; a BatchNorm is
+    only folded when the convolution's output is not used anywhere else. Models that
+    cannot be traced are returned unchanged.
+
+    Args:
+        model (torch.nn.Module): model in eval mode
+
+    Returns:
+        torch.nn.Module: model with the same outputs and fewer layers
+    """
+
+    from torch.fx.experimental.optimization import fuse
+
+    try:
+        return fuse(model.eval())
+    except Exception as e:
+        logging.info(
+            f"could not fuse {model.__class__.__name__}: {type(e).__name__}: {e}"
+        )
+        return model
+
+
+class ChannelsLast(nn.Module):
+    """Runs a model in the channels_last memory format. The model's weights are
+    converted once and 4D inputs are converted on every call, which lets convolutions
+    use the faster NHWC kernels of most CPU and CUDA backends.
+
+    Args:
+        model (torch.nn.Module): model to wrap
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x, *args, **kwargs):
+        if x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.model(x, *args, **kwargs)
+
+
+def prepare_for_inference(model, channels_last=True):
+    """Prepare a trained CNN for inference: fold BatchNorm layers into the preceding
+    convolutions and optionally switch to the channels_last memory format.
+
+    Args:
+        model (torch.nn.Module): model in eval mode
+        channels_last (bool): run the model in the channels_last memory format. Not
+        supported on mps.
+
+    Returns:
+        torch.nn.Module: prepared model in eval mode
+    """
+
+    model = fuse_conv_bn(model)
+    if channels_last:
+        model = ChannelsLast(model)
+    return model.eval()
+
+
+class TracedModelCache:
+    """On-disk cache of TorchScript versions of prepared models, used by Detector when
+    a `model_cache_dir` is given. Each model is traced and frozen once and stored under
+    a key made of its name, the path, size and modification time of its weight files,
+    the py-feat and torch versions and the options it was built and prepared with, so
+    later processes load the compiled model instead of preparing it again. The py-feat
+    version is part of the key because traced models contain the forward code of the
+    py-feat version that traced them.
+
+    Args:
+        cache_dir (str): directory to store models in; created if it doesn't exist
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(name, weight_files, **config):
+        """Hash a model name together with the path, size and modification time of its
+        weight files, the py-feat and torch versions and the options it is built and
+        prepared with. Only the files' metadata is read, so computing a key is cheap.
+
+        Args:
+            name (str): name of the model, e.g., "retinaface"
+            weight_files (list): paths of the files the model's weights are loaded from
+            **config: construction and preparation options, e.g., quantize=True
+
+        Returns:
+            str: hex digest
+        """
+        files = []
+        for path in weight_files:
+            stat = os.stat(path)
+            files.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        return hashlib.sha1(
+            repr(
+                (name, files, __version__, torch.__version__, sorted(config.items()))
+            ).encode()
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def load(self, key, device="cpu"):
+        """Load a model from the cache
+
+        Args:
+            key (str): output of key()
+            device (torch.device): device to load the model on
+
+        Returns:
+            torch.jit.ScriptModule or None: cached model, or None if it isn't cached
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        return torch.jit.load(path, map_location=device)
+
+    def save(self, key, model, example_inputs):
+        """Trace and freeze a model and save it in the cache. Models that can't be
+        traced are returned unchanged and aren't cached.
+
+        Args:
+            key (str): output of key()
+            model (torch.nn.Module): prepared model in eval mode
+            example_inputs (torch.Tensor): input to trace the model with
+
+        Returns:
+            torch.jit.ScriptModule: traced model
+        """
+        try:
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(model.eval(), example_inputs))
+        except Exception as e:
+            logging.info(
+                f"could not trace {model.__class__.__name__}: {type(e).__name__}: {e}"
+            )
+            return model
+
+        # Write then rename so concurrent workers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            torch.jit.save(traced, f)
+        os.replace(tmp_path, self._path(key))
+        return traced
@@ -4,6 +4,10 @@ Feat utility and helper functions for inputting and outputting data.
 
 import os
 import contextlib
+import hashlib
+import pickle
+import tempfile
+import numpy as np
 import pandas as pd
 import feat
 from feat.utils import (
@@ -27,6 +31,7 @@ __all__ = [
     "validate_input",
     "download_url",
     "read_openface",
+    "StageMemo",
 ]
 
 
@@ -199,3 +204,123 @@ def read_openface(openfacefile, features=None):
     )
     fex["input"] = openfacefile
     return fex
+
+
+class StageMemo:
+    """On-disk store of per-frame detector stage outputs, used by Detector.detect_image()
+    and Detector.detect_video() when a `memo_dir` is given. Each entry is keyed by a
+    hash of the frame contents and a hash of the stage's configuration chained with
+    the frame's key of the stage it depends on, so changing e.g. the au_model still
+    reuses the stored face and landmark detections, and entries don't depend on which
+    other frames were in the same batch.
+
+    Args:
+        memo_dir (str): directory to store outputs in; created if it doesn't exist
+    """
+
+    def __init__(self, memo_dir):
+        self.memo_dir = memo_dir
+        os.makedirs(memo_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_frames(frames):
+        """Hash the contents of each frame in a batch
+
+        Args:
+            frames (torch.Tensor): batch of frames [batch, channels, height, width]
+
+        Returns:
+            list: hex digest for each frame
+        """
+        keys = []
+        for frame in frames:
+            frame = frame.detach().cpu().contiguous().numpy()
+            digest = hashlib.sha1(f"{frame.shape}{frame.dtype}".encode())
+            digest.update(frame.tobytes())
+            keys.append(digest.hexdigest())
+        return keys
+
+    @staticmethod
+    def hash_detections(detections):
+        """Hash the faces or landmarks of each frame that didn't come from the memo
+        store (precomputed or tracked), for use as the upstream keys of the stages that
+        depend on them
+
+        Args:
+            detections (list): list of lists of faces or landmarks for each frame
+
+        Returns:
+            list: hex digest for each frame
+        """
+        keys = []
+        for frame in detections:
+            digest = hashlib.sha1(f"detections{len(frame)}".encode())
+            for detection in frame:
+                detection = np.ascontiguousarray(detection, dtype=np.float64)
+                digest.update(f"{detection.shape}".encode())
+                digest.update(detection.tobytes())
+            keys.append(digest.hexdigest())
+        return keys
+
+    @staticmethod
+    def stage_key(stage, *config):
+        """Hash a stage name together with its model, parameters and upstream key
+
+        Args:
+            stage (str): name of the stage, e.g., "faces"
+            *config: model name, parameters and upstream stage keys
+
+        Returns:
+            str: hex digest
+        """
+        config = [
+            sorted(item.items()) if isinstance(item, dict) else item for item in config
+        ]
+        return hashlib.sha1(repr((stage, config)).encode()).hexdigest()
+
+    def _path(self, frame_key, stage_key):
+        return os.path.join(self.memo_dir, stage_key[:16], f"{frame_key}.pkl")
+
+    def load(self, frame_keys, stage_keys):
+        """Load a stage's output for a batch of frames
+
+        Args:
+            frame_keys (list): output of hash_frames()
+            stage_keys (list): output of stage_key() for each frame
+
+        Returns:
+            list, dict or None: output of the stage for the batch, or None if any frame
+            is missing from the store
+        """
+        outputs = []
+        for frame_key, stage_key in zip(frame_keys, stage_keys):
+            path = self._path(frame_key, stage_key)
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                outputs.append(pickle.load(f))
+
+        if isinstance(outputs[0], dict):
+            return {key: [out[key] for out in outputs] for key in outputs[0]}
+        return outputs
+
+    def save(self, frame_keys, stage_keys, output):
+        """Save a stage's output for a batch of frames
+
+        Args:
+            frame_keys (list): output of hash_frames()
+            stage_keys (list): output of stage_key() for each frame
+            output (list or dict): per-frame list or dict of per-frame lists
+        """
+        for i, (frame_key, stage_key) in enumerate(zip(frame_keys, stage_keys)):
+            if isinstance(output, dict):
+                frame_output = {key: value[i] for key, value in output.items()}
+            else:
+                frame_output = output[i]
+            path = self._path(frame_key, stage_key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so concurrent workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(frame_output, f)
+            os.replace(tmp_path, path)
@@ -0,0 +1,86 @@
+"""
+Feat utility and helper functions for int8 quantization of the CNN models used on CPU.
+"""
+
+import os
+import torch
+from torchvision.io import read_image, ImageReadMode
+from torchvision.transforms import Grayscale, Resize, CenterCrop
+from feat.utils.io import get_test_data_path
+
+__all__ = ["CALIBRATION_IMAGES", "calibration_faces", "quantize_model"]
+
+# Bundled close-up face images used to calibrate the activation ranges of quantized
+# models
+CALIBRATION_IMAGES = [
+    "0-f1-su-ph.jpg",
+    "0-f15-hao-ph.jpg",
+    "15-f13-anc-ph.jpg",
+    "45-m7-di-ph.jpg",
+    "single_face.jpg",
+]
+
+
+def calibration_faces(face_size, grayscale=False):
+    """Load the bundled calibration faces, preprocessed like the faces a model sees.
+    Each image is center cropped to a square, resized and scaled to 0-1, and is
+    included along with its horizontal flip.
+
+    Args:
+        face_size (int): size of the square faces
+        grayscale (bool): convert faces to 3 channel grayscale
+
+    Returns:
+        torch.Tensor: (N,3,face_size,face_size) faces
+    """
+
+    faces = []
+    for image in CALIBRATION_IMAGES:
+        face = read_image(
+            os.path.join(get_test_data_path(), image), mode=ImageReadMode.RGB
+        )
+        face = CenterCrop(min(face.shape[1:]))(face)
+        face = Resize((face_size, face_size), antialias=True)(face.unsqueeze(0)) / 255
+        faces.append(Grayscale(3)(face) if grayscale else face)
+    faces = torch.cat(faces)
+    return torch.cat([faces, faces.flip(-1)])
+
+
+def quantize_model(model, calibration_data, backend=None):
+    """Statically quantize the weights and activations of a model to int8 for CPU
+    inference. The model is traced with torch.fx so that residual additions and
+    masking multiplications are quantized along with convolution and linear layers,
+    and activation ranges are calibrated by running calibration_data through it.
+
+    Args:
+        model (torch.nn.Module): float model in eval mode, on cpu
+        calibration_data (torch.Tensor): batch of inputs representative of the data
+        the model is used on
+        backend (str): quantized engine to target; defaults to the current
+        torch.backends.quantized.engine. The engine is only switched while the model
+        is quantized and restored afterwards
+
+    Returns:
+        torch.fx.GraphModule: quantized model
+    """
+
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    if next(model.parameters()).device.type != "cpu":
+        raise ValueError("Quantized models are only supported on cpu")
+    previous_backend = torch.backends.quantized.engine
+    if backend is None:
+        backend = previous_backend
+
+    torch.backends.quantized.engine = backend
+    try:
+        model = model.eval()
+        prepared = prepare_fx(
+            model, get_default_qconfig_mapping(backend), (calibration_data[:1],)
+        )
+        with torch.no_grad():
+            prepared(calibration_data)
+        return convert_fx(prepared).eval()
+    finally:
+        torch.backends.quantized.engine = previous_backend
@@ -8,7 +8,14 @@ from scipy.integrate import simps
 import torch
 from torch.nn.functional import cosine_similarity
 
-__all__ = ["wavelet", "calc_hist_auc", "softmax", "cluster_identities"]
+__all__ = [
+    "wavelet",
+    "calc_hist_auc",
+    "softmax",
+    "cluster_identities",
+    "StackedProjection",
+    "StackedLinearClassifier",
+]
 
 
 def wavelet(freq, num_cyc=3, sampling_freq=30.0):
@@ -86,6 +93,119 @@ def softmax(x):
     return 1.0 / (1 + 10.0 ** -(x))
 
 
+class StackedProjection(object):
+    """Applies several fitted sklearn StandardScaler + PCA pairs to the same features
+    with a single matrix product. Each pair is folded into one affine map at
+    construction, and the maps are stacked column-wise.
+
+    Args:
+        pairs (dict): name -> (scaler, pca) of the projections to stack
+    """
+
+    def __init__(self, pairs):
+        self.pairs = dict(pairs)
+        self.slices = {}
+        weights, biases, start = [], [], 0
+        for name, (scaler, pca) in self.pairs.items():
+            weight, bias = self.fuse(scaler, pca)
+            weights.append(weight)
+            biases.append(bias)
+            self.slices[name] = slice(start, start + len(bias))
+            start += len(bias)
+        self.weight = np.concatenate(weights, axis=1)
+        self.bias = np.concatenate(biases)
+
+    @staticmethod
+    def fuse(scaler, pca):
+        """Fold a StandardScaler followed by a PCA into a single affine map
+
+        Args:
+            scaler (StandardScaler): fitted scaler
+            pca (PCA): fitted PCA
+
+        Returns:
+            tuple: (n_features, n_components) weight and (n_components,) bias so that
+            pca.transform(scaler.transform(X)) == X @ weight + bias
+        """
+        components = pca.components_
+        if pca.whiten:
+            components = components / np.sqrt(pca.explained_variance_)[:, None]
+
+        scale = scaler.scale_ if scaler.scale_ is not None else 1.0
+        mean = scaler.mean_ if scaler.mean_ is not None else 0.0
+        weight = (components / scale).T
+        bias = -(((mean / scale) + pca.mean_) @ components.T)
+        return weight, bias
+
+    def __call__(self, X):
+        """Project features with every stacked scaler + PCA pair
+
+        Args:
+            X (np.ndarray): (n_samples, n_features) features
+
+        Returns:
+            dict: name -> (n_samples, n_components) projected features
+        """
+        projected = X @ self.weight + self.bias
+        return {name: projected[:, columns] for name, columns in self.slices.items()}
+
+
+class StackedLinearClassifier(object):
+    """Evaluates several fitted binary linear sklearn classifiers (e.g. LinearSVC) with a
+    single matrix product. Each classifier can use its own subset of columns of a
+    combined feature matrix; its coefficients are scattered into one zero padded
+    coefficient matrix at construction.
+
+    Args:
+        classifiers (list): fitted binary classifiers with coef_, intercept_ and classes_
+        feature_columns (list): column indices of the combined feature matrix used by
+        each classifier, in the order of its coefficients; default None means every
+        classifier uses all columns
+    """
+
+    def __init__(self, classifiers, feature_columns=None):
+        if feature_columns is None:
+            feature_columns = [
+                np.arange(classifier.coef_.shape[1]) for classifier in classifiers
+            ]
+        n_features = max(int(np.max(columns)) for columns in feature_columns) + 1
+
+        self.coef = np.zeros((n_features, len(classifiers)))
+        self.intercept = np.zeros(len(classifiers))
+        self.classes = np.zeros(
+            (len(classifiers), 2), dtype=classifiers[0].classes_.dtype
+        )
+        for i, (classifier, columns) in enumerate(zip(classifiers, feature_columns)):
+            if classifier.coef_.shape[0] != 1:
+                raise ValueError("only binary linear classifiers can be stacked")
+            self.coef[columns, i] = classifier.coef_[0]
+            self.intercept[i] = np.ravel(classifier.intercept_)[0]
+            self.classes[i] = classifier.classes_
+
+    def decision_function(self, X):
+        """Signed distance of every sample to every classifier's hyperplane
+
+        Args:
+            X (np.ndarray): (n_samples, n_features) combined features
+
+        Returns:
+            np.ndarray: (n_samples, n_classifiers) scores
+        """
+        return X @ self.coef + self.intercept
+
+    def predict(self, X):
+        """Predict the class of every sample for every classifier
+
+        Args:
+            X (np.ndarray): (n_samples, n_features) combined features
+
+        Returns:
+            np.ndarray: (n_samples, n_classifiers) predicted classes
+        """
+        positive = self.decision_function(X) > 0
+        return np.where(positive, self.classes[:, 1], self.classes[:, 0])
+
+
 def cluster_identities(face_embeddings, threshold=0.8):
     """Function to cluster face identities based on cosine similarity of embeddings
 